@@ -4,24 +4,111 @@
 Reddit problem with bayes modeled link and simple user.
 """
 
-from .comm import Vote, VoteDir
-from .bayesobj import BLink, BUser
-from .pool import cfg_pool, get_pool
-
-
-def vote(user_id: int, link_id: int, dir_: VoteDir):
-    """User vote a link"""
-    user = get_pool().get_user(user_id)
-    link = get_pool().get_link(link_id)
-    # Link quality before this vote
-    lq_b4_new_vote = link.quality
-    new_vote = Vote(user, dir_)
-    link.add_vote(new_vote)
+import functools
+from typing import Iterable, Callable
+
+from .comm import Vote, VoteDir, Link
+from .bayesobj import BLink, BUser, BetaLink, UserReliability, GridConfig, DEFAULT_GRID
+from .pool import ResourcePool
+from .engine import Engine
+
+
+def commit_judged_votes(link: Link, votes: list[Vote]) -> list[tuple[Vote, float, bool | None]]:
+    """
+    Commit votes to a link, and judge the last vote of each user with the link quality without it.
+    The judgement is kept in the committed vote (Vote.reliable), so it can be removed from the user later.
+    Call it under the link lock.
+    :return: [(last vote of a user, link quality without it, evidence of the vote it replaced)],
+             to update user reliabilities with.
+    """
+    # {user id: last vote of the user}, earlier votes of the user are replaced in the same commit
+    last = {v.user.id_: v for v in votes}
+    replaced = {}
+    for user_id, v in last.items():
+        old = link.get_vote(v.user)
+        replaced[user_id] = None if old is None else old.reliable
+    link.add_votes(votes)
     link.commit_vote()
 
-    user.update_reliability(new_vote, lq_b4_new_vote)
+    judged = []
+    for user_id, v in last.items():
+        lq = link.quality_without(v)
+        v.reliable = UserReliability.judge(v, lq)
+        link.annotate_vote(v)
+        judged.append((v, lq, replaced[user_id]))
+    return judged
+
+
+class BayesEngine(Engine):
+    """Bayes modeled users and links"""
+    user_constr = BUser
+    link_constr = BLink
+
+    def __init__(self, columnar_votes: bool = False, concurrent: bool = False, pool: ResourcePool | None = None,
+                 grid: GridConfig = DEFAULT_GRID):
+        """
+        :param grid: hypothesis grid of user and link posteriors
+        """
+        self.user_constr = functools.partial(BUser, grid=grid)
+        self.link_constr = self._grid_link_constr(grid)
+        super().__init__(columnar_votes=columnar_votes, concurrent=concurrent, pool=pool)
+
+    @staticmethod
+    def _grid_link_constr(grid: GridConfig) -> Callable[[int], Link]:
+        return functools.partial(BLink, grid=grid)
+
+    def vote(self, user_id: int, link_id: int, dir_: VoteDir):
+        """User vote a link"""
+        user = self._pool.get_user(user_id)
+        link = self._pool.get_link(link_id)
+        new_vote = Vote(user, dir_)
+        with link.lock:
+            # Link quality before this vote, without the earlier vote of the user it replaces
+            old_vote = link.get_vote(user)
+            lq_b4_new_vote = link.quality if old_vote is None else link.quality_without(old_vote)
+            # Kept in the committed vote, its evidence is removed when it is replaced or retracted
+            new_vote.reliable = UserReliability.judge(new_vote, lq_b4_new_vote)
+            link.add_vote(new_vote)
+            link.commit_vote()
+
+        with user.lock:
+            user.update_reliability(new_vote, lq_b4_new_vote, None if old_vote is None else old_vote.reliable)
+
+    def vote_many(self, votes: Iterable[tuple[int, int, VoteDir]]):
+        """
+        Users vote links in a batch.
+        Votes of a link are committed at once, then user reliabilities are updated.
+        The link quality used for a vote is the quality with only this vote left out,
+        because the quality before each single vote is not kept in a batch.
+        Of votes of a user for the same link, only the last one counts.
+        :param votes: votes in [(user id, link id, vote dir)]
+        """
+        # [(vote, link quality without the vote, evidence of the vote it replaced)]
+        committed = []
+        for link, link_votes in self._pool.group_votes(votes):
+            with link.lock:
+                committed.extend(commit_judged_votes(link, link_votes))
+
+        for v, lq, replaced in committed:
+            with v.user.lock:
+                v.user.update_reliability(v, lq, replaced)
+
+    def retract_vote(self, user_id: int, link_id: int) -> Vote | None:
+        """User retract the vote of a link, evidence of the vote is removed from the user reliability"""
+        vote = super().retract_vote(user_id, link_id)
+        if vote is not None:
+            with vote.user.lock:
+                vote.user.retract_reliability(vote.reliable)
+        return vote
 
 
+class BayesBetaEngine(BayesEngine):
+    """
+    Bayes modeled users, and links approximated by Beta distributions, see BetaLink.
+    grid applies to users only, links are always on the default grid.
+    """
+    link_constr = BetaLink
 
-# Use simple link constructor to create new links
-cfg_pool(BUser, BLink)
+    @staticmethod
+    def _grid_link_constr(grid: GridConfig) -> Callable[[int], Link]:
+        return BetaLink
@@ -4,10 +4,14 @@
 Reddit problem with bayes modeled link and simple user.
 """
 
+import functools
+from typing import Iterable
+
 from .comm import Vote, VoteDir, Link, User
 from .simpleobj import SUser
-from .bayesobj import BLink
-from .pool import cfg_pool, get_pool
+from .bayesobj import BLink, GridConfig, DEFAULT_GRID
+from .pool import ResourcePool
+from .engine import Engine
 
 
 def _is_user_vote_reliable(u: User, link: Link) -> bool | None:
@@ -49,48 +53,86 @@ def _is_user_vote_reliable(u: User, link: Link) -> bool | None:
             return False
 
 
-def _update_suser_reliability(u: User):
-    link_it = get_pool().links
-
-    reli_vote_cnt = 0
-    unreli_vote_cnt = 0
-
-    for link in link_it:
-        reli = _is_user_vote_reliable(u, link)
-        if reli is None:
-            continue
-
-        if reli:
-            reli_vote_cnt += 1
-        else:
-            unreli_vote_cnt += 1
-
-    tot_vote_cnt = reli_vote_cnt + unreli_vote_cnt
-    assert tot_vote_cnt > 0
-    u.reliability = reli_vote_cnt / tot_vote_cnt
-
-
-def _update_vote_suser_reliabilities(link: Link):
-    """Update users who has vote for given link"""
-    # Users to update {user id: User}
-    users = {}
-    for v in link.votes:
-        if v.user.id_ not in users:
-            users[v.user.id_] = v.user
-
-    for u in users.values():
-        _update_suser_reliability(u)
-
-
-def vote(user_id: int, link_id: int, dir_: VoteDir):
-    """User vote a link"""
-    user = get_pool().get_user(user_id)
-    link = get_pool().get_link(link_id)
-    vote_ = Vote(user, dir_)
-    link.add_vote(vote_)
-    link.commit_vote()
-    _update_vote_suser_reliabilities(link)
-
-
-# Use simple link constructor to create new links
-cfg_pool(SUser, BLink)
+class BayesSUserEngine(Engine):
+    """Bayes modeled links and simple users"""
+    user_constr = SUser
+    link_constr = BLink
+
+    def __init__(self, columnar_votes: bool = False, concurrent: bool = False, pool: ResourcePool | None = None,
+                 grid: GridConfig = DEFAULT_GRID):
+        """
+        :param grid: hypothesis grid of link posteriors
+        """
+        self.link_constr = functools.partial(BLink, grid=grid)
+        super().__init__(columnar_votes=columnar_votes, concurrent=concurrent, pool=pool)
+
+    def _update_suser_reliability(self, u: User):
+        # Other threads may update this user too
+        with u.lock:
+            reli_vote_cnt = 0
+            unreli_vote_cnt = 0
+
+            # Only links this user has voted
+            for lv in self._pool.user_votes(u):
+                reli = _is_user_vote_reliable(u, lv.link)
+                if reli is None:
+                    continue
+
+                if reli:
+                    reli_vote_cnt += 1
+                else:
+                    unreli_vote_cnt += 1
+
+            tot_vote_cnt = reli_vote_cnt + unreli_vote_cnt
+            if tot_vote_cnt == 0:
+                # No vote of this user can be judged, e.g. all voted links are tied,
+                # back to the prior, so reliability depends only on current votes
+                u.reliability = SUser.PRIOR_RELIABILITY
+                return
+            u.reliability = reli_vote_cnt / tot_vote_cnt
+
+    def _update_vote_suser_reliabilities(self, links: Iterable[Link]):
+        """Update users who has vote for given links"""
+        # Users to update {user id: User}
+        users = {}
+        for link in links:
+            with link.lock:
+                for v in link.votes:
+                    if v.user.id_ not in users:
+                        users[v.user.id_] = v.user
+
+        for u in users.values():
+            self._update_suser_reliability(u)
+
+    def vote(self, user_id: int, link_id: int, dir_: VoteDir):
+        """User vote a link"""
+        user = self._pool.get_user(user_id)
+        link = self._pool.get_link(link_id)
+        vote_ = Vote(user, dir_)
+        with link.lock:
+            link.add_vote(vote_)
+            link.commit_vote()
+        self._update_vote_suser_reliabilities([link])
+
+    def vote_many(self, votes: Iterable[tuple[int, int, VoteDir]]):
+        """
+        Users vote links in a batch.
+        Votes of a link are committed at once, then each affected user is updated once.
+        :param votes: votes in [(user id, link id, vote dir)]
+        """
+        links = []
+        for link, link_votes in self._pool.group_votes(votes):
+            with link.lock:
+                link.add_votes(link_votes)
+                link.commit_vote()
+            links.append(link)
+
+        self._update_vote_suser_reliabilities(links)
+
+    def retract_vote(self, user_id: int, link_id: int) -> Vote | None:
+        """User retract the vote of a link, the user and other voters of the link are updated"""
+        vote = super().retract_vote(user_id, link_id)
+        if vote is not None:
+            self._update_suser_reliability(vote.user)
+            self._update_vote_suser_reliabilities([self._pool.get_link(link_id)])
+        return vote
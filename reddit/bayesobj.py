@@ -4,28 +4,414 @@
 Reddit problem user / link bayes model.
 """
 
+import functools
+from dataclasses import dataclass
+
 import numpy as np
 from thinkbayes import Suite
 
 from .comm import Vote, VoteDir, Link, User
 
 
-class UserReliability(Suite):
+@dataclass(frozen=True)
+class GridConfig:
+    """Hypothesis grid of GridSuite"""
+    # Number of hypotheses, evenly spaced in (0, 1]
+    size: int = 100
+    # dtype of probabilities, e.g. np.float32 for half the memory
+    dtype: type = np.float64
+    # Drop hypotheses whose probability falls below this after an update, 0 to keep all
+    prune_eps: float = 0.0
+
+    @property
+    def hypos(self) -> np.ndarray:
+        """Hypothesis grid, shared by all suites of the same size, read only"""
+        return _grid_hypos(self.size)
+
+
+@functools.cache
+def _grid_hypos(size: int) -> np.ndarray:
+    assert size > 0
+    xs = np.linspace(start=1.0 / size, stop=1.0, num=size)
+    xs.flags.writeable = False
+    return xs
+
+
+DEFAULT_GRID = GridConfig()
+_GRID = DEFAULT_GRID.hypos
+
+# Likelihoods are clipped to this in log space, so a downdate never subtracts log(0)
+_MIN_LIKE = 1e-300
+# A product of likelihoods is rescaled to max 1 when its max falls below this
+_RESCALE_BELOW = 1e-100
+
+
+def log_likes(likes: np.ndarray) -> np.ndarray:
+    """Log of likelihoods as added to log posteriors, clipped so they can be subtracted again"""
+    return np.log(np.maximum(likes, _MIN_LIKE))
+
+
+def _reversibility(vote: Vote) -> float:
+    """Reversibility a vote was committed with, the current one of its user if it is not recorded"""
+    return vote.user.reversibility if vote.rev is None else vote.rev
+
+
+class GridSuite(Suite):
     """
-    User reliability modeled by Bayes model.
+    Suite with hypotheses on a fixed grid in (0, 1].
+
+    Hypotheses and probabilities are kept in numpy arrays,
+    and Likelihood is called once with the whole hypothesis array,
+    so an update is a few array operations instead of one Python call per hypothesis.
+
+    With pruning, hypotheses with negligible probability are dropped for good,
+    a concentrated posterior keeps only a few live hypotheses, which makes updates faster.
+    hypos and probs are of live hypotheses, while grid_hypos and grid_probs are on the whole grid.
+
+    A suite with _LOG_POSTERIOR keeps a log posterior instead of probabilities,
+    so data can be removed by Downdate in O(grid), without replaying other data.
+    Probabilities are derived from it when they are read, only one array is kept either way.
+    Pruned hypotheses do not come back after a downdate.
+
+    The dict `d` of the base class is built from the arrays when it is read (e.g. by thinkplot),
+    it is a snapshot, modifying it does not change this suite.
     """
-    def __init__(self, name: str):
-        super().__init__(np.linspace(start=1.0 / 100, stop=1.0, num=100, dtype=float), name=name)
+    # Whether to keep a log posterior for Downdate, set by child classes
+    _LOG_POSTERIOR = False
+
+    def __init__(self, name: str, grid: GridConfig = DEFAULT_GRID):
+        super().__init__(name=name)
+        assert 0 <= grid.prune_eps < 1
+        self._prune_eps = grid.prune_eps
+        self._grid_xs = grid.hypos
+        # Live hypotheses, and their indexes in the grid, None if none is pruned
+        self._xs = self._grid_xs
+        self._idx = None
+        # Probabilities of live hypotheses,
+        # or with _LOG_POSTERIOR their unnormalized logs, shifted to max 0 by updates
+        size = len(self._xs)
+        self._post = (np.zeros(size, dtype=grid.dtype) if self._LOG_POSTERIOR
+                      else np.full(size, 1.0 / size, dtype=grid.dtype))
+        # Bumped whenever the posterior changes
+        self._version = 0
 
-    def Likelihood(self, data: tuple[Vote, float], hypo: int) -> float:
-        x = hypo
-        vote_reli_like = x
-        vote_unreli_like = 1 - x
-        # When a vote is unjudgable, give same likelihood to all hypos
-        vote_unjudge_like = 1.0
+    @property
+    def version(self) -> int:
+        """Version of the posterior, changed only when the posterior changes"""
+        return self._version
 
-        # vote, and link quality (this vote excluded)
-        vote, lq = data
+    @property
+    def d(self) -> dict:
+        """{hypo: probability} snapshot"""
+        return dict(zip(self._xs.tolist(), self.probs.tolist()))
+
+    @d.setter
+    def d(self, d: dict):
+        # Called by the base class constructor and Copy
+        self._grid_xs = self._xs = np.fromiter(d.keys(), dtype=float, count=len(d))
+        self._idx = None
+        self._post = self._from_probs(np.fromiter(d.values(), dtype=float, count=len(d)))
+
+    def _from_probs(self, ps: np.ndarray) -> np.ndarray:
+        """Posterior array kept for probabilities, ps itself or its log"""
+        if not self._LOG_POSTERIOR:
+            return ps
+        with np.errstate(divide='ignore'):
+            return np.log(ps)
+
+    def Normalize(self, fraction: float = 1.0) -> float:
+        if self._LOG_POSTERIOR:
+            total = float(np.exp(self._post).sum())
+        else:
+            total = self._post.sum()
+        if total == 0.0:
+            raise ValueError('total probability is zero.')
+        if self._LOG_POSTERIOR:
+            self._post = self._post - float(np.log(total / fraction))
+        else:
+            self._post *= fraction / total
+        return total
+
+    @property
+    def hypos(self) -> np.ndarray:
+        """Live hypotheses"""
+        return self._xs
+
+    @property
+    def probs(self) -> np.ndarray:
+        """Probabilities of live hypotheses, in the order of hypos, computed from a log posterior on each call"""
+        post = self._post
+        if not self._LOG_POSTERIOR:
+            return post
+        ps = np.exp(post)
+        ps /= ps.sum()
+        return ps
+
+    @property
+    def grid_hypos(self) -> np.ndarray:
+        """Hypothesis grid, including pruned hypotheses"""
+        return self._grid_xs
+
+    @property
+    def grid_probs(self) -> np.ndarray:
+        """Probabilities on the whole grid, 0 for pruned hypotheses"""
+        ps = self.probs
+        if self._idx is None:
+            return ps
+        grid_ps = np.zeros(len(self._grid_xs), dtype=ps.dtype)
+        grid_ps[self._idx] = ps
+        return grid_ps
+
+    def restore_probs(self, ps: np.ndarray):
+        """
+        Set probabilities of hypotheses on the whole grid.
+        The array is used without copy, it may be a copy-on-write memory map of a snapshot,
+        unless a log posterior is kept, it is pruned or of another dtype.
+        """
+        assert len(ps) == len(self._grid_xs)
+        self._xs = self._grid_xs
+        self._idx = None
+        self._post = self._from_probs(ps.astype(self._post.dtype, copy=False))
+        self._prune()
+        self._version += 1
+
+    @property
+    def grid_log_probs(self) -> np.ndarray:
+        """Unnormalized log probabilities on the whole grid, -inf for pruned hypotheses, needs _LOG_POSTERIOR"""
+        assert self._LOG_POSTERIOR, 'No log posterior'
+        post = self._post
+        if self._idx is None:
+            return post
+        logps = np.full(len(self._grid_xs), -np.inf, dtype=post.dtype)
+        logps[self._idx] = post
+        return logps
+
+    def restore_log_probs(self, logps: np.ndarray):
+        """
+        Set unnormalized log probabilities of hypotheses on the whole grid, needs _LOG_POSTERIOR.
+        Like restore_probs, the array is used without copy unless it is pruned or of another dtype.
+        """
+        assert self._LOG_POSTERIOR, 'No log posterior'
+        assert len(logps) == len(self._grid_xs)
+        self._xs = self._grid_xs
+        self._idx = None
+        self._post = logps.astype(self._post.dtype, copy=False)
+        self._prune()
+        self._version += 1
+
+    def _prune(self):
+        """Drop hypotheses with negligible probability"""
+        if self._prune_eps <= 0:
+            return
+
+        ps = self.probs
+        keep = ps >= self._prune_eps
+        if keep.all():
+            return
+        # Always keep the most likely one
+        keep[np.argmax(ps)] = True
+
+        live = np.flatnonzero(keep)
+        self._idx = live if self._idx is None else self._idx[live]
+        self._xs = self._grid_xs[self._idx]
+        if self._LOG_POSTERIOR:
+            self._post = self._post[keep]
+        else:
+            ps = ps[keep]
+            self._post = ps / ps.sum()
+
+    def _likelihoods(self, dataset) -> tuple[np.ndarray | None, float]:
+        """
+        Product of likelihoods of all data in dataset, or the sum of their logs with _LOG_POSTERIOR.
+        The product is rescaled to max 1 whenever it gets small, so many data never underflow it to 0.
+        :return: (product / scale or sum of logs, None if it does not change the posterior,
+                  scale, it may underflow to 0)
+        """
+        likes = None
+        scale = 1.0
+        for data in dataset:
+            like = self.Likelihood(data, self._xs)
+            if np.ndim(like) == 0:
+                # Same likelihood for all hypotheses does not change the posterior
+                continue
+            if self._LOG_POSTERIOR:
+                like = log_likes(like)
+                likes = like if likes is None else likes + like
+                continue
+            if likes is None:
+                likes = like
+                continue
+
+            likes = likes * like
+            top = likes.max()
+            if 0 < top < _RESCALE_BELOW:
+                likes /= top
+                scale *= top
+
+        return likes, scale
+
+    def _update(self, likes: np.ndarray | None, scale: float = 1.0) -> float:
+        """
+        :param likes: see _likelihoods
+        :return: normalizing constant, it may underflow to 0 for many data
+        """
+        if likes is None:
+            return 1.0
+
+        # Compute into a new array and swap it in, so readers never see a half updated posterior
+        post = self._post
+        if self._LOG_POSTERIOR:
+            logps = post + likes
+            top = logps.max()
+            if not np.isfinite(top):
+                raise ValueError('total probability is zero.')
+            logps -= top
+            total = float(np.exp(logps).sum() / np.exp(post).sum() * np.exp(top))
+            self._post = logps.astype(post.dtype, copy=False)
+        else:
+            ps = (post * likes).astype(post.dtype, copy=False)
+            total = ps.sum()
+            if total == 0.0:
+                raise ValueError('total probability is zero.')
+            ps /= total
+            self._post = ps
+            total *= scale
+        self._prune()
+        self._version += 1
+        return total
+
+    def Update(self, data) -> float:
+        return self._update(*self._likelihoods([data]))
+
+    def _downdate(self, like: float | np.ndarray):
+        assert self._LOG_POSTERIOR, 'No log posterior'
+        if np.ndim(like) == 0:
+            return
+
+        post = self._post
+        logps = post - log_likes(like)
+        logps -= logps.max()
+        self._post = logps.astype(post.dtype, copy=False)
+        self._prune()
+        self._version += 1
+
+    def Downdate(self, data):
+        """Remove given (already updated) data from the posterior, needs _LOG_POSTERIOR"""
+        self._downdate(self.Likelihood(data, self._xs))
+
+    def UpdateSet(self, dataset) -> float:
+        return self._update(*self._likelihoods(dataset))
+
+    def Mean(self) -> float:
+        return float(np.dot(self._xs, self.probs))
+
+    def MeanWithout(self, data) -> float:
+        """Mean of the posterior with the likelihood of given (already updated) data divided out"""
+        return self._mean_without(self.Likelihood(data, self._xs))
+
+    def _mean_without(self, like: float | np.ndarray) -> float:
+        if np.ndim(like) == 0:
+            return self.Mean()
+
+        ps = self.probs / like
+        return float(np.dot(self._xs, ps) / ps.sum())
+
+    def Var(self, mu: float | None = None) -> float:
+        ps = self.probs
+        if mu is None:
+            mu = float(np.dot(self._xs, ps))
+        return float(np.dot((self._xs - mu) ** 2, ps))
+
+    def mean_var(self) -> tuple[float, float]:
+        """(mean, variance) of the posterior, probabilities are computed once for both"""
+        ps = self.probs
+        mu = float(np.dot(self._xs, ps))
+        return mu, float(np.dot((self._xs - mu) ** 2, ps))
+
+    def MaximumLikelihood(self) -> float:
+        return float(self._xs[np.argmax(self._post)])
+
+
+@dataclass(frozen=True)
+class PosteriorSummary:
+    """Summary values of a posterior"""
+    mean: float
+    max_likelihood: float
+    variance: float
+
+
+def _cdf_value(xs: np.ndarray, cum: np.ndarray, p: float) -> float:
+    """:return: the smallest hypothesis whose cumulative probability reaches p"""
+    assert 0 <= p <= 1
+    # Scaled by the total, which may be off 1 by rounding
+    i = int(np.searchsorted(cum, p * cum[-1], side='left'))
+    return float(xs[min(i, len(xs) - 1)])
+
+
+def _credible_interval(xs: np.ndarray, cum: np.ndarray, p: float) -> tuple[float, float]:
+    assert 0 < p < 1
+    tail = (1 - p) / 2
+    return _cdf_value(xs, cum, tail), _cdf_value(xs, cum, 1 - tail)
+
+
+class SummaryCache:
+    """
+    Summary of a GridSuite, recomputed only after the suite changes.
+    The cumulative distribution is computed on the first percentile query after a change.
+    """
+    __slots__ = ('_suite', '_version', '_summary', '_cdf_version', '_cdf')
+
+    def __init__(self, suite: GridSuite):
+        self._suite = suite
+        self._version = None
+        self._summary = None
+        self._cdf_version = None
+        # (hypotheses, cumulative probabilities)
+        self._cdf = None
+
+    def get(self) -> PosteriorSummary:
+        """Return summary of the current posterior"""
+        # Read version before the posterior, so a concurrent update leaves the cache outdated, never wrong
+        version = self._suite.version
+        if self._version != version:
+            mean, var = self._suite.mean_var()
+            self._summary = PosteriorSummary(
+                mean=mean,
+                max_likelihood=self._suite.MaximumLikelihood(),
+                variance=var)
+            self._version = version
+
+        return self._summary
+
+    def _get_cdf(self) -> tuple[np.ndarray, np.ndarray]:
+        version = self._suite.version
+        if self._cdf_version != version:
+            self._cdf = (self._suite.hypos, np.cumsum(self._suite.probs))
+            self._cdf_version = version
+        return self._cdf
+
+    def percentile(self, q: float) -> float:
+        """Value at percentile q (0 ~ 100) of the current posterior, by binary search"""
+        return _cdf_value(*self._get_cdf(), q / 100)
+
+    def credible_interval(self, p: float) -> tuple[float, float]:
+        """Central credible interval of the current posterior with probability p (0 ~ 1)"""
+        return _credible_interval(*self._get_cdf(), p)
+
+
+class UserReliability(GridSuite):
+    """
+    User reliability modeled by Bayes model.
+    """
+    # Votes may be replaced or retracted
+    _LOG_POSTERIOR = True
+
+    @staticmethod
+    def judge(vote: Vote, lq: float) -> bool | None:
+        """
+        :param lq: link quality, the vote excluded
+        :return: whether the vote agrees with the link, None if the link is unjudgable
+        """
         delta = 0.0001
 
         link_is_good = None
@@ -40,39 +426,99 @@ class UserReliability(Suite):
             link_is_good = False
 
         if link_is_good is None:
-            return vote_unjudge_like
+            return None
 
         expected_vote_dir = VoteDir.UP if link_is_good else VoteDir.DOWN
-        return vote_reli_like if expected_vote_dir == vote.dir_ else vote_unreli_like
+        return expected_vote_dir == vote.dir_
+
+    @staticmethod
+    def _likelihood(reliable: bool, hypo: float | np.ndarray) -> float | np.ndarray:
+        x = hypo
+        return x if reliable else 1 - x
+
+    def Likelihood(self, data: tuple[Vote, float], hypo: float | np.ndarray) -> float | np.ndarray:
+        # vote, and link quality (this vote excluded)
+        reliable = self.judge(*data)
+        if reliable is None:
+            # When a vote is unjudgable, give same likelihood to all hypos
+            return 1.0
+        return self._likelihood(reliable, hypo)
+
+    def RemoveEvidence(self, reliable: bool):
+        """Remove a judged vote from the posterior, see judge"""
+        self._downdate(self._likelihood(reliable, self._xs))
 
 
 class BUser(User):
-    """User with bayes model"""
-    def __init__(self, id_: int):
+    """
+    User with bayes model.
+    Evidence of a vote is recorded on the vote as Vote.reliable by the engine, with UserReliability.judge,
+    so it can be removed when the vote is replaced or retracted.
+    """
+    __slots__ = ('_reliability', '_summary')
+
+    def __init__(self, id_: int, grid: GridConfig = DEFAULT_GRID):
         super().__init__(id_)
-        self._reliability = UserReliability(name=f'user_{id_}')
+        self._reliability = UserReliability(name=f'user_{id_}', grid=grid)
+        self._summary = SummaryCache(self._reliability)
+
+    @property
+    def posterior(self) -> UserReliability:
+        """Posterior of reliability"""
+        return self._reliability
 
     @property
     def reliability(self) -> float:
-        return self._reliability.Mean()
+        return self._summary.get().mean
 
-    def update_reliability(self, new_vote: Vote, link_quality: float):
-        """Update reliability with user vote and the voted link"""
+    def update_reliability(self, new_vote: Vote, link_quality: float, replaced: bool | None = None):
+        """
+        Update reliability with user vote and the voted link.
+        :param replaced: evidence (Vote.reliable) of the earlier vote of the user for the link,
+                         it is removed from reliability, None if there is none
+        """
+        self.retract_reliability(replaced)
         self._reliability.Update((new_vote, link_quality))
 
+    def retract_reliability(self, reliable: bool | None):
+        """Remove evidence (Vote.reliable) of a vote from reliability, nothing to remove if it is None"""
+        if reliable is not None:
+            self._reliability.RemoveEvidence(reliable)
+
     @property
     def max_likelihood(self) -> float:
-        return self._reliability.MaximumLikelihood()
+        return self._summary.get().max_likelihood
+
+    @property
+    def variance(self) -> float:
+        """Variance of reliability posterior"""
+        return self._summary.get().variance
 
+    def percentile(self, q: float) -> float:
+        """Reliability at percentile q (0 ~ 100) of the posterior"""
+        return self._summary.percentile(q)
 
-class LinkQuality(Suite):
+    def credible_interval(self, p: float = 0.9) -> tuple[float, float]:
+        """Central credible interval of reliability with probability p (0 ~ 1)"""
+        return self._summary.credible_interval(p)
+
+    def state(self) -> np.ndarray:
+        # The log posterior as it is kept, so a restored posterior is exactly the saved one
+        return self._reliability.grid_log_probs
+
+    def restore_state(self, state: np.ndarray):
+        self._reliability.restore_log_probs(state)
+
+
+class LinkQuality(GridSuite):
     """
     Link quality modeled by Bayes model.
     """
-    def __init__(self, name: str):
-        super().__init__(np.linspace(start=1 / 100, stop=1, num=100, dtype=float), name=name)
+    # Votes may be retracted
+    _LOG_POSTERIOR = True
 
-    def _likelihood(self, vote_dir: VoteDir, reversibility: float, hypo: int) -> float:
+    def _likelihood(self, vote_dir: VoteDir, reversibility: float,
+                    hypo: float | np.ndarray) -> float | np.ndarray:
         """
         Denote:
         - hypo U: Upvote with given hypothesis
@@ -125,36 +571,313 @@ class LinkQuality(Suite):
             assert vote_dir == VoteDir.DOWN
             return hypo_D_like * (1 - reversibility) + hypo_U_like * reversibility
 
-    def Likelihood(self, data: Vote, hypo: int) -> float:
+    def Likelihood(self, data: Vote, hypo: float | np.ndarray) -> float | np.ndarray:
         """
         :data: Vote
-        :hypo: hypothesis of upvote percentage
+        :hypo: hypothesis of upvote percentage, or an array of them
         """
         return self._likelihood(
             vote_dir=data.dir_,
-            reversibility=data.user.reversibility,
+            # The user's reversibility may have changed since a vote was committed
+            reversibility=_reversibility(data),
             hypo=hypo)
 
 
 class BLink(Link):
-    """Link with bayes model"""
-    def __init__(self, id_: int):
+    """
+    Link with bayes model.
+    A vote again by the same user, or a retracted vote, removes the old vote from the log posterior,
+    with the reversibility it was committed with, recorded as Vote.rev.
+    """
+    __slots__ = ('_l_quality', '_summary')
+
+    def __init__(self, id_: int, grid: GridConfig = DEFAULT_GRID):
         super().__init__(id_)
         # Give pmf a name for visualization
-        self._l_quality = LinkQuality(name=f'link_{id_}')
+        self._l_quality = LinkQuality(name=f'link_{id_}', grid=grid)
+        self._summary = SummaryCache(self._l_quality)
+
+    @property
+    def posterior(self) -> LinkQuality:
+        """Posterior of quality"""
+        return self._l_quality
 
     @property
     def quality(self) -> float | None:
         """Quality of this link"""
-        return self._l_quality.Mean()
+        return self._summary.get().mean
 
     @property
     def max_likelihood(self) -> float:
-        return self._l_quality.MaximumLikelihood()
+        return self._summary.get().max_likelihood
+
+    @property
+    def variance(self) -> float:
+        """Variance of quality posterior"""
+        return self._summary.get().variance
+
+    def percentile(self, q: float) -> float:
+        """Quality at percentile q (0 ~ 100) of the posterior"""
+        return self._summary.percentile(q)
+
+    def credible_interval(self, p: float = 0.9) -> tuple[float, float]:
+        """Central credible interval of quality with probability p (0 ~ 1)"""
+        return self._summary.credible_interval(p)
+
+    def state(self) -> np.ndarray:
+        # The log posterior as it is kept, so a restored posterior is exactly the saved one
+        return self._l_quality.grid_log_probs
+
+    def restore_state(self, state: np.ndarray):
+        self._l_quality.restore_log_probs(state)
+
+    def quality_without(self, vote: Vote) -> float:
+        """
+        Quality of this link as if given committed vote had not been made,
+        with the reversibility the vote was committed with.
+        """
+        return self._l_quality.MeanWithout(vote)
 
     def pre_commit_update_quality(self):
-        """Update quality with staged votes"""
+        """Update quality with staged votes, and remove votes they replace"""
+        # {user id: staged vote} of this commit
+        staged = {}
+        for v in self._staged_votes:
+            # Also a vote staged earlier in this commit, it is updated below
+            old = staged.get(v.user.id_, None) or self._user_votes.get(v.user.id_, None)
+            if old is not None:
+                self._l_quality.Downdate(old)
+            staged[v.user.id_] = v
+            v.rev = v.user.reversibility
         self._l_quality.UpdateSet(self._staged_votes)
 
     def post_commit_update_quality(self):
         pass
+
+    def retract_update_quality(self, vote: Vote):
+        self._l_quality.Downdate(vote)
+
+
+# Density is infinite at 0 or 1 when a or b < 1, it is evaluated half a grid step inside instead
+_BETA_XS = np.clip(_GRID, _GRID[0] / 2, 1 - _GRID[0] / 2)
+# Log of Beta(a, b) density on the grid is this basis times (a - 1, b - 1, constant)
+_BETA_LOG_BASIS = np.stack([np.log(_BETA_XS), np.log(1 - _BETA_XS), np.ones(len(_GRID))], axis=1)
+
+
+def _beta_grid_log_probs(a: float, b: float) -> np.ndarray:
+    """Beta(a, b) discretized on the hypothesis grid, as log probabilities shifted to max 0"""
+    logps = (a - 1) * _BETA_LOG_BASIS[:, 0] + (b - 1) * _BETA_LOG_BASIS[:, 1]
+    return logps - logps.max()
+
+
+def _beta_grid_probs(a: float, b: float) -> np.ndarray:
+    """Beta(a, b) discretized on the hypothesis grid"""
+    ps = np.exp(_beta_grid_log_probs(a, b))
+    return ps / ps.sum()
+
+
+def _beta_from_log_probs(logps: np.ndarray) -> tuple[float, float] | None:
+    """:return: (alpha, beta) of log probabilities given by _beta_grid_log_probs, None if they are not Beta"""
+    if len(logps) != len(_GRID) or not np.isfinite(logps).all():
+        return None
+    coef, *_ = np.linalg.lstsq(_BETA_LOG_BASIS, logps, rcond=None)
+    if np.abs(_BETA_LOG_BASIS @ coef - logps).max() > 1e-9 * max(1.0, float(np.abs(logps).max())):
+        return None
+    a, b = float(coef[0]) + 1, float(coef[1]) + 1
+    return (a, b) if a > 0 and b > 0 else None
+
+
+def _beta_from_moments(mean: float, var: float) -> tuple[float, float] | None:
+    """:return: (alpha, beta) with given mean and variance, None if no Beta distribution has them"""
+    if not 0 < mean < 1 or var <= 0:
+        return None
+    nu = mean * (1 - mean) / var - 1
+    if not 0 < nu < np.inf:
+        return None
+    return mean * nu, (1 - mean) * nu
+
+
+class BetaLink(Link):
+    """
+    Link with bayes model approximated by Beta(alpha, beta),
+    which takes O(1) memory and O(1) time per vote instead of a grid.
+
+    Likelihood of a vote is linear in link quality x, see LinkQuality,
+    so the exact posterior after a vote is a mix of two Beta distributions.
+    It is projected back to one Beta distribution with the same mean and variance
+    (assumed density filtering).
+    The link switches to a LinkQuality grid when its posterior is not Beta like:
+    a restored state far from its Beta approximation, or moments no Beta distribution has.
+    """
+    __slots__ = ('_alpha', '_beta', '_grid')
+
+    # Uniform prior of LinkQuality on the grid, matched by mean and variance
+    _PRIOR = _beta_from_moments(float(_GRID.mean()), float(_GRID.var()))
+    # Max total variation distance between a restored grid posterior and its Beta approximation
+    _MAX_RESTORE_ERROR = 0.15
+
+    def __init__(self, id_: int):
+        super().__init__(id_)
+        self._alpha, self._beta = self._PRIOR
+        # LinkQuality once it has switched to grid, otherwise None
+        self._grid = None
+
+    @property
+    def is_grid(self) -> bool:
+        """Whether this link has switched to a grid"""
+        return self._grid is not None
+
+    def _moments(self) -> tuple[float, float, float]:
+        """First 3 raw moments of Beta(alpha, beta)"""
+        a, b = self._alpha, self._beta
+        m1 = a / (a + b)
+        m2 = m1 * (a + 1) / (a + b + 1)
+        m3 = m2 * (a + 2) / (a + b + 2)
+        return m1, m2, m3
+
+    @staticmethod
+    def _linear_likelihood(vote: Vote) -> tuple[float, float]:
+        """:return: (c, s) of likelihood c + s * x of a vote, see LinkQuality"""
+        rev = _reversibility(vote)
+        if vote.dir_ == VoteDir.UP:
+            return rev, 1 - 2 * rev
+        else:
+            assert vote.dir_ == VoteDir.DOWN
+            return 1 - rev, 2 * rev - 1
+
+    def _switch_to_grid(self):
+        self._grid = LinkQuality(name=f'link_{self.id_}')
+        self._grid.restore_log_probs(_beta_grid_log_probs(self._alpha, self._beta))
+
+    def _update(self, vote: Vote):
+        if self._grid is not None:
+            self._grid.Update(vote)
+            return
+
+        c, s = self._linear_likelihood(vote)
+        if s == 0:
+            # Same likelihood for all qualities
+            return
+
+        m1, m2, m3 = self._moments()
+        z = c + s * m1
+        mean = (c * m1 + s * m2) / z
+        var = (c * m2 + s * m3) / z - mean ** 2
+        ab = _beta_from_moments(mean, var)
+        if ab is None:
+            self._switch_to_grid()
+            self._grid.Update(vote)
+        else:
+            self._alpha, self._beta = ab
+
+    @property
+    def alpha_beta(self) -> tuple[float, float] | None:
+        """(alpha, beta) of quality posterior, None if this link has switched to grid"""
+        return None if self._grid is not None else (self._alpha, self._beta)
+
+    @property
+    def posterior(self) -> LinkQuality:
+        """Posterior of quality on the grid, built from (alpha, beta) on each call unless switched to grid"""
+        if self._grid is not None:
+            return self._grid
+        pmf = LinkQuality(name=f'link_{self.id_}')
+        pmf.restore_log_probs(_beta_grid_log_probs(self._alpha, self._beta))
+        return pmf
+
+    @property
+    def quality(self) -> float:
+        """Quality of this link"""
+        if self._grid is not None:
+            return self._grid.Mean()
+        return self._alpha / (self._alpha + self._beta)
+
+    @property
+    def max_likelihood(self) -> float:
+        return self.posterior.MaximumLikelihood()
+
+    @property
+    def variance(self) -> float:
+        """Variance of quality posterior"""
+        if self._grid is not None:
+            return self._grid.Var()
+        m1, m2, _ = self._moments()
+        return m2 - m1 ** 2
+
+    def _cdf(self) -> tuple[np.ndarray, np.ndarray]:
+        pmf = self.posterior
+        return pmf.hypos, np.cumsum(pmf.probs)
+
+    def percentile(self, q: float) -> float:
+        """Quality at percentile q (0 ~ 100) of the posterior on the grid, not cached"""
+        return _cdf_value(*self._cdf(), q / 100)
+
+    def credible_interval(self, p: float = 0.9) -> tuple[float, float]:
+        """Central credible interval of quality with probability p (0 ~ 1) on the grid, not cached"""
+        return _credible_interval(*self._cdf(), p)
+
+    def state(self) -> np.ndarray:
+        # Grid log probabilities, so snapshots of BLink and BetaLink are interchangeable
+        if self._grid is not None:
+            return self._grid.grid_log_probs
+        return _beta_grid_log_probs(self._alpha, self._beta)
+
+    def restore_state(self, state: np.ndarray):
+        # A state saved by a Beta link gives its (alpha, beta) back
+        ab = _beta_from_log_probs(state)
+        if ab is not None:
+            self._alpha, self._beta = ab
+            self._grid = None
+            return
+
+        pmf = LinkQuality(name=f'link_{self.id_}')
+        pmf.restore_log_probs(state)
+        ab = _beta_from_moments(*pmf.mean_var())
+        # Keep the grid if it is not Beta like, e.g. bimodal
+        if ab is None or 0.5 * np.abs(_beta_grid_probs(*ab) - pmf.probs).sum() > self._MAX_RESTORE_ERROR:
+            self._grid = pmf
+        else:
+            self._alpha, self._beta = ab
+            self._grid = None
+
+    def quality_without(self, vote: Vote) -> float:
+        """
+        Quality of this link as if given committed vote had not been made, computed on the grid,
+        with the reversibility the vote was committed with.
+        """
+        if self._grid is not None:
+            return self._grid.MeanWithout(vote)
+
+        c, s = self._linear_likelihood(vote)
+        if s == 0:
+            return self.quality
+        like = c + s * _GRID
+        # Unlike a grid posterior, the approximation is not zero where the likelihood is zero
+        ps = np.divide(_beta_grid_probs(self._alpha, self._beta), like, out=np.zeros_like(like), where=like > 0)
+        return float(np.dot(_GRID, ps) / ps.sum())
+
+    def pre_commit_update_quality(self):
+        """Update quality with staged votes"""
+        # {user id: staged vote} of this commit
+        staged = {}
+        for v in self._staged_votes:
+            old = staged.get(v.user.id_, None) or self._user_votes.get(v.user.id_, None)
+            if old is not None:
+                self._remove(old)
+            staged[v.user.id_] = v
+            v.rev = v.user.reversibility
+            self._update(v)
+
+    def post_commit_update_quality(self):
+        pass
+
+    def _remove(self, vote: Vote):
+        """
+        Remove a vote with the reversibility it was committed with,
+        a Beta distribution divided by a likelihood is not Beta, so it switches to grid.
+        """
+        if self._grid is None:
+            self._switch_to_grid()
+        self._grid.Downdate(vote)
+
+    def retract_update_quality(self, vote: Vote):
+        self._remove(vote)
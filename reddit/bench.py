@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of reddit models on synthetic workloads of growing size.
+
+Each case replays a workload through one model in a fresh process, and reports
+throughput, latency of vote / vote_many calls, peak RSS, and accuracy against the ground truth.
+Results are saved as JSON, and can be compared with results of another version to catch regressions.
+"""
+
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+
+import numpy as np
+
+from . import instrument as instr
+from .models import ENGINES
+from .bayes import BayesEngine, BayesBetaEngine
+from .workload import Workload, WorkloadSpec
+
+
+_FORMAT_VERSION = 1
+
+
+def _peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def run_case(model: str, spec: WorkloadSpec, batch_size: int = 1, instrument: bool = False) -> dict:
+    """
+    Replay a workload through a model in this process.
+    :param batch_size: 1 to call vote for each vote, otherwise votes per vote_many call
+    :param instrument: add an instrumentation snapshot to the result, it slows down the replay.
+    """
+    assert batch_size > 0
+    if instrument:
+        instr.reset()
+        instr.enable()
+    engine = ENGINES[model]()
+    workload = Workload(spec)
+    rss_before = _peak_rss_mb()
+
+    # Seconds of each vote / vote_many call
+    latencies = []
+    vote_cnt = 0
+    for chunk in workload.chunks():
+        votes = chunk.tuples()
+        vote_cnt += len(votes)
+        if batch_size == 1:
+            for vote in votes:
+                t = time.perf_counter()
+                engine.vote(*vote)
+                latencies.append(time.perf_counter() - t)
+        else:
+            for b in range(0, len(votes), batch_size):
+                batch = votes[b:b + batch_size]
+                t = time.perf_counter()
+                engine.vote_many(batch)
+                latencies.append(time.perf_counter() - t)
+
+    if instrument:
+        instr.disable()
+
+    secs = float(np.sum(latencies))
+    p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9]) * 1000
+    truth = workload.truth
+    res = {
+        'model': model,
+        'users': spec.user_count,
+        'links': spec.link_count,
+        'votes': vote_cnt,
+        'batch_size': batch_size,
+        'seconds': secs,
+        'votes_per_sec': vote_cnt / secs,
+        'latency_p50_ms': float(p50),
+        'latency_p99_ms': float(p99),
+        'latency_p999_ms': float(p999),
+        'peak_rss_mb': _peak_rss_mb(),
+        'rss_before_replay_mb': rss_before,
+        'link_accuracy': truth.link_accuracy({link.id_: link.quality for link in engine.pool.links}),
+        'reliability_mae': truth.reliability_mae({u.id_: u.reliability for u in engine.pool.users}),
+    }
+    if instrument:
+        res['instrument'] = instr.snapshot()
+    return res
+
+
+def run(models: list[str], sizes: list[int], link_ratio: float = 1.0, votes_per_user: float = 20.0,
+        batch_size: int = 1, seed: int = 0, instrument: bool = False) -> dict:
+    """
+    Run a case for each model and size, each in a fresh process, so peak RSS is of that case only.
+    :param sizes: user counts
+    :param link_ratio: links per user
+    """
+    results = []
+    for size in sizes:
+        spec = WorkloadSpec(user_count=size, link_count=max(1, int(size * link_ratio)),
+                            votes_per_user=votes_per_user, seed=seed)
+        for model in models:
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as executor:
+                res = executor.submit(run_case, model, spec, batch_size, instrument).result()
+            results.append(res)
+            print(f'{model:<12} users: {size:>8} votes: {res["votes"]:>9} '
+                  f'votes/s: {res["votes_per_sec"]:>10.0f} p99: {res["latency_p99_ms"]:>8.3f} ms '
+                  f'rss: {res["peak_rss_mb"]:>7.1f} MB link acc: {res["link_accuracy"]:.3f} '
+                  f'reli mae: {res["reliability_mae"]:.3f}', flush=True)
+
+    return {
+        'version': _FORMAT_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def beta_error(spec: WorkloadSpec, batch_size: int = 1) -> dict:
+    """Error of Beta approximated links against grid links, both models see the same votes in one pass"""
+    grid, beta = BayesEngine(), BayesBetaEngine()
+    workload = Workload(spec)
+    for chunk in workload.chunks():
+        votes = chunk.tuples()
+        for b in range(0, len(votes), batch_size):
+            for engine in (grid, beta):
+                if batch_size == 1:
+                    engine.vote(*votes[b])
+                else:
+                    engine.vote_many(votes[b:b + batch_size])
+
+    links = sorted(grid.pool.links, key=lambda link: link.id_)
+    quality_err = np.abs([link.quality - beta.pool.get_link(link.id_).quality for link in links])
+    reli_err = np.abs([u.reliability - beta.pool.get_user(u.id_).reliability for u in grid.pool.users])
+    truth = workload.truth
+    return {
+        'users': spec.user_count,
+        'links': spec.link_count,
+        'quality_mae': float(quality_err.mean()),
+        'quality_max_err': float(quality_err.max()),
+        'reliability_mae': float(reli_err.mean()),
+        'grid_links': sum(link.is_grid for link in beta.pool.links),
+        'grid_link_accuracy': truth.link_accuracy({link.id_: link.quality for link in grid.pool.links}),
+        'beta_link_accuracy': truth.link_accuracy({link.id_: link.quality for link in beta.pool.links}),
+    }
+
+
+def _case_key(res: dict) -> tuple:
+    return res['model'], res['users'], res['links'], res['votes'], res['batch_size']
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.1) -> list[str]:
+    """
+    Compare results of the same cases.
+    :param tolerance: allowed relative slowdown of throughput and growth of peak RSS
+    :return: descriptions of regressions
+    """
+    assert baseline['version'] == current['version'], 'Results of different formats'
+    base = {_case_key(res): res for res in baseline['results']}
+
+    regressions = []
+    for res in current['results']:
+        old = base.get(_case_key(res), None)
+        if old is None:
+            continue
+
+        name = f'{res["model"]} users: {res["users"]} batch: {res["batch_size"]}'
+        if res['votes_per_sec'] < old['votes_per_sec'] * (1 - tolerance):
+            regressions.append(f'{name} votes/s {old["votes_per_sec"]:.0f} -> {res["votes_per_sec"]:.0f}')
+        if res['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f'{name} peak rss {old["peak_rss_mb"]:.1f} -> {res["peak_rss_mb"]:.1f} MB')
+    return regressions
+
+
+def main():
+    """Run benchmark, save results, and compare with a baseline"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--models', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000], help='user counts')
+    parser.add_argument('--link-ratio', type=float, default=1.0, help='links per user')
+    parser.add_argument('--votes-per-user', type=float, default=20.0)
+    parser.add_argument('--batch-size', type=int, default=1, help='1 to call vote, otherwise vote_many batch size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--instrument', action='store_true', help='add hot path counts and timings to results')
+    parser.add_argument('--beta-error', action='store_true',
+                        help='measure error of bayes_beta against bayes instead of running cases')
+    parser.add_argument('--out', help='save results to this JSON file')
+    parser.add_argument('--baseline', help='compare with results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.beta_error:
+        for size in args.sizes:
+            spec = WorkloadSpec(user_count=size, link_count=max(1, int(size * args.link_ratio)),
+                                votes_per_user=args.votes_per_user, seed=args.seed)
+            print(json.dumps(beta_error(spec, batch_size=args.batch_size)))
+        return
+
+    current = run(args.models, args.sizes, link_ratio=args.link_ratio, votes_per_user=args.votes_per_user,
+                  batch_size=args.batch_size, seed=args.seed, instrument=args.instrument)
+    if args.out is not None:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(json.load(f), current, tolerance=args.tolerance)
+        for r in regressions:
+            print(f'REGRESSION: {r}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,16 +4,41 @@
 Common classes for reddit problem.
 """
 
-from typing import Iterator
+import threading
+from typing import Iterator, Iterable, Callable
 from enum import Enum, auto
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
+
+import numpy as np
+
+
+# Lock of objects that are not shared by threads
+_NO_LOCK = nullcontext()
+# Locks of user vote tallies of concurrent pools, striped by user id.
+# They are held only to count, so a link commit never waits for a reliability update under User.lock.
+_TALLY_LOCKS = tuple(threading.Lock() for _ in range(64))
+
+
+class VoteDir(Enum):
+    """Vote directions"""
+    UP = auto()
+    DOWN = auto()
 
 
 class User(ABC):
     """Represent an user"""
+    # No per instance dict, there may be millions of users
+    __slots__ = ('id_', 'lock', '_up_vote_cnt', '_down_vote_cnt')
+
     def __init__(self, id_: int):
         """Represent a redditor (a user)"""
         self.id_ = id_
+        # Guard reliability updates, a no-op unless set by a concurrent pool
+        self.lock = _NO_LOCK
+        # Running tallies of committed votes of this user, kept by links
+        self._up_vote_cnt = 0
+        self._down_vote_cnt = 0
 
     @property
     @abstractmethod
@@ -26,33 +51,115 @@ class User(ABC):
         """Reversibility"""
         return 1.0 - self.reliability
 
+    def tally_vote(self, dir_: VoteDir, n: int):
+        """Count n committed votes (negative to uncount) of this user, called by links"""
+        # Links of this user may be committed by other threads, see _TALLY_LOCKS
+        lock = _NO_LOCK if self.lock is _NO_LOCK else _TALLY_LOCKS[self.id_ % len(_TALLY_LOCKS)]
+        with lock:
+            if dir_ == VoteDir.UP:
+                self._up_vote_cnt += n
+            else:
+                assert dir_ == VoteDir.DOWN
+                self._down_vote_cnt += n
 
-class VoteDir(Enum):
-    """Vote directions"""
-    UP = auto()
-    DOWN = auto()
+    @property
+    def up_vote_count(self) -> int:
+        """Number of committed up votes"""
+        return self._up_vote_cnt
+
+    @property
+    def down_vote_count(self) -> int:
+        """Number of committed down votes"""
+        return self._down_vote_cnt
+
+    @property
+    def vote_count(self) -> int:
+        """Number of committed votes, i.e. links voted"""
+        return self._up_vote_cnt + self._down_vote_cnt
+
+    @abstractmethod
+    def state(self) -> np.ndarray:
+        """Return reliability state as a 1d float array, used to save snapshot"""
+        raise NotImplementedError('Child class must implement this')
+
+    @abstractmethod
+    def restore_state(self, state: np.ndarray):
+        """Restore reliability state returned by state()"""
+        raise NotImplementedError('Child class must implement this')
 
 
 class Vote:
     """Represent a vote"""
-    def __init__(self, user: User, dir_: VoteDir):
+    __slots__ = ('user', 'dir_', 'rev', 'reliable')
+
+    def __init__(self, user: User, dir_: VoteDir, rev: float | None = None, reliable: bool | None = None):
         self.user = user
         self.dir_ = dir_
+        # Reversibility of the user when a bayes link committed this vote, None if not recorded
+        self.rev = rev
+        # Whether this vote agreed with its link when it was judged for the user reliability,
+        # None if it was not judged or unjudgable
+        self.reliable = reliable
 
 
 class Link(ABC):
     """Represent a link"""
+    # No per instance dict, there may be millions of links
+    __slots__ = ('id_', 'lock', '_staged_votes', '_user_votes', '_commit_listeners', '_retract_listeners',
+                 '_quality_listeners', '_up_vote_cnt', '_down_vote_cnt')
+
     def __init__(self, id_: int):
         self.id_ = id_
+        # Guard staging and committing votes, a no-op unless set by a concurrent pool
+        self.lock = _NO_LOCK
         # [Vote]
         self._staged_votes = []
         # {user id: Vote}
         self._user_votes = {}
+        # (callable(link, vote), ) notified with every committed vote, the empty tuple is shared
+        self._commit_listeners = ()
+        # (callable(link, vote), ) notified with every retracted vote
+        self._retract_listeners = ()
+        # (callable(link), ) notified after committed votes may have changed quality
+        self._quality_listeners = ()
+        # Running tallies of committed votes
+        self._up_vote_cnt = 0
+        self._down_vote_cnt = 0
+
+    def set_vote_storage(self, user_votes):
+        """
+        Keep committed votes in given {user id: Vote} like storage instead of a dict,
+        e.g. a view on a columnar vote store.
+        It must be called before any vote is committed.
+        """
+        assert len(self._user_votes) == 0, 'Votes have been committed'
+        self._user_votes = user_votes
+
+    def add_commit_listener(self, listener: Callable[['Link', Vote], None]):
+        """Add a callable that is called with (this link, vote) for every committed vote"""
+        self._commit_listeners += (listener,)
+
+    def add_retract_listener(self, listener: Callable[['Link', Vote], None]):
+        """Add a callable that is called with (this link, vote) for every retracted vote"""
+        self._retract_listeners += (listener,)
+
+    def add_quality_listener(self, listener: Callable[['Link'], None]):
+        """Add a callable that is called with this link after commit_vote committed any vote"""
+        self._quality_listeners += (listener,)
+
+    def quality_changed(self):
+        """Notify quality listeners, called after quality may have changed, e.g. by commit_vote or refit"""
+        for listener in self._quality_listeners:
+            listener(self)
 
     def add_vote(self, vote: Vote):
         """Add a vote to this link"""
         self._staged_votes.append(vote)
 
+    def add_votes(self, votes: Iterable[Vote]):
+        """Add votes to this link"""
+        self._staged_votes.extend(votes)
+
     @abstractmethod
     def pre_commit_update_quality(self):
         """Method used to update link quality before committing votes.
@@ -63,26 +170,114 @@ class Link(ABC):
     @abstractmethod
     def post_commit_update_quality(self):
         """Method used to update link quality after committing votes.
-        This method is called inside commit_vote.
+        This method is called inside commit_vote and retract_vote.
+        """
+        raise NotImplementedError('Child class must implement this')
+
+    @abstractmethod
+    def retract_update_quality(self, vote: Vote):
+        """Method used to remove a committed vote from link quality.
+        This method is called inside retract_vote, before the vote is removed.
         """
         raise NotImplementedError('Child class must implement this')
 
+    def _tally(self, v: Vote, n: int):
+        """Count a vote in tallies of this link and its user"""
+        if v.dir_ == VoteDir.UP:
+            self._up_vote_cnt += n
+        else:
+            assert v.dir_ == VoteDir.DOWN
+            self._down_vote_cnt += n
+        v.user.tally_vote(v.dir_, n)
+
+    def _commit_one(self, v: Vote):
+        old_vote = self._user_votes.get(v.user.id_, None)
+        if old_vote is not None:
+            # A vote again by the same user replaces the old vote
+            self._tally(old_vote, -1)
+        self._tally(v, 1)
+        self._user_votes[v.user.id_] = v
+        for listener in self._commit_listeners:
+            listener(self, v)
+
     def commit_vote(self):
         """Commit staged votes"""
         self.pre_commit_update_quality()
 
+        committed = len(self._staged_votes) > 0
         for v in self._staged_votes:
-            self._user_votes[v.user.id_] = v
+            self._commit_one(v)
 
         self._staged_votes.clear()
 
         self.post_commit_update_quality()
 
+        if committed:
+            self.quality_changed()
+
+    def retract_vote(self, user: User) -> Vote | None:
+        """
+        Retract the committed vote of a user, and update quality without it.
+        To change a vote, commit a new vote of the user instead, it replaces the old one.
+        :return: the retracted vote, None if the user has not voted this link
+        """
+        vote = self._user_votes.get(user.id_, None)
+        if vote is None:
+            return None
+
+        self.retract_update_quality(vote)
+        self._tally(vote, -1)
+        del self._user_votes[user.id_]
+        for listener in self._retract_listeners:
+            listener(self, vote)
+        self.post_commit_update_quality()
+
+        self.quality_changed()
+        return vote
+
+    def annotate_vote(self, vote: Vote):
+        """
+        Store fields of a committed vote set after it was committed, e.g. reliable,
+        quality, tallies and listeners are not touched.
+        """
+        assert self._user_votes.get(vote.user.id_, None) is not None, 'Vote is not committed'
+        self._user_votes[vote.user.id_] = vote
+
+    def restore_votes(self, votes: Iterable[Vote]):
+        """Add committed votes without updating quality, used to load snapshot"""
+        for v in votes:
+            self._commit_one(v)
+
+    @abstractmethod
+    def state(self) -> np.ndarray:
+        """Return quality state as a 1d float array, used to save snapshot"""
+        raise NotImplementedError('Child class must implement this')
+
+    @abstractmethod
+    def restore_state(self, state: np.ndarray):
+        """Restore quality state returned by state()"""
+        raise NotImplementedError('Child class must implement this')
+
     @property
     def votes(self) -> Iterator[Vote]:
         """Return an iterator on votes of this link"""
         return self._user_votes.values()
 
+    @property
+    def staged_votes(self) -> Iterator[Vote]:
+        """Return an iterator on staged but not committed votes of this link"""
+        return iter(self._staged_votes)
+
+    @property
+    def up_vote_count(self) -> int:
+        """Number of committed up votes"""
+        return self._up_vote_cnt
+
+    @property
+    def down_vote_count(self) -> int:
+        """Number of committed down votes"""
+        return self._down_vote_cnt
+
     def get_vote(self, u: User) -> Vote | None:
         """Return a vote by given user"""
         return self._user_votes.get(u.id_, None)
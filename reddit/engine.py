@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""
+Model engine, a reddit model with its own resource pool.
+
+Engines do not share state, so several models can run side by side in one process,
+e.g. to score shadow models with one pass over a vote stream.
+"""
+
+from typing import Iterable, Callable
+from abc import ABC, abstractmethod
+
+from .comm import User, Link, Vote, VoteDir
+from .pool import ResourcePool
+
+
+class Engine(ABC):
+    """A reddit model"""
+    # Constructors of users and links of the model, set by child classes, or on an engine before __init__
+    user_constr: Callable[[int], User] = None
+    link_constr: Callable[[int], Link] = None
+
+    def __init__(self, columnar_votes: bool = False, concurrent: bool = False, pool: ResourcePool | None = None):
+        """
+        :param columnar_votes: see ResourcePool
+        :param concurrent: see ResourcePool
+        :param pool: use this pool instead of creating a new one, e.g. a pool loaded from a snapshot.
+        """
+        if pool is None:
+            pool = ResourcePool(self.user_constr, self.link_constr,
+                                columnar_votes=columnar_votes, concurrent=concurrent)
+        self._pool = pool
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, columnar_votes: bool = False, concurrent: bool = False,
+             **kwargs) -> 'Engine':
+        """
+        Create an engine with the pool of a snapshot directory, see ResourcePool.load
+        :param kwargs: other arguments of the engine, e.g. grid of BayesEngine, it must match the snapshot.
+        """
+        engine = cls(columnar_votes=columnar_votes, concurrent=concurrent, **kwargs)
+        engine.restore(path, mmap=mmap)
+        return engine
+
+    def restore(self, path: str, mmap: bool = True):
+        """
+        Replace the pool of this engine with the pool of a snapshot directory, see ResourcePool.load.
+        The new pool has the options of the current pool, which must have no user or link.
+        """
+        pool = self._pool
+        assert next(iter(pool.users), None) is None and next(iter(pool.links), None) is None, \
+            'Only an unused engine can be restored'
+        self._pool = ResourcePool.load(path, self.user_constr, self.link_constr, mmap=mmap,
+                                       columnar_votes=pool.vote_store is not None, concurrent=pool.concurrent)
+
+    @property
+    def pool(self) -> ResourcePool:
+        """Resource pool of this engine"""
+        return self._pool
+
+    @abstractmethod
+    def vote(self, user_id: int, link_id: int, dir_: VoteDir):
+        """User vote a link"""
+        raise NotImplementedError('Child class must implement this')
+
+    @abstractmethod
+    def vote_many(self, votes: Iterable[tuple[int, int, VoteDir]]):
+        """
+        Users vote links in a batch.
+        :param votes: votes in [(user id, link id, vote dir)]
+        """
+        raise NotImplementedError('Child class must implement this')
+
+    def retract_vote(self, user_id: int, link_id: int) -> Vote | None:
+        """
+        User retract the vote of a link, the link quality is updated without the vote.
+        A vote again changes a vote, see Link.retract_vote.
+        :return: the retracted vote, None if the user has not voted the link, unknown ids are not created
+        """
+        link = self._pool.find_link(link_id)
+        user = self._pool.find_user(user_id)
+        if link is None or user is None:
+            return None
+        with link.lock:
+            return link.retract_vote(user)
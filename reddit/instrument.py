@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+"""
+Opt-in instrumentation of hot paths.
+
+enable() wraps the instrumented methods in place, and disable() puts the original methods back,
+so there is no cost at all when it is disabled.
+
+Counters:
+- likelihood: likelihood evaluations of link quality and user reliability suites
+- normalize: posterior normalizations
+- votes_committed: votes committed by Link.commit_vote
+
+Timers, a stage includes the time of stages called inside it:
+- commit_vote, pre_commit_update_quality, post_commit_update_quality: Link
+- update_reliability: BUser
+- suser_reliability_scan: scan of a simple user's votes by simple and bayes_suser models
+- get_user, get_link: ResourcePool lookups
+- <model>.vote, <model>.vote_many: model engines
+
+Counts are not synchronized, they may be slightly off when threads vote at the same time.
+"""
+
+import time
+import functools
+from typing import Callable, Iterator
+from contextlib import contextmanager
+
+from .comm import Link
+from .simpleobj import SLink
+from .bayesobj import GridSuite, LinkQuality, UserReliability, BUser, BLink, BetaLink
+from .pool import ResourcePool
+from .simple import SimpleEngine
+from .bayes_suser import BayesSUserEngine
+from .models import ENGINES
+
+
+# Histogram buckets are powers of 2 nanoseconds
+_BUCKETS = 48
+
+# {counter name: count}
+_g_counters = {}
+# {stage name: [count, total ns, [count of bucket]]}
+_g_timers = {}
+# [(owner class, attribute name, original function or None if inherited)] of wrapped methods
+_g_wrapped = []
+
+
+def _count(name: str, n: int = 1):
+    _g_counters[name] = _g_counters.get(name, 0) + n
+
+
+def _record(stage: str, ns: int):
+    timer = _g_timers.get(stage, None)
+    if timer is None:
+        timer = _g_timers[stage] = [0, 0, [0] * _BUCKETS]
+    timer[0] += 1
+    timer[1] += ns
+    timer[2][min(ns.bit_length(), _BUCKETS - 1)] += 1
+
+
+def _counted(fn: Callable, counter: str, count: Callable[..., int] | None = None) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        _count(counter, 1 if count is None else count(*args, **kwargs))
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def _timed(fn: Callable, stage: str) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        t = time.perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _record(stage, time.perf_counter_ns() - t)
+    return wrapper
+
+
+def _targets() -> list[tuple[type, str, Callable[[Callable], Callable]]]:
+    """[(owner class, attribute name, wrap the original function)]"""
+    targets = [
+        (LinkQuality, '_likelihood', lambda fn: _counted(fn, 'likelihood')),
+        (UserReliability, 'Likelihood', lambda fn: _counted(fn, 'likelihood')),
+        (GridSuite, 'Normalize', lambda fn: _counted(fn, 'normalize')),
+        # Normalizes the posterior of Update and UpdateSet, unless the data does not change it
+        (GridSuite, '_update', lambda fn: _counted(fn, 'normalize', lambda _, likes, *__: int(likes is not None))),
+        (Link, 'commit_vote', lambda fn: _timed(
+            _counted(fn, 'votes_committed', lambda link: len(list(link.staged_votes))), 'commit_vote')),
+        (BLink, 'pre_commit_update_quality', lambda fn: _timed(fn, 'pre_commit_update_quality')),
+        (BetaLink, 'pre_commit_update_quality', lambda fn: _timed(fn, 'pre_commit_update_quality')),
+        (SLink, 'post_commit_update_quality', lambda fn: _timed(fn, 'post_commit_update_quality')),
+        (BUser, 'update_reliability', lambda fn: _timed(fn, 'update_reliability')),
+        (SimpleEngine, '_update_suser_reliability', lambda fn: _timed(fn, 'suser_reliability_scan')),
+        (BayesSUserEngine, '_update_suser_reliability', lambda fn: _timed(fn, 'suser_reliability_scan')),
+        (ResourcePool, 'get_user', lambda fn: _timed(fn, 'get_user')),
+        (ResourcePool, 'get_link', lambda fn: _timed(fn, 'get_link')),
+    ]
+    for name, engine in ENGINES.items():
+        for method in ('vote', 'vote_many'):
+            targets.append((engine, method, functools.partial(_timed, stage=f'{name}.{method}')))
+    return targets
+
+
+def is_enabled() -> bool:
+    """Whether instrumentation is enabled"""
+    return bool(_g_wrapped)
+
+
+def enable():
+    """Wrap instrumented methods, counts are kept from the last reset"""
+    if is_enabled():
+        return
+
+    # Get all original methods before wrapping any of them, a method may be inherited by another owner
+    targets = [(owner, attr, wrap, owner.__dict__.get(attr, None), getattr(owner, attr))
+               for owner, attr, wrap in _targets()]
+    for owner, attr, wrap, own_fn, fn in targets:
+        # An inherited method is wrapped on the owner, shadowing the one of the base class
+        _g_wrapped.append((owner, attr, own_fn))
+        setattr(owner, attr, wrap(fn))
+
+
+def disable():
+    """Put original methods back"""
+    while _g_wrapped:
+        owner, attr, fn = _g_wrapped.pop()
+        if fn is None:
+            delattr(owner, attr)
+        else:
+            setattr(owner, attr, fn)
+
+
+def reset():
+    """Clear all counts"""
+    _g_counters.clear()
+    _g_timers.clear()
+
+
+@contextmanager
+def instrumented() -> Iterator[None]:
+    """Enable instrumentation with cleared counts inside the context"""
+    reset()
+    enable()
+    try:
+        yield
+    finally:
+        disable()
+
+
+def snapshot() -> dict:
+    """
+    Copy of all counts,
+    {'counters': {name: count},
+     'timers': {stage: {'count': calls, 'total_ms': total time, 'histogram_us': {bucket upper bound: calls}}}}
+    """
+    timers = {}
+    for stage, (cnt, total_ns, buckets) in _g_timers.items():
+        timers[stage] = {
+            'count': cnt,
+            'total_ms': total_ns / 1e6,
+            'histogram_us': {2 ** i / 1000: n for i, n in enumerate(buckets) if n > 0},
+        }
+    return {'counters': dict(_g_counters), 'timers': timers}
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+Memory benchmark, bytes per user, link and vote held by a resource pool.
+
+Memory is measured with tracemalloc, so it covers Python objects and numpy arrays,
+but not allocator overhead seen in RSS.
+"""
+
+import argparse
+import functools
+import tracemalloc
+from random import Random
+from typing import Callable
+
+import numpy as np
+
+from .comm import User, Link, Vote, VoteDir
+from .simpleobj import SUser, SLink
+from .bayesobj import BUser, BLink, BetaLink, GridConfig
+from .pool import ResourcePool
+
+
+def _traced_bytes(fn: Callable[[], None]) -> int:
+    """Bytes still allocated after fn returns"""
+    before = tracemalloc.get_traced_memory()[0]
+    fn()
+    return tracemalloc.get_traced_memory()[0] - before
+
+
+def measure(user_constr: Callable[[int], User], link_constr: Callable[[int], Link],
+            user_cnt: int, link_cnt: int, vote_cnt: int, columnar_votes: bool = False, seed: int = 0) -> dict:
+    """
+    Bytes per user, link and committed vote of a pool.
+    Each vote is committed to its link, user reliabilities are not updated.
+    """
+    rand = Random(seed)
+    votes = [(rand.randrange(user_cnt), rand.randrange(link_cnt), rand.choice((VoteDir.UP, VoteDir.DOWN)))
+             for _ in range(vote_cnt)]
+
+    tracemalloc.start()
+    try:
+        pool = ResourcePool(user_constr, link_constr, columnar_votes=columnar_votes)
+        user_bytes = _traced_bytes(lambda: [pool.get_user(i) for i in range(user_cnt)])
+        link_bytes = _traced_bytes(lambda: [pool.get_link(i) for i in range(link_cnt)])
+
+        def commit_votes():
+            for user_id, link_id, dir_ in votes:
+                link = pool.get_link(link_id)
+                link.add_vote(Vote(pool.get_user(user_id), dir_))
+                link.commit_vote()
+
+        vote_bytes = _traced_bytes(commit_votes)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'bytes_per_user': user_bytes / user_cnt,
+        'bytes_per_link': link_bytes / link_cnt,
+        'bytes_per_vote': vote_bytes / vote_cnt,
+    }
+
+
+def main():
+    """Print bytes per user, link and vote of each kind of pool"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--links', type=int, default=10000)
+    parser.add_argument('--votes', type=int, default=50000)
+    args = parser.parse_args()
+
+    f32 = GridConfig(dtype=np.float32)
+    print(f'{"pool":<20} {"user":>8} {"link":>8} {"vote":>8}')
+    for name, user_constr, link_constr, columnar_votes in (
+            ('simple', SUser, SLink, False),
+            ('simple columnar', SUser, SLink, True),
+            ('bayes', BUser, BLink, False),
+            ('bayes columnar', BUser, BLink, True),
+            ('bayes float32', functools.partial(BUser, grid=f32), functools.partial(BLink, grid=f32), False),
+            ('bayes beta', BUser, BetaLink, False)):
+        res = measure(user_constr, link_constr, args.users, args.links, args.votes, columnar_votes=columnar_votes)
+        print(f'{name:<20} {res["bytes_per_user"]:>8.0f} {res["bytes_per_link"]:>8.0f} {res["bytes_per_vote"]:>8.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+
+"""
+All reddit models by name.
+"""
+
+from .simple import SimpleEngine
+from .bayes import BayesEngine, BayesBetaEngine
+from .bayes_suser import BayesSUserEngine
+
+
+# {model name: Engine class}
+ENGINES = {
+    'simple': SimpleEngine,
+    'bayes': BayesEngine,
+    'bayes_beta': BayesBetaEngine,
+    'bayes_suser': BayesSUserEngine,
+}
@@ -2,61 +2,194 @@
 
 """Pool of user and link"""
 
-from typing import Iterator, Callable
+import math
+import threading
+from typing import Iterator, Iterable, Callable
+from contextlib import nullcontext
 from dataclasses import dataclass
 
 from .comm import User, Link, Vote, VoteDir
+from .votestore import VoteStore, CODE_TO_DIR, CODE_TO_RELIABLE
+from .snapshot import Snapshot
 
 
 class UserPool:
     """All users"""
-    def __init__(self, constr: Callable[[int], User]):
+    def __init__(self, constr: Callable[[int], User], lock_stripes: int = 0):
+        """
+        :param lock_stripes: number of locks guarding creation of users, 0 if it is not used by threads.
+        """
         self._constr = constr
         # {id: User}
         self._users = {}
+        self._stripes = [threading.Lock() for _ in range(lock_stripes)]
+        # Ids of users that exist but are not created yet
+        self._saved_ids = []
+
+    def set_saved_ids(self, ids: Iterable[int]):
+        """Set ids of users in a loaded snapshot, they are created on first access"""
+        self._saved_ids = ids
 
     @property
     def users(self) -> Iterator[User]:
         """Return an iterator on all users"""
+        for id_ in self._saved_ids:
+            self.get(int(id_))
+        self._saved_ids = []
+
+        if self._stripes:
+            # Copy, users may be added by other threads while iterating
+            return iter(list(self._users.values()))
         return self._users.values()
 
     def get(self, id_: int) -> User:
         """Lazily retrieve an user"""
-        if id_ in self._users:
-            return self._users[id_]
-        else:
-            user = self._constr(id_)
-            self._users[user.id_] = user
+        user = self._users.get(id_, None)
+        if user is not None:
+            return user
+
+        lock = self._stripes[id_ % len(self._stripes)] if self._stripes else nullcontext()
+        with lock:
+            # Check again, another thread may have created it
+            user = self._users.get(id_, None)
+            if user is None:
+                user = self._constr(id_)
+                self._users[user.id_] = user
             return user
 
+    def find(self, id_: int) -> User | None:
+        """Retrieve a created user, None if it is not created, it is never created here"""
+        return self._users.get(id_, None)
+
 
 class LinkPool:
     """All linkes"""
-    def __init__(self, constr: Callable[[int], Link]):
+    def __init__(self, constr: Callable[[int], Link], lock_stripes: int = 0):
+        """
+        :param lock_stripes: number of locks guarding creation of links, 0 if it is not used by threads.
+        """
         self._constr = constr
         # {id: Link}
         self._links = {}
+        self._stripes = [threading.Lock() for _ in range(lock_stripes)]
+        # Ids of links that exist but are not created yet
+        self._saved_ids = []
+
+    def set_saved_ids(self, ids: Iterable[int]):
+        """Set ids of links in a loaded snapshot, they are created on first access"""
+        self._saved_ids = ids
 
     @property
     def links(self) -> Iterator[Link]:
         """Return an iterator on all links"""
+        for id_ in self._saved_ids:
+            self.get(int(id_))
+        self._saved_ids = []
+
+        if self._stripes:
+            # Copy, links may be added by other threads while iterating
+            return iter(list(self._links.values()))
         return self._links.values()
 
     def get(self, id_: int) -> Link:
         """Lazily retrieve a link"""
-        if id_ in self._links:
-            return self._links[id_]
-        else:
-            link = self._constr(id_)
-            self._links[link.id_] = link
+        link = self._links.get(id_, None)
+        if link is not None:
+            return link
+
+        lock = self._stripes[id_ % len(self._stripes)] if self._stripes else nullcontext()
+        with lock:
+            # Check again, another thread may have created it
+            link = self._links.get(id_, None)
+            if link is None:
+                link = self._constr(id_)
+                self._links[link.id_] = link
             return link
 
+    def find(self, id_: int) -> Link | None:
+        """Retrieve a created link, None if it is not created, it is never created here"""
+        return self._links.get(id_, None)
+
+
+# Number of locks guarding creation of users or links in a concurrent pool
+_LOCK_STRIPES = 64
+
 
 class ResourcePool:
     """Encapsulate all resource retrieval"""
-    def __init__(self, user_constr: Callable[[int], User], link_constr: Callable[[int], Link]):
-        self._user_pool = UserPool(user_constr)
-        self._link_pool = LinkPool(link_constr)
+    def __init__(self, user_constr: Callable[[int], User], link_constr: Callable[[int], Link],
+                 columnar_votes: bool = False, concurrent: bool = False):
+        """
+        :param columnar_votes: keep committed votes of all links in one columnar VoteStore
+                               instead of Vote objects in per link dicts.
+        :param concurrent: allow threads to vote at the same time.
+                           Creation of users and links is guarded by striped locks,
+                           each user and link gets its own lock.
+        """
+        self._concurrent = concurrent
+        stripes = _LOCK_STRIPES if concurrent else 0
+        self._user_constr = user_constr
+        self._user_pool = UserPool(self._new_user, lock_stripes=stripes)
+        self._link_constr = link_constr
+        self._vote_store = VoteStore(self.get_user, concurrent=concurrent) if columnar_votes else None
+        self._link_pool = LinkPool(self._new_link, lock_stripes=stripes)
+        # Inverted index of committed votes {user id: {link id: Link}}, the vote store has its own
+        self._user_link_index = {}
+        # Loaded snapshot, users and links in it are restored when they are created
+        self._snapshot = None
+        # [callable(link)] added to every link, see Link.add_quality_listener
+        self._quality_listeners = []
+        # Bound once, instead of a new bound method for every link
+        self._index_vote_listener = self._index_vote
+        self._unindex_vote_listener = self._unindex_vote
+
+    def _new_user(self, id_: int) -> User:
+        user = self._user_constr(id_)
+        if self._concurrent:
+            user.lock = threading.RLock()
+        if self._snapshot is not None:
+            state = self._snapshot.user_state(id_)
+            if state is not None:
+                user.restore_state(state)
+        return user
+
+    def _new_link(self, id_: int) -> Link:
+        link = self._link_constr(id_)
+        if self._concurrent:
+            link.lock = threading.RLock()
+        if self._vote_store is not None:
+            link.set_vote_storage(self._vote_store.view(id_))
+        else:
+            link.add_commit_listener(self._index_vote_listener)
+            link.add_retract_listener(self._unindex_vote_listener)
+        for listener in self._quality_listeners:
+            link.add_quality_listener(listener)
+
+        if self._snapshot is not None:
+            state = self._snapshot.link_state(id_)
+            if state is not None:
+                link.restore_votes(Vote(self.get_user(uid), CODE_TO_DIR[code], rev=None if math.isnan(rev) else rev,
+                                        reliable=CODE_TO_RELIABLE[reliable])
+                                   for uid, code, rev, reliable in self._snapshot.link_votes(id_))
+                link.restore_state(state)
+        return link
+
+    def _index_vote(self, link: Link, vote: Vote):
+        """Record that the vote's user has voted for the link"""
+        # setdefault, links of the same user may be committed by other threads
+        self._user_link_index.setdefault(vote.user.id_, {})[link.id_] = link
+
+    def _unindex_vote(self, link: Link, vote: Vote):
+        """Forget that the retracted vote's user has voted for the link"""
+        links = self._user_link_index.get(vote.user.id_, None)
+        if links is not None:
+            links.pop(link.id_, None)
+
+    def add_quality_listener(self, listener: Callable[[Link], None]):
+        """Add a quality listener to all links, including links created later"""
+        self._quality_listeners.append(listener)
+        for link in self.links:
+            link.add_quality_listener(listener)
 
     def get_user(self, id_: int) -> User:
         """Get User object with given user id"""
@@ -66,6 +199,38 @@ class ResourcePool:
         """Get Link object with given link id"""
         return self._link_pool.get(id_)
 
+    def find_user(self, id_: int) -> User | None:
+        """Get User object with given user id if the user exists, None if it is unknown, no user is created"""
+        user = self._user_pool.find(id_)
+        if user is None and self._snapshot is not None and self._snapshot.user_state(id_) is not None:
+            # A saved user is created on first access
+            user = self.get_user(id_)
+        return user
+
+    def find_link(self, id_: int) -> Link | None:
+        """Get Link object with given link id if the link exists, None if it is unknown, no link is created"""
+        link = self._link_pool.find(id_)
+        if link is None and self._snapshot is not None and self._snapshot.link_state(id_) is not None:
+            # A saved link is created on first access
+            link = self.get_link(id_)
+        return link
+
+    def group_votes(self, votes: Iterable[tuple[int, int, VoteDir]]) -> list[tuple[Link, list[Vote]]]:
+        """
+        Group votes by their links, votes are not staged,
+        so they can be staged and committed under the link lock.
+        :param votes: votes in [(user id, link id, vote dir)]
+        :return: [(link, votes of the link)], in the order links first appear in votes.
+        """
+        # {link id: (Link, [Vote])}
+        groups = {}
+        for user_id, link_id, dir_ in votes:
+            if link_id not in groups:
+                groups[link_id] = (self.get_link(link_id), [])
+            groups[link_id][1].append(Vote(self.get_user(user_id), dir_))
+
+        return list(groups.values())
+
     @property
     def users(self) -> Iterator[User]:
         """Return an iterator on all users"""
@@ -76,42 +241,68 @@ class ResourcePool:
         """Return an iterator on all links"""
         return self._link_pool.links
 
+    @property
+    def concurrent(self) -> bool:
+        """Whether threads may vote at the same time"""
+        return self._concurrent
+
+    @property
+    def vote_store(self) -> VoteStore | None:
+        """Columnar store of all committed votes, None if columnar votes is not enabled"""
+        return self._vote_store
+
     @dataclass(frozen=True)
     class LinkVote:
         """Combination of (a link that an user has voted, the vote)"""
         link: Link
         vote: Vote
 
-    def _print_user_summary(self):
-        # {user id: LinkVote}
-        uid_lv_map = {}
-        for link in self._link_pool.links:
-            for vote in link.votes:
-                uid = vote.user.id_
-                if uid not in uid_lv_map:
-                    uid_lv_map[uid] = []
+    def user_votes(self, user: User) -> Iterator[LinkVote]:
+        """Return an iterator on (link, vote) of all committed votes by given user"""
+        if self._snapshot is not None:
+            # Create saved links of this user, so their votes are indexed
+            for link_id in self._snapshot.user_link_ids(user.id_):
+                self.get_link(link_id)
 
-                uid_lv_map[uid].append(self.LinkVote(link=link, vote=vote))
+        if self._vote_store is not None:
+            links = [self.get_link(link_id) for link_id in self._vote_store.user_link_ids(user.id_)]
+        else:
+            # Copy, other threads may commit votes of this user while iterating
+            links = list(self._user_link_index.get(user.id_, {}).values())
+        # Skip a vote retracted after the copy
+        return (self.LinkVote(link=link, vote=vote) for link in links
+                if (vote := link.get_vote(user)) is not None)
+
+    def save(self, path: str):
+        """Save committed state of all users and links to a snapshot directory"""
+        Snapshot.from_objects(self.users, self.links).save(path)
+
+    @classmethod
+    def load(cls, path: str, user_constr: Callable[[int], User], link_constr: Callable[[int], Link],
+             mmap: bool = True, columnar_votes: bool = False, concurrent: bool = False) -> 'ResourcePool':
+        """
+        Create a pool from a snapshot directory saved by save.
+        Users and links are restored when they are first accessed.
+        :param mmap: map the snapshot into memory instead of reading it.
+        """
+        pool = cls(user_constr, link_constr, columnar_votes=columnar_votes, concurrent=concurrent)
+        pool._snapshot = Snapshot.load(path, mmap=mmap)
+        pool._user_pool.set_saved_ids(pool._snapshot.user_ids)
+        pool._link_pool.set_saved_ids(pool._snapshot.link_ids)
+        return pool
 
+    def _print_user_summary(self):
+        # Create saved links first, so votes of all links are in user tallies
+        _ = self.links
         for user in self._user_pool.users:
-            uid = user.id_
-            lvs = uid_lv_map.get(uid, [])
-            print(f'User: {uid}, votes: {len(lvs)}, reliability: {user.reliability}')
+            print(f'User: {user.id_}, votes: {user.vote_count}, reliability: {user.reliability}')
 
     def _print_link_summary(self):
         links = sorted(self._link_pool.links, key=lambda link: link.id_)
 
         for link in links:
-            upvotes = []
-            downvotes = []
-            for vote in link.votes:
-                if vote.dir_ == VoteDir.UP:
-                    upvotes.append(vote)
-                else:
-                    assert vote.dir_ == VoteDir.DOWN
-                    downvotes.append(vote)
-
-            print(f'Link: {link.id_}, up: {len(upvotes)}, down: {len(downvotes)}, quality: {link.quality}')
+            print(f'Link: {link.id_}, up: {link.up_vote_count}, down: {link.down_vote_count}, '
+                  f'quality: {link.quality}')
 
     def print_summary(self):
         """Show summary by users and links"""
@@ -125,26 +316,3 @@ class ResourcePool:
         print('##############')
         self._print_link_summary()
 
-
-_g_user_constr = None
-_g_link_constr = None
-_g_pool = None
-
-
-def cfg_pool(user_constr: Callable[[int], User], link_constr: Callable[[int], Link]):
-    """Config resource pool"""
-    global _g_user_constr
-    global _g_link_constr
-    assert (_g_user_constr is None) and (_g_link_constr is None), 'Only allow config pool once'
-    _g_user_constr = user_constr
-    _g_link_constr = link_constr
-
-
-def get_pool() -> ResourcePool:
-    """Singleton ResourcePool"""
-    global _g_pool
-    assert (_g_user_constr is not None) and (_g_link_constr is not None), 'cfg_pool must be called before calling get_pool'
-    if _g_pool is None:
-        _g_pool = ResourcePool(_g_user_constr, _g_link_constr)
-
-    return _g_pool
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+"""
+Ranking of links by quality, maintained as votes are committed.
+
+Links are kept in a treap (a randomized balanced binary search tree) augmented with subtree sizes,
+so top_k and rank take O(log n) expected time, plus O(k) for the k links returned.
+"""
+
+import random
+import threading
+from typing import Callable
+
+from .comm import Link
+from .pool import ResourcePool
+
+
+def mean_score(link: Link) -> float | None:
+    """Rank by posterior mean, i.e. link quality"""
+    return link.quality
+
+
+def lower_bound_score(alpha: float = 0.05) -> Callable[[Link], float | None]:
+    """
+    Rank by lower credible bound, i.e. the alpha percentile of link quality posterior.
+    Links with few votes rank lower than links with the same mean and more votes.
+    Only for links with a posterior, e.g. BLink.
+    """
+    assert 0 < alpha < 1
+
+    def score(link: Link) -> float:
+        return link.percentile(alpha * 100)
+
+    return score
+
+
+class _Node:
+    __slots__ = ('key', 'prio', 'size', 'left', 'right')
+
+    def __init__(self, key: tuple[float, int]):
+        self.key = key
+        self.prio = random.random()
+        self.size = 1
+        self.left = None
+        self.right = None
+
+
+def _size(node: _Node | None) -> int:
+    return 0 if node is None else node.size
+
+
+def _fix_size(node: _Node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _split(node: _Node | None, key: tuple[float, int]) -> tuple[_Node | None, _Node | None]:
+    """Split into (keys < key, keys >= key)"""
+    if node is None:
+        return None, None
+
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        _fix_size(node)
+        return node, right
+    else:
+        left, node.left = _split(node.left, key)
+        _fix_size(node)
+        return left, node
+
+
+def _merge(left: _Node | None, right: _Node | None) -> _Node | None:
+    """Merge two treaps, all keys of left are less than keys of right"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+
+    if left.prio > right.prio:
+        left.right = _merge(left.right, right)
+        _fix_size(left)
+        return left
+    else:
+        right.left = _merge(left, right.left)
+        _fix_size(right)
+        return right
+
+
+class RankingIndex:
+    """Links of a pool ranked by a score, best first"""
+    def __init__(self, pool: ResourcePool, score: Callable[[Link], float | None] = mean_score):
+        """
+        Index all links of the pool, and follow their quality changes.
+        Create it before threads vote, links created meanwhile may be followed twice.
+        :param score: score of a link, None if the link is not ranked yet
+        """
+        self._score = score
+        self._root = None
+        # Key of each ranked link {link id: (-score, link id)}
+        self._keys = {}
+        self._lock = threading.Lock()
+        pool.add_quality_listener(self.update)
+        for link in pool.links:
+            self.update(link)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _insert(self, key: tuple[float, int]):
+        left, right = _split(self._root, key)
+        self._root = _merge(_merge(left, _Node(key)), right)
+
+    def _remove(self, key: tuple[float, int]):
+        left, right = _split(self._root, key)
+        # The first node of right is the key
+        _, right = _split(right, (key[0], key[1] + 1))
+        self._root = _merge(left, right)
+
+    def update(self, link: Link):
+        """Re-rank a link after its quality changed, e.g. restored by refit"""
+        score = self._score(link)
+        # Higher score first, then lower link id first
+        key = None if score is None else (-score, link.id_)
+        with self._lock:
+            old_key = self._keys.get(link.id_, None)
+            if old_key == key:
+                return
+
+            if old_key is not None:
+                self._remove(old_key)
+                del self._keys[link.id_]
+            if key is not None:
+                self._insert(key)
+                self._keys[link.id_] = key
+
+    def top_k(self, k: int) -> list[tuple[int, float]]:
+        """:return: [(link id, score)] of the best k links"""
+        assert k >= 0
+        res = []
+        with self._lock:
+            # In order traversal, stop after k nodes
+            stack = []
+            node = self._root
+            while (stack or node is not None) and len(res) < k:
+                while node is not None:
+                    stack.append(node)
+                    node = node.left
+                node = stack.pop()
+                res.append((node.key[1], -node.key[0]))
+                node = node.right
+        return res
+
+    def rank(self, link_id: int) -> int | None:
+        """:return: 0 based rank of a link, None if the link is not ranked"""
+        with self._lock:
+            key = self._keys.get(link_id, None)
+            if key is None:
+                return None
+
+            # Count keys less than key
+            rank = 0
+            node = self._root
+            while node.key != key:
+                if key < node.key:
+                    node = node.left
+                else:
+                    rank += _size(node.left) + 1
+                    node = node.right
+            return rank + _size(node.left)
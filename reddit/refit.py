@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+"""
+Offline joint re-estimation of all bayes users and links.
+
+reddit.bayes updates users and links greedily in vote order.
+refit uses all committed votes at once, and alternates
+- all link quality posteriors, given user reversibilities
+- all user reliability posteriors, given link qualities
+until user reliabilities converge, then writes posteriors back to the pool.
+The reversibility and evidence of each vote in the written posteriors are recorded in the vote
+(Vote.rev, Vote.reliable), so a vote replaced or retracted later is removed as refit added it,
+and quality listeners of all links are notified.
+
+Like reddit.bayes, the link quality used to judge a vote excludes the vote itself.
+"""
+
+import numpy as np
+
+from .comm import VoteDir
+from .pool import ResourcePool
+from .bayesobj import log_likes
+from .votestore import DIR_TO_CODE, RELIABLE_TO_CODE, CODE_TO_RELIABLE
+
+
+class _VoteMatrix:
+    """Committed votes as sparse (user, link) entries, sorted by link"""
+    def __init__(self, pool: ResourcePool):
+        users = sorted(pool.users, key=lambda u: u.id_)
+        links = sorted(pool.links, key=lambda link: link.id_)
+        self.users = users
+        self.links = links
+        user_ids = np.array([u.id_ for u in users], dtype=np.int64)
+
+        store = pool.vote_store
+        # Committed Vote objects, None for votes in columns
+        votes = None
+        if store is not None:
+            vote_user_ids, vote_link_ids, dirs = (col.astype(np.int64) for col in store.columns)
+        else:
+            link_votes = [(link.id_, v) for link in links for v in link.votes]
+            votes = [v for _, v in link_votes]
+            vote_cols = np.array([(v.user.id_, link_id, DIR_TO_CODE[v.dir_]) for link_id, v in link_votes],
+                                 dtype=np.int64).reshape(-1, 3)
+            vote_user_ids, vote_link_ids, dirs = vote_cols.T
+
+        order = np.argsort(vote_link_ids, kind='stable')
+        self.store = store
+        # Vote objects, or rows of the store, in the sorted order
+        self.votes = None if votes is None else [votes[i] for i in order]
+        self.store_rows = order if votes is None else None
+        vote_link_ids = vote_link_ids[order]
+        # Row of user / link of each vote
+        self.user_rows = np.searchsorted(user_ids, vote_user_ids[order])
+        self.link_rows = np.searchsorted(np.array([link.id_ for link in links], dtype=np.int64), vote_link_ids)
+        self.is_up = dirs[order] == DIR_TO_CODE[VoteDir.UP]
+
+
+def _shift_log(logps: np.ndarray) -> np.ndarray:
+    """Row-wise log probabilities shifted to max 0, like log posteriors of GridSuite"""
+    return logps - logps.max(axis=1, keepdims=True)
+
+
+def _normalize_log(logps: np.ndarray) -> np.ndarray:
+    """Row-wise normalized probabilities from log probabilities"""
+    ps = np.exp(_shift_log(logps))
+    return ps / ps.sum(axis=1, keepdims=True)
+
+
+def _vote_loglikes(xs: np.ndarray, is_up: np.ndarray, rev: np.ndarray) -> np.ndarray:
+    """
+    Log likelihoods of votes (rows) under link quality hypotheses (columns), see LinkQuality.
+    measured U likelihood = x * (1 - rev) + (1 - x) * rev = rev + x * (1 - 2 * rev)
+    measured D likelihood = 1 - measured U likelihood
+    """
+    base = np.where(is_up, rev, 1 - rev)
+    slope = np.where(is_up, 1 - 2 * rev, 2 * rev - 1)
+    return log_likes(base[:, None] + slope[:, None] * xs[None, :])
+
+
+def _annotate_votes(vm: _VoteMatrix, rev: np.ndarray, reliable: np.ndarray, unreliable: np.ndarray):
+    """Record the reversibility and evidence each vote is counted with in refit posteriors"""
+    revs = rev[vm.user_rows]
+    reliables = np.where(reliable, RELIABLE_TO_CODE[True], np.where(unreliable, RELIABLE_TO_CODE[False],
+                                                                    RELIABLE_TO_CODE[None])).astype(np.int8)
+    if vm.votes is None:
+        vm.store.annotate_rows(vm.store_rows, revs, reliables)
+        return
+
+    for v, v_rev, code in zip(vm.votes, revs.tolist(), reliables.tolist()):
+        v.rev = v_rev
+        v.reliable = CODE_TO_RELIABLE[code]
+
+
+def refit(pool: ResourcePool, max_iter: int = 100, tol: float = 1e-6, chunk_size: int = 100000) -> int:
+    """
+    Re-estimate all users and links of a pool of BUser and BLink.
+    :param tol: stop when no user reliability changes more than this
+    :param chunk_size: votes processed at a time, temporary arrays are chunk_size x grid size floats
+    :return: number of iterations
+    """
+    assert max_iter > 0
+    vm = _VoteMatrix(pool)
+    if not vm.users or not vm.links:
+        return 0
+
+    # Whole grids, hypotheses pruned in the pool may come back with all votes
+    link_xs = vm.links[0].posterior.grid_hypos
+    user_xs = vm.users[0].posterior.grid_hypos
+    delta = 0.0001
+
+    # Clipped as in posteriors of the pool, so evidence removed from refit posteriors later comes off exactly
+    log_x = log_likes(user_xs)
+    log_1mx = log_likes(1 - user_xs)
+
+    reli = np.array([u.reliability for u in vm.users])
+    link_logps = np.zeros((len(vm.links), len(link_xs)))
+    user_logps = np.zeros((len(vm.users), len(user_xs)))
+    it = 0
+    while it < max_iter:
+        it += 1
+        rev = 1 - reli
+
+        # Link posteriors with all votes
+        link_logps[:] = 0
+        for b in range(0, len(vm.is_up), chunk_size):
+            e = b + chunk_size
+            loglikes = _vote_loglikes(link_xs, vm.is_up[b:e], rev[vm.user_rows[b:e]])
+            # Votes are sorted by link
+            rows, starts = np.unique(vm.link_rows[b:e], return_index=True)
+            link_logps[rows] += np.add.reduceat(loglikes, starts, axis=0)
+
+        # Quality of each vote's link without that vote
+        lq_without = np.empty(len(vm.is_up))
+        for b in range(0, len(vm.is_up), chunk_size):
+            e = b + chunk_size
+            loglikes = _vote_loglikes(link_xs, vm.is_up[b:e], rev[vm.user_rows[b:e]])
+            ps = _normalize_log(link_logps[vm.link_rows[b:e]] - loglikes)
+            lq_without[b:e] = ps @ link_xs
+
+        # User posteriors with judgable votes, see UserReliability
+        link_is_good = lq_without > 0.5 + delta
+        link_is_bad = lq_without < 0.5 - delta
+        reliable = (link_is_good & vm.is_up) | (link_is_bad & ~vm.is_up)
+        unreliable = (link_is_good & ~vm.is_up) | (link_is_bad & vm.is_up)
+        reli_cnt = np.bincount(vm.user_rows, weights=reliable, minlength=len(vm.users))
+        unreli_cnt = np.bincount(vm.user_rows, weights=unreliable, minlength=len(vm.users))
+        user_logps[:] = reli_cnt[:, None] * log_x + unreli_cnt[:, None] * log_1mx
+
+        new_reli = _normalize_log(user_logps) @ user_xs
+        converged = np.max(np.abs(new_reli - reli)) < tol
+        reli = new_reli
+        if converged:
+            break
+
+    # Link posteriors are of votes with rev, user posteriors of their evidence of the last iteration
+    _annotate_votes(vm, rev, reliable, unreliable)
+    for link, logps in zip(vm.links, _shift_log(link_logps)):
+        link.restore_state(logps)
+    for user, logps in zip(vm.users, _shift_log(user_logps)):
+        user.restore_state(logps)
+    for link in vm.links:
+        link.quality_changed()
+
+    return it
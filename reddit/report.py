@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""
+Summaries of users and links of a pool, streamed to files in chunks.
+
+Summaries are read from running tallies kept as votes are committed, no vote is scanned,
+so a summary of a big pool can be taken while votes are ingested.
+Each user or link is read under its lock, so its values agree with each other,
+except user tallies, which are counted by links without the user lock.
+Votes committed during an export may be in some summaries and not in others.
+
+Supported formats, selected by file extension:
+- .csv: a header line of field names, then a line per summary, an unknown value is empty
+- .jsonl: a JSON object per line, an unknown value is null
+"""
+
+import os
+import csv
+import json
+import argparse
+import dataclasses
+from typing import Iterator, Iterable
+from dataclasses import dataclass
+
+from .pool import ResourcePool
+from .models import ENGINES
+
+
+@dataclass(frozen=True)
+class UserSummary:
+    """Aggregates of a user"""
+    id_: int
+    votes: int
+    up: int
+    down: int
+    reliability: float
+
+
+@dataclass(frozen=True)
+class LinkSummary:
+    """Aggregates of a link"""
+    id_: int
+    up: int
+    down: int
+    # None if it is not known yet
+    quality: float | None
+
+
+Summary = UserSummary | LinkSummary
+
+
+def user_summaries(pool: ResourcePool) -> Iterator[UserSummary]:
+    """Summaries of all users of a pool"""
+    # Create saved links first, so votes of all links are in user tallies
+    _ = pool.links
+    for user in pool.users:
+        with user.lock:
+            up, down = user.up_vote_count, user.down_vote_count
+            summary = UserSummary(id_=user.id_, votes=up + down, up=up, down=down,
+                                  reliability=user.reliability)
+        # Not under the lock, the consumer may take long or never resume
+        yield summary
+
+
+def link_summaries(pool: ResourcePool) -> Iterator[LinkSummary]:
+    """Summaries of all links of a pool"""
+    for link in pool.links:
+        with link.lock:
+            summary = LinkSummary(id_=link.id_, up=link.up_vote_count, down=link.down_vote_count,
+                                  quality=link.quality)
+        yield summary
+
+
+def _report_format(path: str) -> str:
+    fmt = os.path.splitext(path)[1].lstrip('.')
+    assert fmt in ('csv', 'jsonl'), f'Unsupported report format: {path}'
+    return fmt
+
+
+def export(path: str, summaries: Iterable[Summary], chunk_size: int = 10000) -> int:
+    """
+    Write summaries of one kind to a file, the format is selected by file extension.
+    :param chunk_size: summaries buffered before a write
+    :return: number of summaries written
+    """
+    assert chunk_size > 0
+    fmt = _report_format(path)
+    cnt = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f) if fmt == 'csv' else None
+        names = None
+        rows = []
+
+        def flush():
+            if writer is not None:
+                writer.writerows(rows)
+            else:
+                f.writelines(f'{json.dumps(dict(zip(names, row)))}\n' for row in rows)
+            rows.clear()
+
+        for s in summaries:
+            if names is None:
+                names = [field.name for field in dataclasses.fields(s)]
+                if writer is not None:
+                    writer.writerow(names)
+            rows.append([getattr(s, name) for name in names])
+            cnt += 1
+            if len(rows) == chunk_size:
+                flush()
+        flush()
+    return cnt
+
+
+def main():
+    """Export user and link summaries of a pool snapshot"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('snapshot', help='snapshot directory saved by ResourcePool.save')
+    parser.add_argument('--model', choices=list(ENGINES), default='bayes', help='model of the snapshot')
+    parser.add_argument('--users', help='export user summaries to this .csv or .jsonl file')
+    parser.add_argument('--links', help='export link summaries to this .csv or .jsonl file')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    pool = ENGINES[args.model].load(args.snapshot).pool
+    if args.links is not None:
+        print(f'Links: {export(args.links, link_summaries(pool), chunk_size=args.chunk_size)}')
+    if args.users is not None:
+        print(f'Users: {export(args.users, user_summaries(pool), chunk_size=args.chunk_size)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""
+Sensitivity of model results to vote order.
+
+Models that judge a vote by the link quality before it, e.g. bayes, may give different results
+for the same votes in different orders.
+The same votes are replayed under many seeded permutations in a process pool,
+and the spread of every link quality and user reliability over the replays is reported.
+
+Each replay creates its own engine, so replays share no state.
+Votes are sent to each worker process once, a replay task is only its permutation number.
+"""
+
+import io
+import os
+import argparse
+import contextlib
+from typing import Iterable
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+
+import numpy as np
+
+from .comm import VoteDir
+from .models import ENGINES
+from .votestore import DIR_TO_CODE, CODE_TO_DIR
+from .votelog import read_chunks
+from .test_vec import gen_test_vec
+
+
+# Votes of the worker process, (model, user ids, link ids, vote dir codes), set by _init_worker
+_g_votes = None
+# (sorted unique user ids, sorted unique link ids) of _g_votes
+_g_ids = None
+
+
+def _init_worker(model: str, user_ids: np.ndarray, link_ids: np.ndarray, dirs: np.ndarray):
+    global _g_votes, _g_ids
+    _g_votes = (model, user_ids, link_ids, dirs)
+    _g_ids = (np.unique(user_ids).tolist(), np.unique(link_ids).tolist())
+
+
+def _permutation(seed: int, i: int, n: int) -> np.ndarray:
+    return np.random.default_rng([seed, i]).permutation(n)
+
+
+def _replay(seed: int, i: int, batch_size: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Replay votes of this worker in permutation i.
+    :return: (link qualities in the order of sorted link ids, NaN if unknown,
+              user reliabilities in the order of sorted user ids)
+    """
+    model, user_ids, link_ids, dirs = _g_votes
+    order = _permutation(seed, i, len(dirs))
+    votes = [(user_id, link_id, CODE_TO_DIR[code]) for user_id, link_id, code
+             in zip(user_ids[order].tolist(), link_ids[order].tolist(), dirs[order].tolist())]
+
+    engine = ENGINES[model]()
+    if batch_size == 1:
+        for vote in votes:
+            engine.vote(*vote)
+    else:
+        for b in range(0, len(votes), batch_size):
+            engine.vote_many(votes[b:b + batch_size])
+
+    pool = engine.pool
+    sorted_user_ids, sorted_link_ids = _g_ids
+    qualities = [pool.get_link(link_id).quality for link_id in sorted_link_ids]
+    reliabilities = [pool.get_user(user_id).reliability for user_id in sorted_user_ids]
+    return (np.array([np.nan if q is None else q for q in qualities], dtype=float),
+            np.array(reliabilities, dtype=float))
+
+
+class _RunningSpread:
+    """Mean, variance (Welford), min and max of arrays, added one at a time"""
+    def __init__(self, size: int):
+        self.n = 0
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+
+    def add(self, xs: np.ndarray):
+        self.n += 1
+        delta = xs - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (xs - self.mean)
+        self.min = np.minimum(self.min, xs)
+        self.max = np.maximum(self.max, xs)
+
+
+@dataclass(frozen=True)
+class Spread:
+    """Spread of a value of each object over replays, arrays are in the order of ids"""
+    ids: np.ndarray
+    mean: np.ndarray
+    std: np.ndarray
+    min: np.ndarray
+    max: np.ndarray
+
+    @property
+    def range(self) -> np.ndarray:
+        """max - min"""
+        return self.max - self.min
+
+    def most_sensitive(self, n: int) -> list[tuple[int, float]]:
+        """:return: [(id, range)] of n objects with the widest ranges"""
+        order = np.argsort(-np.nan_to_num(self.range, nan=-np.inf), kind='stable')[:n]
+        return [(int(self.ids[i]), float(self.range[i])) for i in order]
+
+    @classmethod
+    def _of(cls, ids: np.ndarray, running: _RunningSpread) -> 'Spread':
+        return cls(ids=ids, mean=running.mean, std=np.sqrt(running.m2 / running.n),
+                   min=running.min, max=running.max)
+
+
+@dataclass(frozen=True)
+class Sensitivity:
+    """Spreads of link qualities and user reliabilities over vote order permutations"""
+    model: str
+    permutations: int
+    links: Spread
+    users: Spread
+
+
+def analyze(model: str, votes: Iterable[tuple[int, int, VoteDir]], permutations: int = 100,
+            workers: int | None = None, seed: int = 0, batch_size: int = 1) -> Sensitivity:
+    """
+    Replay the same votes in seeded permutations, and measure the spread of results.
+    A link quality unknown in a replay is NaN, and makes its spread NaN.
+    :param workers: worker processes, None for the number of CPUs, 0 to replay in this process.
+    :param batch_size: 1 to call vote for each vote, otherwise votes per vote_many call
+    """
+    assert permutations > 0 and batch_size > 0
+    votes = list(votes)
+    assert votes, 'No vote'
+    user_ids = np.array([v[0] for v in votes], dtype=np.int64)
+    link_ids = np.array([v[1] for v in votes], dtype=np.int64)
+    dirs = np.array([DIR_TO_CODE[v[2]] for v in votes], dtype=np.int8)
+    unique_link_ids, unique_user_ids = np.unique(link_ids), np.unique(user_ids)
+
+    link_spread = _RunningSpread(len(unique_link_ids))
+    user_spread = _RunningSpread(len(unique_user_ids))
+    initargs = (model, user_ids, link_ids, dirs)
+    n = permutations
+    with contextlib.ExitStack() as stack:
+        if workers == 0:
+            _init_worker(*initargs)
+            results = map(_replay, [seed] * n, range(n), [batch_size] * n)
+        else:
+            executor = stack.enter_context(ProcessPoolExecutor(
+                max_workers=workers, mp_context=mp.get_context('spawn'),
+                initializer=_init_worker, initargs=initargs))
+            # A few tasks per worker, to balance load with little overhead per replay
+            chunksize = max(1, n // (4 * (workers or os.cpu_count() or 1)))
+            results = executor.map(_replay, [seed] * n, range(n), [batch_size] * n, chunksize=chunksize)
+
+        for qualities, reliabilities in results:
+            link_spread.add(qualities)
+            user_spread.add(reliabilities)
+
+    return Sensitivity(model=model, permutations=permutations,
+                       links=Spread._of(unique_link_ids, link_spread),
+                       users=Spread._of(unique_user_ids, user_spread))
+
+
+def main():
+    """Print the links and users most sensitive to vote order"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=list(ENGINES), default='bayes')
+    parser.add_argument('--votes', help='vote log (.csv, .jsonl or .bin), the test vector if not given')
+    parser.add_argument('--permutations', type=int, default=100)
+    parser.add_argument('--workers', type=int, help='worker processes, 0 to replay in this process')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=1, help='1 to call vote, otherwise vote_many batch size')
+    parser.add_argument('--top', type=int, default=10, help='number of links and users shown')
+    args = parser.parse_args()
+
+    if args.votes is None:
+        # Quiet test vector summary
+        with contextlib.redirect_stdout(io.StringIO()):
+            votes = gen_test_vec(shuffle=False)
+    else:
+        votes = [v for chunk in read_chunks(args.votes) for v in chunk.votes]
+
+    res = analyze(args.model, votes, permutations=args.permutations, workers=args.workers,
+                  seed=args.seed, batch_size=args.batch_size)
+    for name, spread in (('Link quality', res.links), ('User reliability', res.users)):
+        print(f'# {name}, max std: {np.nanmax(spread.std):.6f}, mean std: {np.nanmean(spread.std):.6f}')
+        index = {int(id_): i for i, id_ in enumerate(spread.ids)}
+        for id_, width in spread.most_sensitive(args.top):
+            i = index[id_]
+            print(f'{id_:>10} mean: {spread.mean[i]:.6f} std: {spread.std[i]:.6f} '
+                  f'min: {spread.min[i]:.6f} max: {spread.max[i]:.6f} range: {width:.6f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+"""
+Vote service over a local TCP or Unix socket.
+
+Requests and responses are JSON lines, responses are in the order of requests of a connection.
+- {"op": "vote", "user_id": 3, "link_id": 100, "dir": "UP"} -> {"ok": true} after the vote is committed
+- {"op": "quality", "link_id": 100} -> {"quality": 0.8}
+- {"op": "reliability", "user_id": 3} -> {"reliability": 0.9}
+- A query of a link or user never voted is {"quality": null, "unknown": true}, the same for reliability,
+  queries never create links or users.
+- {"op": "stats"} -> {"votes": ..., "batches": ..., "latency_p50_ms": ..., "latency_p99_ms": ...}
+
+Votes go through a bounded queue to a single writer task, which commits them in micro-batches with
+the model's vote_many. When the queue is full, connections stop reading, which pushes back on producers.
+Queries are answered between batches, from the last committed state.
+"""
+
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from typing import Callable
+
+import numpy as np
+
+from .comm import VoteDir
+from .pool import ResourcePool
+from .models import ENGINES
+
+
+class VoteService:
+    """Asyncio vote service of a model"""
+    def __init__(self, vote_many: Callable[[list[tuple[int, int, VoteDir]]], None], pool: ResourcePool,
+                 max_batch: int = 1000, max_delay: float = 0.002, queue_size: int = 10000,
+                 latency_window: int = 100000):
+        """
+        :param vote_many: vote_many of a model
+        :param pool: resource pool of the model, for queries
+        :param max_batch: max votes committed at once
+        :param max_delay: max seconds the writer waits to fill a batch
+        :param queue_size: max votes waiting to be committed
+        :param latency_window: ingest latency percentiles are over this many latest votes
+        """
+        self._vote_many = vote_many
+        self._pool = pool
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._queue_size = queue_size
+        self._queue = None
+        # Seconds from a vote received to committed
+        self._latencies = deque(maxlen=latency_window)
+        self._vote_cnt = 0
+        self._batch_cnt = 0
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self._max_delay
+        while len(batch) < self._max_batch:
+            timeout = deadline - asyncio.get_running_loop().time()
+            try:
+                if timeout <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+
+    async def _writer(self):
+        """The only task that changes the model"""
+        while True:
+            batch = await self._next_batch()
+            try:
+                self._vote_many([vote for vote, _, _ in batch])
+            except Exception as e:  # pylint: disable=W0718
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            for _, fut, t_recv in batch:
+                self._latencies.append(now - t_recv)
+                fut.set_result({'ok': True})
+            self._vote_cnt += len(batch)
+            self._batch_cnt += 1
+
+    def stats(self) -> dict:
+        """Ingest statistics"""
+        lats = np.array(self._latencies)
+        p50, p99 = np.percentile(lats, [50, 99]) * 1000 if len(lats) > 0 else (None, None)
+        return {
+            'votes': self._vote_cnt,
+            'batches': self._batch_cnt,
+            'queued': self._queue.qsize(),
+            'latency_p50_ms': None if p50 is None else float(p50),
+            'latency_p99_ms': None if p99 is None else float(p99),
+        }
+
+    def _query(self, req: dict) -> dict:
+        op = req['op']
+        if op == 'quality':
+            link = self._pool.find_link(int(req['link_id']))
+            return {'quality': None, 'unknown': True} if link is None else {'quality': link.quality}
+        elif op == 'reliability':
+            user = self._pool.find_user(int(req['user_id']))
+            return {'reliability': None, 'unknown': True} if user is None else {'reliability': user.reliability}
+        else:
+            assert op == 'stats', f'Unknown op {op}'
+            return self.stats()
+
+    async def _handle_request(self, line: bytes) -> asyncio.Future:
+        """:return: future of the response"""
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            req = json.loads(line)
+            if req['op'] == 'vote':
+                vote = (int(req['user_id']), int(req['link_id']), VoteDir[req['dir']])
+                # Wait here when the queue is full
+                await self._queue.put((vote, fut, time.perf_counter()))
+            else:
+                fut.set_result(self._query(req))
+        except Exception as e:  # pylint: disable=W0718
+            fut.set_exception(e)
+        return fut
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, responses: asyncio.Queue):
+        while (fut := await responses.get()) is not None:
+            try:
+                resp = await fut
+            except Exception as e:  # pylint: disable=W0718
+                resp = {'error': repr(e)}
+            writer.write((json.dumps(resp) + '\n').encode())
+            await writer.drain()
+
+    async def _handle_conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Futures of responses in request order
+        responses = asyncio.Queue()
+        responder = asyncio.create_task(self._respond(writer, responses))
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    await responses.put(await self._handle_request(line))
+        finally:
+            await responses.put(None)
+            await responder
+            writer.close()
+            await writer.wait_closed()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 0, path: str | None = None,
+                    started: Callable[[asyncio.AbstractServer], None] | None = None):
+        """
+        Serve until cancelled.
+        :param path: serve on this Unix socket instead of TCP host and port
+        :param started: called with the server once it listens
+        """
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        writer = asyncio.create_task(self._writer())
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle_conn, path=path)
+        else:
+            server = await asyncio.start_server(self._handle_conn, host=host, port=port)
+
+        try:
+            async with server:
+                if started is not None:
+                    started(server)
+                await server.serve_forever()
+        finally:
+            writer.cancel()
+
+
+def main():
+    """Serve a reddit model"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=list(ENGINES), default='bayes')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='serve on this Unix socket path instead of TCP')
+    parser.add_argument('--max-batch', type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = ENGINES[args.model]()
+    service = VoteService(engine.vote_many, engine.pool, max_batch=args.max_batch)
+    asyncio.run(service.serve(host=args.host, port=args.port, path=args.unix))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+"""
+Reddit bayes model with links and users sharded over worker processes.
+
+Links are partitioned by `link id % shard count`, and users by `user id % shard count`,
+each shard process owns its links and users.
+The coordinator (ShardedBayes) in the calling process only routes votes and reliability updates.
+
+A batch of votes goes in two steps:
+- link shards commit votes of their links in parallel, and judge each vote, see commit_judged_votes
+- user shards update reliabilities of their users with the judged votes in parallel,
+  the coordinator does not wait for them until it has to, i.e. before it publishes reliabilities,
+  or before the next request to the same shard.
+
+Consistency of user reliability:
+a link update needs reliabilities of its voters, which change as votes of other shards come in.
+The coordinator publishes a snapshot of user reliabilities every `sync_interval` batches,
+and sends the published reliability of each voter along with the vote.
+So a shard sees user reliabilities at most `sync_interval` batches old.
+With a batch of one vote and `sync_interval=1`, the result is the same as reddit.bayes.vote.
+
+An exception in a shard is sent back with its traceback, and raised as RuntimeError by the coordinator,
+the shard keeps serving.
+"""
+
+import traceback
+import multiprocessing as mp
+from typing import Iterable
+
+from .comm import Vote, VoteDir
+from .simpleobj import SUser
+from .bayesobj import BUser, BLink
+from .pool import ResourcePool, UserPool
+from .bayes import commit_judged_votes
+
+
+# Reliability update of a user (user id, vote dir, link quality without the vote, evidence of the vote it replaced)
+ReliabilityUpdate = tuple[int, VoteDir, float, bool | None]
+
+
+def _shard_vote_many(pool: ResourcePool, votes: list[tuple[int, float, int, VoteDir]]) -> list[ReliabilityUpdate]:
+    """
+    Commit votes of links in this shard.
+    :param votes: [(user id, user reliability, link id, vote dir)]
+    :return: reliability updates of voters, see commit_judged_votes.
+    """
+    for user_id, reli, _, _ in votes:
+        # Voters of links are replicas, only their reliabilities are used
+        pool.get_user(user_id).reliability = reli
+
+    reli_updates = []
+    for link, link_votes in pool.group_votes((user_id, link_id, dir_) for user_id, _, link_id, dir_ in votes):
+        reli_updates.extend((v.user.id_, v.dir_, lq, replaced)
+                            for v, lq, replaced in commit_judged_votes(link, link_votes))
+
+    return reli_updates
+
+
+def _shard_update_users(users: UserPool, updates: list[ReliabilityUpdate]) -> dict[int, float]:
+    """
+    Update reliabilities of users in this shard.
+    :return: new reliabilities of updated users {user id: reliability}
+    """
+    for user_id, dir_, lq, replaced in updates:
+        user = users.get(user_id)
+        user.update_reliability(Vote(user, dir_), lq, replaced)
+    return {user_id: users.get(user_id).reliability for user_id, _, _, _ in updates}
+
+
+def _shard_main(conn):
+    """Message loop of a shard process"""
+    pool = ResourcePool(SUser, BLink)
+    users = UserPool(BUser)
+    handlers = {
+        'vote': lambda arg: _shard_vote_many(pool, arg),
+        'reliability': lambda arg: _shard_update_users(users, arg),
+        'quality': lambda arg: ({link.id_: link.quality for link in pool.links} if arg is None
+                                else pool.get_link(arg).quality),
+        # State of a user, None for a user without votes
+        'user': lambda arg: None if (user := users.find(arg)) is None else user.state(),
+        'users': lambda _: [(user.id_, user.state()) for user in users.users],
+    }
+    while True:
+        cmd, arg = conn.recv()
+        if cmd == 'stop':
+            conn.close()
+            return
+
+        try:
+            conn.send(('ok', handlers[cmd](arg)))
+        except Exception:  # pylint: disable=W0718
+            # Sent back to the coordinator, this shard keeps serving
+            conn.send(('error', traceback.format_exc()))
+
+
+class ShardedBayes:
+    """Bayes model with links and users in worker processes"""
+    def __init__(self, shard_count: int, sync_interval: int = 1):
+        """
+        :param shard_count: number of worker processes
+        :param sync_interval: publish user reliabilities to shards every this many batches
+        """
+        assert shard_count > 0
+        assert sync_interval > 0
+        self._sync_interval = sync_interval
+        self._batch_cnt = 0
+        # Reliability of a user without votes
+        self._prior_reli = BUser(0).reliability
+        # Reliabilities seen by shards {user id: reliability}
+        self._published_reli = {}
+        # Reliabilities received after the last publish {user id: reliability}
+        self._fresh_reli = {}
+
+        self._conns = []
+        self._procs = []
+        for _ in range(shard_count):
+            conn, child_conn = mp.Pipe()
+            proc = mp.Process(target=_shard_main, args=(child_conn,), daemon=True)
+            proc.start()
+            child_conn.close()
+            self._conns.append(conn)
+            self._procs.append(proc)
+        # Number of reliability replies not received yet of each shard
+        self._pending = [0] * shard_count
+
+    def __enter__(self) -> 'ShardedBayes':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Stop shard processes"""
+        for i, conn in enumerate(self._conns):
+            # Replies left in the pipe are dropped, errors of them are not raised any more
+            self._drain(i)
+            conn.send(('stop', None))
+            conn.close()
+        for proc in self._procs:
+            proc.join()
+        self._conns = []
+        self._procs = []
+        self._pending = []
+
+    def _shard(self, id_: int) -> int:
+        return id_ % len(self._conns)
+
+    def _drain(self, i: int) -> list[str]:
+        """
+        Receive pending reliability replies of a shard.
+        :return: tracebacks of failed ones
+        """
+        errors = []
+        while self._pending[i]:
+            self._pending[i] -= 1
+            status, reply = self._conns[i].recv()
+            if status == 'ok':
+                self._fresh_reli.update(reply)
+            else:
+                errors.append(reply)
+        return errors
+
+    def _send(self, i: int, cmd: str, arg) -> list[str]:
+        """
+        Send a request to a shard after receiving its pending reliability replies,
+        so neither end blocks on a full pipe, other shards keep working meanwhile.
+        :return: tracebacks of failed pending replies
+        """
+        errors = self._drain(i)
+        self._conns[i].send((cmd, arg))
+        return errors
+
+    @staticmethod
+    def _raise_errors(errors: list[str]):
+        if errors:
+            raise RuntimeError(f'{len(errors)} shard request(s) failed, the first one:\n{errors[0]}')
+
+    def _request(self, requests: Iterable[tuple[int, str, object]]) -> list:
+        """
+        Send requests to shards and receive their replies, see _send.
+        All replies are received before an error is raised, so no reply is left behind.
+        :param requests: [(shard, command, argument)], at most one request per shard
+        :return: replies in the order of requests
+        """
+        requests = list(requests)
+        errors = []
+        for i, cmd, arg in requests:
+            errors.extend(self._send(i, cmd, arg))
+
+        replies = []
+        for i, _, _ in requests:
+            status, reply = self._conns[i].recv()
+            if status == 'ok':
+                replies.append(reply)
+            else:
+                errors.append(reply)
+        self._raise_errors(errors)
+        return replies
+
+    def _publish(self):
+        errors = []
+        for i in range(len(self._conns)):
+            errors.extend(self._drain(i))
+        self._published_reli.update(self._fresh_reli)
+        self._fresh_reli.clear()
+        self._raise_errors(errors)
+
+    def vote_many(self, votes: Iterable[tuple[int, int, VoteDir]]):
+        """
+        Users vote links in a batch, shards commit their votes, then update their users, in parallel.
+        :param votes: votes in [(user id, link id, vote dir)]
+        """
+        shard_votes = [[] for _ in self._conns]
+        for user_id, link_id, dir_ in votes:
+            shard_votes[self._shard(link_id)].append(
+                (user_id, self._published_reli.get(user_id, self._prior_reli), link_id, dir_))
+
+        user_updates = [[] for _ in self._conns]
+        for updates in self._request((i, 'vote', sv) for i, sv in enumerate(shard_votes) if sv):
+            for update in updates:
+                user_updates[self._shard(update[0])].append(update)
+
+        # Replies are received later, see _drain
+        errors = []
+        for i, updates in enumerate(user_updates):
+            if updates:
+                errors.extend(self._send(i, 'reliability', updates))
+                self._pending[i] += 1
+        self._raise_errors(errors)
+
+        self._batch_cnt += 1
+        if self._batch_cnt % self._sync_interval == 0:
+            self._publish()
+
+    def vote(self, user_id: int, link_id: int, dir_: VoteDir):
+        """User vote a link"""
+        self.vote_many([(user_id, link_id, dir_)])
+
+    def link_quality(self, link_id: int) -> float:
+        """Quality of a link"""
+        return self._request([(self._shard(link_id), 'quality', link_id)])[0]
+
+    def link_qualities(self) -> dict[int, float]:
+        """Qualities of all links in {link id: quality}"""
+        qualities = {}
+        for shard_qualities in self._request((i, 'quality', None) for i in range(len(self._conns))):
+            qualities.update(shard_qualities)
+        return qualities
+
+    @staticmethod
+    def _user_copy(user_id: int, state) -> BUser:
+        user = BUser(user_id)
+        if state is not None:
+            user.restore_state(state)
+        return user
+
+    def get_user(self, user_id: int) -> BUser:
+        """Get a copy of the user with given user id from its shard"""
+        return self._user_copy(user_id, self._request([(self._shard(user_id), 'user', user_id)])[0])
+
+    @property
+    def users(self) -> Iterable[BUser]:
+        """Return an iterator on copies of all users with votes"""
+        return (self._user_copy(user_id, state)
+                for shard_users in self._request((i, 'users', None) for i in range(len(self._conns)))
+                for user_id, state in shard_users)
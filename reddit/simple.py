@@ -4,41 +4,46 @@
 Reddit problem simple model.
 """
 
+from typing import Iterable
+
 from .comm import VoteDir, Vote, Link, User
 from .simpleobj import SUser, SLink
-from .pool import cfg_pool, get_pool
+from .pool import ResourcePool
+from .engine import Engine
 
 
-def _is_user_vote_reliable(u: User, link: Link) -> bool | None:
+def _is_link_good(link: Link) -> bool | None:
     """
-    :return: True, the user vote for the given link is reliable
-             False, the user vote for the given link is unreliable
-             None, the user has no vote for the given link, or it cannot determine user vote is reliable or not.
+    :return: True, the link is good
+             False, the link is bad
+             None, it cannot determine the link is good or bad.
     """
-    user_vote = link.get_vote(u)
-    if user_vote is None:
-        return None
-
-    up_vote_cnt = 0
-    dn_vote_cnt = 0
-    for v in link.votes:
-        if v.dir_ == VoteDir.UP:
-            up_vote_cnt += 1
-        else:
-            assert v.dir_ == VoteDir.DOWN
-            dn_vote_cnt += 1
+    up_vote_cnt = link.up_vote_count
+    dn_vote_cnt = link.down_vote_count
 
-    link_is_good = None
     if up_vote_cnt > dn_vote_cnt:
         # This is a good link
-        link_is_good = True
+        return True
     elif up_vote_cnt == dn_vote_cnt:
         # Not sure this is a good link or a bad link
-        link_is_good = None
+        return None
     else:
         assert up_vote_cnt < dn_vote_cnt
         # This is a bad link
-        link_is_good = False
+        return False
+
+
+def _is_user_vote_reliable(u: User, link: Link) -> bool | None:
+    """
+    :return: True, the user vote for the given link is reliable
+             False, the user vote for the given link is unreliable
+             None, the user has no vote for the given link, or it cannot determine user vote is reliable or not.
+    """
+    user_vote = link.get_vote(u)
+    if user_vote is None:
+        return None
+
+    link_is_good = _is_link_good(link)
 
     if link_is_good is None:
         return None
@@ -56,49 +61,142 @@ def _is_user_vote_reliable(u: User, link: Link) -> bool | None:
             return False
 
 
-def _update_suser_reliability(u: SUser):
-    """Update reliability of a simple user"""
-    link_it = get_pool().links
-
-    reli_vote_cnt = 0
-    unreli_vote_cnt = 0
-
-    for link in link_it:
-        reli = _is_user_vote_reliable(u, link)
-        if reli is None:
-            continue
-
-        if reli:
-            reli_vote_cnt += 1
-        else:
-            unreli_vote_cnt += 1
-
-    tot_vote_cnt = reli_vote_cnt + unreli_vote_cnt
-    assert tot_vote_cnt > 0
-    u.reliability = reli_vote_cnt / tot_vote_cnt
-
-
-def _update_vote_suser_reliabilities(link: SLink):
-    """Update simple users who has vote for given link"""
-    # Users to update {user id: SUser}
-    users = {}
-    for v in link.votes:
-        if v.user.id_ not in users:
-            users[v.user.id_] = v.user
-
-    for u in users.values():
-        _update_suser_reliability(u)
-
-
-def vote(user_id: int, link_id: int, dir_: VoteDir):
-    """User vote a link"""
-    user = get_pool().get_user(user_id)
-    link = get_pool().get_link(link_id)
-    vote_ = Vote(user, dir_)
-    link.add_vote(vote_)
-    link.commit_vote()
-    _update_vote_suser_reliabilities(link)
-
-
-# Use simple link constructor to create new links
-cfg_pool(SUser, SLink)
+class SimpleEngine(Engine):
+    """Simple modeled users and links"""
+    user_constr = SUser
+    link_constr = SLink
+
+    def __init__(self, columnar_votes: bool = False, concurrent: bool = False, pool: ResourcePool | None = None,
+                 lazy_reliability: bool = False):
+        """
+        :param lazy_reliability: see cfg_lazy_reliability
+        """
+        super().__init__(columnar_votes=columnar_votes, concurrent=concurrent, pool=pool)
+        self._lazy_reliability = lazy_reliability
+        # Users with stale reliability {user id: SUser}
+        self._dirty_users = {}
+        # Bound once, instead of a new bound method for every stale user
+        self._refresh_dirty_listener = self._refresh_dirty
+
+    def _update_suser_reliability(self, u: SUser):
+        """Update reliability of a simple user"""
+        # Other threads may update this user too
+        with u.lock:
+            reli_vote_cnt = 0
+            unreli_vote_cnt = 0
+
+            # Only links this user has voted
+            for lv in self._pool.user_votes(u):
+                reli = _is_user_vote_reliable(u, lv.link)
+                if reli is None:
+                    continue
+
+                if reli:
+                    reli_vote_cnt += 1
+                else:
+                    unreli_vote_cnt += 1
+
+            tot_vote_cnt = reli_vote_cnt + unreli_vote_cnt
+            if tot_vote_cnt == 0:
+                # No vote of this user can be judged, e.g. all voted links are tied,
+                # back to the prior, so reliability depends only on current votes
+                u.reliability = SUser.PRIOR_RELIABILITY
+                return
+            u.reliability = reli_vote_cnt / tot_vote_cnt
+
+    def _mark_dirty(self, u: SUser):
+        """Mark reliability of a user stale, it is recomputed when read, or by flush"""
+        u.mark_stale(self._refresh_dirty_listener)
+        self._dirty_users[u.id_] = u
+
+    def _refresh_dirty(self, u: SUser):
+        """Recompute reliability of a dirty user, called when it is read, so it is no longer dirty"""
+        self._dirty_users.pop(u.id_, None)
+        self._update_suser_reliability(u)
+
+    def _update_vote_suser_reliabilities(self, links: Iterable[SLink]):
+        """Update simple users who has vote for given links"""
+        # Users to update {user id: SUser}
+        users = {}
+        for link in links:
+            with link.lock:
+                for v in link.votes:
+                    if v.user.id_ not in users:
+                        users[v.user.id_] = v.user
+
+        for u in users.values():
+            self._update_suser_reliability(u)
+
+    def cfg_lazy_reliability(self, enable: bool):
+        """
+        Config whether user reliabilities are updated lazily.
+        In lazy mode, a vote only marks affected users dirty, their reliabilities are
+        recomputed when read, or by flush.
+        """
+        if not enable:
+            self.flush()
+        self._lazy_reliability = enable
+
+    def flush(self):
+        """Recompute reliabilities of all dirty users"""
+        # Pop one by one, other threads may mark users dirty meanwhile
+        for user_id in list(self._dirty_users):
+            u = self._dirty_users.pop(user_id, None)
+            if u is not None:
+                u.refresh_reliability()
+
+    def _commit_links(self, link_votes: list[tuple[SLink, list[Vote]]]):
+        """
+        Commit votes to links, and update or mark dirty affected users
+        :param link_votes: [(link, votes of the link)]
+        """
+        if not self._lazy_reliability:
+            for link, votes in link_votes:
+                with link.lock:
+                    link.add_votes(votes)
+                    link.commit_vote()
+            self._update_vote_suser_reliabilities(link for link, _ in link_votes)
+            return
+
+        for link, votes in link_votes:
+            with link.lock:
+                link_was_good = _is_link_good(link)
+                link.add_votes(votes)
+                link.commit_vote()
+                voters = [v.user for v in votes]
+                if _is_link_good(link) != link_was_good:
+                    # Reliabilities of all voters depend on the changed judgement
+                    voters = [v.user for v in link.votes]
+
+            for u in voters:
+                self._mark_dirty(u)
+
+    def vote(self, user_id: int, link_id: int, dir_: VoteDir):
+        """User vote a link"""
+        user = self._pool.get_user(user_id)
+        link = self._pool.get_link(link_id)
+        self._commit_links([(link, [Vote(user, dir_)])])
+
+    def vote_many(self, votes: Iterable[tuple[int, int, VoteDir]]):
+        """
+        Users vote links in a batch.
+        Votes of a link are committed at once, then each affected user is updated once.
+        :param votes: votes in [(user id, link id, vote dir)]
+        """
+        self._commit_links(self._pool.group_votes(votes))
+
+    def retract_vote(self, user_id: int, link_id: int) -> Vote | None:
+        """User retract the vote of a link, the user and other voters of the link are updated"""
+        vote = super().retract_vote(user_id, link_id)
+        if vote is None:
+            return None
+
+        link = self._pool.get_link(link_id)
+        with link.lock:
+            users = [vote.user] + [v.user for v in link.votes]
+        for u in users:
+            if self._lazy_reliability:
+                self._mark_dirty(u)
+            else:
+                self._update_suser_reliability(u)
+        return vote
@@ -4,30 +4,59 @@
 Reddit problem simple user / link object.
 """
 
-from typing import Iterator
+from typing import Callable
 
-from .comm import VoteDir, Vote, User, Link
+import numpy as np
+
+from .comm import User, Link, Vote
 
 
 class SUser(User):
     """User with simple reliability model"""
+    __slots__ = ('_reliability', '_refresh')
+
+    # Reliability of a user without any judged vote
+    PRIOR_RELIABILITY = 0.5
+
     def __init__(self, id_: int):
         """A simple user"""
         super().__init__(id_)
-        self._reliability = 0.5
+        self._reliability = self.PRIOR_RELIABILITY
+        # Recompute stale reliability when it is read
+        self._refresh = None
 
     @property
     def reliability(self):
+        self.refresh_reliability()
         return self._reliability
 
+    def mark_stale(self, refresh: Callable[['SUser'], None]):
+        """Mark reliability stale, refresh(self) is called to recompute it before it is read"""
+        self._refresh = refresh
+
+    def refresh_reliability(self):
+        """Recompute reliability if it is stale"""
+        if self._refresh is not None:
+            refresh, self._refresh = self._refresh, None
+            refresh(self)
+
     @reliability.setter
     def reliability(self, v: float):
         assert 0 <= v <= 1.0
         self._reliability = v
+        self._refresh = None
+
+    def state(self) -> np.ndarray:
+        return np.array([self.reliability])
+
+    def restore_state(self, state: np.ndarray):
+        self.reliability = float(state[0])
 
 
 class SLink(Link):
     """Simple Link with simple quality"""
+    __slots__ = ('_quality',)
+
     def __init__(self, id_: int):
         super().__init__(id_)
         self._quality = None
@@ -38,17 +67,8 @@ class SLink(Link):
         return self._quality
 
     @staticmethod
-    def _do_update_quality(vote_it: Iterator[Vote]) -> float | None:
-        """Update quality of this link according to all votes"""
-        up_votes = 0
-        down_votes = 0
-        for vote in vote_it:
-            if vote.dir_ == VoteDir.UP:
-                up_votes += 1
-            else:
-                assert vote.dir_ == VoteDir.DOWN
-                down_votes += 1
-
+    def _do_update_quality(up_votes: int, down_votes: int) -> float | None:
+        """Update quality of this link according to vote counts"""
         tot_votes = up_votes + down_votes
         assert tot_votes >= 0
         if tot_votes == 0:
@@ -57,8 +77,19 @@ class SLink(Link):
         else:
             return up_votes / tot_votes
 
+    def state(self) -> np.ndarray:
+        # NaN for unknown quality
+        return np.array([np.nan if self._quality is None else self._quality])
+
+    def restore_state(self, state: np.ndarray):
+        self._quality = None if np.isnan(state[0]) else float(state[0])
+
     def pre_commit_update_quality(self):
         pass
 
     def post_commit_update_quality(self):
-        self._quality = self._do_update_quality(self._user_votes.values())
\ No newline at end of file
+        self._quality = self._do_update_quality(self.up_vote_count, self.down_vote_count)
+
+    def retract_update_quality(self, vote: Vote):
+        # Quality is recomputed from tallies by post_commit_update_quality
+        pass
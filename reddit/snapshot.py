@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+Snapshot of users, links and votes in contiguous arrays.
+
+A snapshot is a directory of .npy files, so it can be loaded as memory maps without reading it.
+"""
+
+import os
+import json
+from typing import Iterator, Iterable
+
+import numpy as np
+
+from .comm import User, Link
+from .votestore import DIR_TO_CODE, RELIABLE_TO_CODE
+
+
+# 2: bayes states are log posteriors
+# 3: votes keep rev and reliable
+_FORMAT_VERSION = 3
+_META_FILE = 'meta.json'
+_ARRAY_NAMES = (
+    # Sorted user ids, and state row of each user
+    'user_ids', 'user_states',
+    # Sorted link ids, and state row of each link
+    'link_ids', 'link_states',
+    # Votes sorted by link, votes of the i-th link are in [link_vote_offsets[i], link_vote_offsets[i + 1])
+    'link_vote_offsets', 'link_vote_user_ids', 'link_vote_dirs',
+    # Vote.rev (nan: None) and Vote.reliable (see RELIABLE_TO_CODE) of the votes,
+    # so a vote replaced or retracted after a restore is removed as it was added
+    'link_vote_revs', 'link_vote_reliables',
+    # Voted link ids sorted by user, in the same way
+    'user_vote_offsets', 'user_vote_link_ids',
+)
+
+
+def _states(objs: list, default_len: int = 0) -> np.ndarray:
+    if not objs:
+        return np.empty((0, default_len), dtype=float)
+    return np.stack([obj.state() for obj in objs])
+
+
+def _offsets(sorted_keys: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Offsets of each id in keys, keys are sorted and each key is one of ids"""
+    return np.searchsorted(sorted_keys, np.append(ids, np.iinfo(np.int64).max)).astype(np.int64)
+
+
+class Snapshot:
+    """Saved users, links and votes"""
+    def __init__(self, arrays: dict[str, np.ndarray]):
+        assert set(arrays) == set(_ARRAY_NAMES)
+        self._a = arrays
+
+    @classmethod
+    def from_objects(cls, users: Iterable[User], links: Iterable[Link]) -> 'Snapshot':
+        """Collect committed state of given users and links"""
+        users = sorted(users, key=lambda u: u.id_)
+        links = sorted(links, key=lambda link: link.id_)
+
+        # [(link id, vote)]
+        votes = [(link.id_, v) for link in links for v in link.votes]
+        # [(link id, user id, dir code)]
+        vote_cols = np.array([(link_id, v.user.id_, DIR_TO_CODE[v.dir_]) for link_id, v in votes],
+                             dtype=np.int64).reshape(-1, 3)
+        vote_link_ids, vote_user_ids, vote_dirs = vote_cols.T
+        vote_revs = np.array([np.nan if v.rev is None else v.rev for _, v in votes], dtype=np.float64)
+        vote_reliables = np.array([RELIABLE_TO_CODE[v.reliable] for _, v in votes], dtype=np.int8)
+
+        user_ids = np.array([u.id_ for u in users], dtype=np.int64)
+        link_ids = np.array([link.id_ for link in links], dtype=np.int64)
+
+        # Votes are already sorted by link
+        by_user = np.lexsort((vote_link_ids, vote_user_ids))
+
+        return cls({
+            'user_ids': user_ids,
+            'user_states': _states(users),
+            'link_ids': link_ids,
+            'link_states': _states(links),
+            'link_vote_offsets': _offsets(vote_link_ids, link_ids),
+            'link_vote_user_ids': vote_user_ids.astype(np.int32),
+            'link_vote_dirs': vote_dirs.astype(np.int8),
+            'link_vote_revs': vote_revs,
+            'link_vote_reliables': vote_reliables,
+            'user_vote_offsets': _offsets(vote_user_ids[by_user], user_ids),
+            'user_vote_link_ids': vote_link_ids[by_user].astype(np.int32),
+        })
+
+    def save(self, path: str):
+        """Save to a directory"""
+        os.makedirs(path, exist_ok=True)
+        for name, arr in self._a.items():
+            np.save(os.path.join(path, f'{name}.npy'), arr)
+
+        with open(os.path.join(path, _META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'version': _FORMAT_VERSION}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'Snapshot':
+        """
+        Load from a directory.
+        :param mmap: map arrays copy-on-write instead of reading them,
+                     changes to loaded states never go back to the files.
+        """
+        with open(os.path.join(path, _META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        assert meta['version'] == _FORMAT_VERSION, f'Unsupported snapshot version {meta["version"]}'
+
+        mmap_mode = 'c' if mmap else None
+        return cls({name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+                    for name in _ARRAY_NAMES})
+
+    @staticmethod
+    def _find(ids: np.ndarray, id_: int) -> int | None:
+        i = int(np.searchsorted(ids, id_))
+        return i if i < len(ids) and ids[i] == id_ else None
+
+    @property
+    def user_ids(self) -> np.ndarray:
+        """Sorted ids of saved users"""
+        return self._a['user_ids']
+
+    @property
+    def link_ids(self) -> np.ndarray:
+        """Sorted ids of saved links"""
+        return self._a['link_ids']
+
+    def user_state(self, user_id: int) -> np.ndarray | None:
+        """State of a saved user, None if the user is not saved"""
+        i = self._find(self._a['user_ids'], user_id)
+        return None if i is None else self._a['user_states'][i]
+
+    def link_state(self, link_id: int) -> np.ndarray | None:
+        """State of a saved link, None if the link is not saved"""
+        i = self._find(self._a['link_ids'], link_id)
+        return None if i is None else self._a['link_states'][i]
+
+    def link_votes(self, link_id: int) -> Iterator[tuple[int, int, float, int]]:
+        """Return an iterator on (user id, dir code, rev, reliable code) of votes of a saved link, see _ARRAY_NAMES"""
+        i = self._find(self._a['link_ids'], link_id)
+        if i is None:
+            return iter(())
+
+        b, e = self._a['link_vote_offsets'][i:i + 2]
+        return zip(*(self._a[name][b:e].tolist()
+                     for name in ('link_vote_user_ids', 'link_vote_dirs', 'link_vote_revs', 'link_vote_reliables')))
+
+    def user_link_ids(self, user_id: int) -> list[int]:
+        """Ids of links voted by a saved user"""
+        i = self._find(self._a['user_ids'], user_id)
+        if i is None:
+            return []
+
+        b, e = self._a['user_vote_offsets'][i:i + 2]
+        return self._a['user_vote_link_ids'][b:e].tolist()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""
+Vote log files, read in chunks.
+
+Supported formats, selected by file extension:
+- .csv: lines of `user id,link id,vote dir`, e.g. `3,100,DOWN`
+- .jsonl: lines of `{"user_id": 3, "link_id": 100, "dir": "DOWN"}`
+- .bin: fixed size records of little endian int32 user id, int32 link id, int8 vote dir (1: up, -1: down)
+"""
+
+import os
+import json
+import shutil
+import struct
+from typing import Iterator, Iterable, Callable
+from dataclasses import dataclass
+
+from .comm import VoteDir
+from .votestore import DIR_TO_CODE, CODE_TO_DIR
+from .engine import Engine
+
+
+_BIN_RECORD = struct.Struct('<iib')
+
+VoteTuple = tuple[int, int, VoteDir]
+
+
+@dataclass(frozen=True)
+class VoteChunk:
+    """Votes read from a log, and the byte offset right after the last vote"""
+    votes: list[VoteTuple]
+    end_offset: int
+
+
+def _log_format(path: str) -> str:
+    fmt = os.path.splitext(path)[1].lstrip('.')
+    assert fmt in ('csv', 'jsonl', 'bin'), f'Unsupported vote log format: {path}'
+    return fmt
+
+
+def _parse_csv(line: bytes) -> VoteTuple:
+    user_id, link_id, dir_ = line.decode().strip().split(',')
+    return int(user_id), int(link_id), VoteDir[dir_]
+
+
+def _parse_jsonl(line: bytes) -> VoteTuple:
+    d = json.loads(line)
+    return int(d['user_id']), int(d['link_id']), VoteDir[d['dir']]
+
+
+def _read_text_chunks(f, parse: Callable[[bytes], VoteTuple], chunk_size: int) -> Iterator[VoteChunk]:
+    offset = f.tell()
+    votes = []
+    for line in f:
+        offset += len(line)
+        if not line.strip():
+            continue
+
+        votes.append(parse(line))
+        if len(votes) == chunk_size:
+            yield VoteChunk(votes=votes, end_offset=offset)
+            votes = []
+
+    if votes:
+        yield VoteChunk(votes=votes, end_offset=offset)
+
+
+def _read_bin_chunks(f, chunk_size: int) -> Iterator[VoteChunk]:
+    offset = f.tell()
+    assert offset % _BIN_RECORD.size == 0, 'Offset is not at a record boundary'
+    while buf := f.read(_BIN_RECORD.size * chunk_size):
+        assert len(buf) % _BIN_RECORD.size == 0, 'Truncated vote record'
+        offset += len(buf)
+        votes = [(user_id, link_id, CODE_TO_DIR[code])
+                 for user_id, link_id, code in _BIN_RECORD.iter_unpack(buf)]
+        yield VoteChunk(votes=votes, end_offset=offset)
+
+
+def read_chunks(path: str, chunk_size: int = 10000, offset: int = 0) -> Iterator[VoteChunk]:
+    """
+    Read a vote log in chunks.
+    :param chunk_size: max votes in a chunk
+    :param offset: byte offset to start reading, e.g. end_offset of the last processed chunk.
+    """
+    assert chunk_size > 0
+    fmt = _log_format(path)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        if fmt == 'bin':
+            yield from _read_bin_chunks(f, chunk_size)
+        elif fmt == 'csv':
+            yield from _read_text_chunks(f, _parse_csv, chunk_size)
+        else:
+            assert fmt == 'jsonl'
+            yield from _read_text_chunks(f, _parse_jsonl, chunk_size)
+
+
+def write_votes(path: str, votes: Iterable[VoteTuple]):
+    """Write votes to a vote log, the format is selected by file extension"""
+    fmt = _log_format(path)
+    with open(path, 'wb') as f:
+        for user_id, link_id, dir_ in votes:
+            if fmt == 'bin':
+                f.write(_BIN_RECORD.pack(user_id, link_id, DIR_TO_CODE[dir_]))
+            elif fmt == 'csv':
+                f.write(f'{user_id},{link_id},{dir_.name}\n'.encode())
+            else:
+                assert fmt == 'jsonl'
+                line = json.dumps({'user_id': user_id, 'link_id': link_id, 'dir': dir_.name})
+                f.write(f'{line}\n'.encode())
+
+
+# Checkpoint file in a checkpoint directory, it names the snapshot and the log offset it covers
+_CHECKPOINT_FILE = 'checkpoint.json'
+_SNAPSHOT_PREFIX = 'snapshot-'
+
+
+def _load_checkpoint(checkpoint_dir: str) -> tuple[str | None, int]:
+    """:return: (snapshot directory, None if there is no checkpoint, byte offset of the log it covers)"""
+    path = os.path.join(checkpoint_dir, _CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None, 0
+
+    with open(path, encoding='utf-8') as f:
+        ckpt = json.load(f)
+    return os.path.join(checkpoint_dir, ckpt['snapshot']), int(ckpt['offset'])
+
+
+def _save_checkpoint(checkpoint_dir: str, engine: Engine, offset: int):
+    # Snapshot first, then the checkpoint referring to it, so a checkpoint never refers to a partial snapshot
+    name = f'{_SNAPSHOT_PREFIX}{offset}'
+    snapshot_path = os.path.join(checkpoint_dir, name)
+    # Left by a crash before its checkpoint was written
+    shutil.rmtree(snapshot_path, ignore_errors=True)
+    engine.pool.save(snapshot_path)
+
+    # Write then rename, so a crash never leaves a partially written checkpoint
+    path = os.path.join(checkpoint_dir, _CHECKPOINT_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'snapshot': name, 'offset': offset}, f)
+    os.replace(tmp_path, path)
+
+    for old in os.listdir(checkpoint_dir):
+        if old.startswith(_SNAPSHOT_PREFIX) and old != name:
+            shutil.rmtree(os.path.join(checkpoint_dir, old))
+
+
+def ingest(path: str, engine: Engine, chunk_size: int = 10000,
+           checkpoint_dir: str | None = None, checkpoint_every: int = 1) -> int:
+    """
+    Feed a vote log into a model chunk by chunk.
+    :param engine: engine of the model, votes are fed to its vote_many
+    :param checkpoint_dir: directory keeping a checkpoint, a snapshot of the engine pool
+                           and the byte offset of the log it covers.
+                           If a checkpoint exists, the engine, which must be unused, is restored from the snapshot,
+                           and ingestion resumes from the offset, so a crashed ingestion resumes in a new process.
+    :param checkpoint_every: save a checkpoint every this many chunks, and after the last chunk
+    :return: number of ingested votes
+    """
+    assert checkpoint_every > 0
+    offset = 0
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        snapshot_path, offset = _load_checkpoint(checkpoint_dir)
+        if snapshot_path is not None:
+            # Read into memory, the snapshot is removed by the next checkpoint
+            engine.restore(snapshot_path, mmap=False)
+
+    cnt = 0
+    chunk = None
+    for i, chunk in enumerate(read_chunks(path, chunk_size=chunk_size, offset=offset)):
+        engine.vote_many(chunk.votes)
+        cnt += len(chunk.votes)
+        if checkpoint_dir is not None and (i + 1) % checkpoint_every == 0:
+            _save_checkpoint(checkpoint_dir, engine, chunk.end_offset)
+            chunk = None
+
+    if checkpoint_dir is not None and chunk is not None:
+        _save_checkpoint(checkpoint_dir, engine, chunk.end_offset)
+    return cnt
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+"""
+Columnar store of committed votes.
+"""
+
+import bisect
+import threading
+from array import array
+from typing import Iterator, Callable
+from contextlib import nullcontext
+
+import numpy as np
+
+from .comm import User, Vote, VoteDir
+
+
+# Vote direction stored as int8
+DIR_TO_CODE = {VoteDir.UP: 1, VoteDir.DOWN: -1}
+CODE_TO_DIR = {code: dir_ for dir_, code in DIR_TO_CODE.items()}
+# Vote.reliable stored as int8
+RELIABLE_TO_CODE = {None: 0, True: 1, False: -1}
+CODE_TO_RELIABLE = {code: reliable for reliable, code in RELIABLE_TO_CODE.items()}
+
+
+class VoteStore:
+    """
+    Committed votes of all links in growable columns:
+    int32 user ids, int32 link ids and int8 directions (1: up, -1: down).
+    Vote.rev and Vote.reliable are kept in float64 (nan: None) and int8 (see RELIABLE_TO_CODE) columns,
+    each allocated when the first vote with it is stored, so models that do not record them pay nothing.
+
+    Each (user, link) pair has one row, a vote again by the same user overwrites
+    the direction of that row.
+    Rows of a link are indexed by int32 arrays per link, of user ids in ascending order and their rows,
+    so a vote is found by binary search.
+    Links voted by a user are indexed by an int32 array of link ids per user.
+    """
+    def __init__(self, user_getter: Callable[[int], User], capacity: int = 1024, concurrent: bool = False):
+        """
+        :param user_getter: get User object by user id, used to build Vote objects on read.
+        :param capacity: initial number of rows
+        :param concurrent: guard columns with a lock, for votes of different links set by threads.
+        """
+        assert capacity > 0
+        self._user_getter = user_getter
+        self._lock = threading.Lock() if concurrent else nullcontext()
+        self._user_ids = np.empty(capacity, dtype=np.int32)
+        self._link_ids = np.empty(capacity, dtype=np.int32)
+        self._dirs = np.empty(capacity, dtype=np.int8)
+        # Optional columns, None until used
+        self._revs = None
+        self._reliables = None
+        self._size = 0
+        # {link id: (array of sorted user ids, array of their rows)}
+        self._link_rows = {}
+        # {user id: array of voted link ids}
+        self._user_links = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self):
+        capacity = 2 * len(self._dirs)
+        for name in ('_user_ids', '_link_ids', '_dirs', '_revs', '_reliables'):
+            old = getattr(self, name)
+            if old is None:
+                continue
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _optional_columns(self) -> list[np.ndarray]:
+        return [col for col in (self._revs, self._reliables) if col is not None]
+
+    def _set_optional(self, row: int, rev: float | None, reliable: bool | None):
+        """Set optional columns of a row, allocate a column on its first value"""
+        if rev is not None and self._revs is None:
+            self._revs = np.full(len(self._dirs), np.nan)
+        if reliable is not None and self._reliables is None:
+            self._reliables = np.zeros(len(self._dirs), dtype=np.int8)
+        if self._revs is not None:
+            self._revs[row] = np.nan if rev is None else rev
+        if self._reliables is not None:
+            self._reliables[row] = RELIABLE_TO_CODE[reliable]
+
+    def _find(self, link_id: int, user_id: int) -> tuple[array | None, array | None, int, bool]:
+        """:return: (user ids, rows of the link, index of user id in them or to insert it, whether it is found)"""
+        index = self._link_rows.get(link_id, None)
+        if index is None:
+            return None, None, 0, False
+        user_ids, rows = index
+        i = bisect.bisect_left(user_ids, user_id)
+        return user_ids, rows, i, i < len(user_ids) and user_ids[i] == user_id
+
+    def _find_row(self, link_id: int, user_id: int) -> int | None:
+        _, rows, i, found = self._find(link_id, user_id)
+        return rows[i] if found else None
+
+    def _vote(self, row: int) -> Vote:
+        rev = None if self._revs is None or np.isnan(self._revs[row]) else float(self._revs[row])
+        reliable = None if self._reliables is None else CODE_TO_RELIABLE[int(self._reliables[row])]
+        return Vote(self._user_getter(int(self._user_ids[row])), CODE_TO_DIR[int(self._dirs[row])],
+                    rev=rev, reliable=reliable)
+
+    def set_vote(self, link_id: int, user_id: int, dir_: VoteDir, rev: float | None = None,
+                 reliable: bool | None = None):
+        """Store a vote, replace the old vote of the same user for the same link"""
+        with self._lock:
+            self._set_vote(link_id, user_id, dir_, rev, reliable)
+
+    def _set_vote(self, link_id: int, user_id: int, dir_: VoteDir, rev: float | None, reliable: bool | None):
+        user_ids, rows, i, found = self._find(link_id, user_id)
+        if found:
+            self._dirs[rows[i]] = DIR_TO_CODE[dir_]
+            self._set_optional(rows[i], rev, reliable)
+            return
+
+        if self._size == len(self._dirs):
+            self._grow()
+
+        row = self._size
+        self._user_ids[row] = user_id
+        self._link_ids[row] = link_id
+        self._dirs[row] = DIR_TO_CODE[dir_]
+        self._set_optional(row, rev, reliable)
+        self._size += 1
+
+        if user_ids is None:
+            user_ids, rows = self._link_rows[link_id] = (array('i'), array('i'))
+        user_ids.insert(i, user_id)
+        rows.insert(i, row)
+        link_ids = self._user_links.get(user_id, None)
+        if link_ids is None:
+            link_ids = self._user_links[user_id] = array('i')
+        link_ids.append(link_id)
+
+    def annotate_rows(self, rows: np.ndarray, revs: np.ndarray, reliables: np.ndarray):
+        """
+        Set Vote.rev and Vote.reliable of votes in given rows at once, e.g. after refit.
+        :param revs: float64, nan for None
+        :param reliables: int8 codes, see RELIABLE_TO_CODE
+        """
+        with self._lock:
+            if self._revs is None:
+                self._revs = np.full(len(self._dirs), np.nan)
+            if self._reliables is None:
+                self._reliables = np.zeros(len(self._dirs), dtype=np.int8)
+            self._revs[rows] = revs
+            self._reliables[rows] = reliables
+
+    def del_vote(self, link_id: int, user_id: int) -> bool:
+        """
+        Delete vote of given user for given link
+        :return: whether the vote was stored
+        """
+        with self._lock:
+            return self._del_vote(link_id, user_id)
+
+    def _del_vote(self, link_id: int, user_id: int) -> bool:
+        user_ids, rows, i, found = self._find(link_id, user_id)
+        if not found:
+            return False
+
+        row = rows[i]
+        del user_ids[i]
+        del rows[i]
+        link_ids = self._user_links[user_id]
+        link_ids.remove(link_id)
+        if not link_ids:
+            del self._user_links[user_id]
+        # Move the last row into the deleted one, so columns stay dense
+        last = self._size - 1
+        if row != last:
+            _, last_rows, j, _ = self._find(int(self._link_ids[last]), int(self._user_ids[last]))
+            last_rows[j] = row
+            for col in [self._user_ids, self._link_ids, self._dirs] + self._optional_columns():
+                col[row] = col[last]
+        self._size -= 1
+        return True
+
+    def get_vote(self, link_id: int, user_id: int) -> Vote | None:
+        """Return vote of given user for given link"""
+        with self._lock:
+            row = self._find_row(link_id, user_id)
+        return None if row is None else self._vote(row)
+
+    def link_votes(self, link_id: int) -> Iterator[Vote]:
+        """Return an iterator on votes of given link"""
+        with self._lock:
+            index = self._link_rows.get(link_id, None)
+            rows = [] if index is None else index[1].tolist()
+        return (self._vote(row) for row in rows)
+
+    def user_link_ids(self, user_id: int) -> list[int]:
+        """Ids of links voted by given user"""
+        with self._lock:
+            link_ids = self._user_links.get(user_id, None)
+            return [] if link_ids is None else link_ids.tolist()
+
+    def link_vote_count(self, link_id: int) -> int:
+        """Number of votes of given link"""
+        with self._lock:
+            index = self._link_rows.get(link_id, None)
+            return 0 if index is None else len(index[1])
+
+    def view(self, link_id: int) -> 'LinkVoteView':
+        """Return {user id: Vote} like view on votes of given link"""
+        return LinkVoteView(self, link_id)
+
+    @property
+    def columns(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(user ids, link ids, directions) of all votes, as views without copy"""
+        return self._user_ids[:self._size], self._link_ids[:self._size], self._dirs[:self._size]
+
+    def nbytes(self) -> int:
+        """Bytes used by columns, link row indexes and user link indexes"""
+        n = self._user_ids.nbytes + self._link_ids.nbytes + self._dirs.nbytes
+        n += sum(col.nbytes for col in self._optional_columns())
+        n += sum(arr.itemsize * len(arr) for index in self._link_rows.values() for arr in index)
+        n += sum(arr.itemsize * len(arr) for arr in self._user_links.values())
+        return n
+
+
+class LinkVoteView:
+    """
+    Votes of one link in a VoteStore, in the {user id: Vote} interface used by Link.
+    """
+    def __init__(self, store: VoteStore, link_id: int):
+        self._store = store
+        self._link_id = link_id
+
+    def __len__(self) -> int:
+        return self._store.link_vote_count(self._link_id)
+
+    def __contains__(self, user_id: int) -> bool:
+        return self._store.get_vote(self._link_id, user_id) is not None
+
+    def __setitem__(self, user_id: int, vote: Vote):
+        assert vote.user.id_ == user_id
+        self._store.set_vote(self._link_id, user_id, vote.dir_, rev=vote.rev, reliable=vote.reliable)
+
+    def __delitem__(self, user_id: int):
+        if not self._store.del_vote(self._link_id, user_id):
+            raise KeyError(user_id)
+
+    def get(self, user_id: int, default: Vote | None = None) -> Vote | None:
+        vote = self._store.get_vote(self._link_id, user_id)
+        return default if vote is None else vote
+
+    def values(self) -> Iterator[Vote]:
+        return self._store.link_votes(self._link_id)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+"""
+Synthetic vote workload of any size, for load testing and accuracy measurement.
+
+Like test_vec, each user votes the intended direction (up for a good link, down for a bad link)
+with probability of its planned reliability, and the reversed direction otherwise.
+Unlike test_vec, every user votes only a random subset of links, and votes are generated
+with a NumPy RNG, a chunk of users at a time, so memory does not grow with the workload.
+"""
+
+import argparse
+from typing import Iterator
+from dataclasses import dataclass
+
+import numpy as np
+
+from .comm import VoteDir
+from .votestore import CODE_TO_DIR, DIR_TO_CODE
+from .votelog import write_votes
+
+
+@dataclass(frozen=True)
+class WorkloadSpec:
+    """Parameters of a workload"""
+    user_count: int
+    link_count: int
+    good_link_ratio: float = 0.8
+    # Planned user reliabilities are drawn from Beta(reliability_a, reliability_b)
+    reliability_a: float = 8.0
+    reliability_b: float = 2.0
+    # Number of links voted by a user is Poisson distributed with this mean, at most link_count
+    votes_per_user: float = 20.0
+    seed: int = 0
+
+
+@dataclass(frozen=True)
+class VoteArrays:
+    """A chunk of votes in columns"""
+    user_ids: np.ndarray
+    link_ids: np.ndarray
+    # 1: up, -1: down, see DIR_TO_CODE
+    dirs: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.dirs)
+
+    def tuples(self) -> list[tuple[int, int, VoteDir]]:
+        """Votes in [(user id, link id, vote dir)], as taken by vote_many"""
+        return [(user_id, link_id, CODE_TO_DIR[code]) for user_id, link_id, code
+                in zip(self.user_ids.tolist(), self.link_ids.tolist(), self.dirs.tolist())]
+
+
+class GroundTruth:
+    """Planned link goodness and user reliabilities, and reliabilities realized by generated votes"""
+    def __init__(self, link_is_good: np.ndarray, planned_reliability: np.ndarray):
+        self.link_is_good = link_is_good
+        self.planned_reliability = planned_reliability
+        # Votes of each user in the intended / reversed direction, counted as votes are generated
+        self.intended_cnt = np.zeros(len(planned_reliability), dtype=np.int64)
+        self.unintended_cnt = np.zeros(len(planned_reliability), dtype=np.int64)
+
+    @property
+    def simulated_reliability(self) -> np.ndarray:
+        """Fraction of intended votes of each user, NaN for users without votes"""
+        tot = self.intended_cnt + self.unintended_cnt
+        with np.errstate(invalid='ignore'):
+            return self.intended_cnt / tot
+
+    def reliability_mae(self, reliabilities: dict[int, float]) -> float:
+        """Mean absolute error of given {user id: reliability} against simulated reliabilities"""
+        user_ids = np.fromiter(reliabilities.keys(), dtype=np.int64, count=len(reliabilities))
+        cal = np.fromiter(reliabilities.values(), dtype=float, count=len(reliabilities))
+        return float(np.nanmean(np.abs(cal - self.simulated_reliability[user_ids])))
+
+    def link_accuracy(self, qualities: dict[int, float | None]) -> float:
+        """Fraction of links in given {link id: quality} judged good or bad correctly, quality > 0.5 is good"""
+        judged = {link_id: q for link_id, q in qualities.items() if q is not None}
+        link_ids = np.fromiter(judged.keys(), dtype=np.int64, count=len(judged))
+        cal = np.fromiter(judged.values(), dtype=float, count=len(judged)) > 0.5
+        return float(np.mean(cal == self.link_is_good[link_ids]))
+
+
+class Workload:
+    """Votes of a WorkloadSpec, user ids are in [0, user_count), link ids in [0, link_count)"""
+    def __init__(self, spec: WorkloadSpec):
+        assert spec.user_count > 0 and spec.link_count > 0
+        assert 0 <= spec.good_link_ratio <= 1
+        self.spec = spec
+        self._rng = np.random.default_rng(spec.seed)
+        self.truth = GroundTruth(
+            link_is_good=self._rng.random(spec.link_count) < spec.good_link_ratio,
+            planned_reliability=self._rng.beta(spec.reliability_a, spec.reliability_b, spec.user_count))
+
+    def _gen_chunk(self, user_begin: int, user_end: int) -> VoteArrays:
+        rng = self._rng
+        spec = self.spec
+        cnts = np.minimum(rng.poisson(spec.votes_per_user, user_end - user_begin), spec.link_count)
+        user_ids = np.repeat(np.arange(user_begin, user_end, dtype=np.int64), cnts)
+        link_ids = rng.integers(0, spec.link_count, len(user_ids))
+        # One vote per (user, link), drop repeated draws
+        _, first = np.unique(user_ids * spec.link_count + link_ids, return_index=True)
+        user_ids = user_ids[first]
+        link_ids = link_ids[first]
+
+        intended = rng.random(len(user_ids)) < self.truth.planned_reliability[user_ids]
+        up = self.truth.link_is_good[link_ids] == intended
+        dirs = np.where(up, DIR_TO_CODE[VoteDir.UP], DIR_TO_CODE[VoteDir.DOWN]).astype(np.int8)
+
+        self.truth.intended_cnt += np.bincount(user_ids, weights=intended,
+                                               minlength=spec.user_count).astype(np.int64)
+        self.truth.unintended_cnt += np.bincount(user_ids, weights=~intended,
+                                                 minlength=spec.user_count).astype(np.int64)
+
+        # Interleave users of the chunk
+        order = rng.permutation(len(user_ids))
+        return VoteArrays(user_ids=user_ids[order].astype(np.int32),
+                          link_ids=link_ids[order].astype(np.int32),
+                          dirs=dirs[order])
+
+    def chunks(self, chunk_users: int = 10000) -> Iterator[VoteArrays]:
+        """
+        Generate votes of chunk_users users at a time.
+        Ground truth simulated reliabilities are complete once all chunks are generated.
+        Generate once, a second pass draws different votes.
+        """
+        assert chunk_users > 0
+        for b in range(0, self.spec.user_count, chunk_users):
+            yield self._gen_chunk(b, min(b + chunk_users, self.spec.user_count))
+
+    def votes(self, chunk_users: int = 10000) -> Iterator[tuple[int, int, VoteDir]]:
+        """Generate votes in (user id, link id, vote dir)"""
+        for chunk in self.chunks(chunk_users):
+            yield from chunk.tuples()
+
+    def write(self, path: str, chunk_users: int = 10000):
+        """Stream votes to a vote log, see votelog for formats"""
+        write_votes(path, self.votes(chunk_users))
+
+
+def main():
+    """Write a synthetic workload to a vote log"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='vote log path, .csv, .jsonl or .bin')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--links', type=int, default=10000)
+    parser.add_argument('--good-link-ratio', type=float, default=0.8)
+    parser.add_argument('--votes-per-user', type=float, default=20.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    workload = Workload(WorkloadSpec(user_count=args.users, link_count=args.links,
+                                     good_link_ratio=args.good_link_ratio,
+                                     votes_per_user=args.votes_per_user, seed=args.seed))
+    workload.write(args.path)
+    print(f'Votes: {int(workload.truth.intended_cnt.sum() + workload.truth.unintended_cnt.sum())}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,978 @@
+#!/usr/bin/env python3
+'''Test reddit problem objects'''
+
+import os
+import sys
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from reddit.comm import Vote, VoteDir
+from reddit.simpleobj import SUser, SLink
+from reddit.pool import ResourcePool
+from reddit.votestore import VoteStore
+from reddit.votelog import read_chunks, write_votes, ingest
+from reddit.shard import ShardedBayes
+from reddit.refit import refit
+from reddit.service import VoteService
+from reddit.bayesobj import LinkQuality, UserReliability, BUser, BLink, BetaLink, GridConfig
+from reddit.simple import SimpleEngine
+from reddit.bayes import BayesEngine, BayesBetaEngine
+from reddit.bayes_suser import BayesSUserEngine
+from reddit.ranking import RankingIndex, lower_bound_score
+from reddit.memory_bench import measure
+from reddit.workload import Workload, WorkloadSpec
+from reddit.bench import run_case, compare
+from reddit.report import user_summaries, link_summaries, export
+from reddit.sensitivity import analyze
+from reddit import instrument
+
+
+def _update_per_hypo(suite, dataset) -> dict[float, float]:
+    '''
+    Reference update that calls Likelihood once per hypothesis.
+    :return: posterior in {hypo: probability}
+    '''
+    d = suite.d
+    for data in dataset:
+        for hypo in d:
+            d[hypo] *= suite.Likelihood(data, hypo)
+
+    total = sum(d.values())
+    return {hypo: p / total for hypo, p in d.items()}
+
+
+def _assert_same_dist(exp: dict[float, float], cal: dict[float, float], delta: float = 1e-9):
+    assert exp.keys() == cal.keys()
+    for hypo, exp_p in exp.items():
+        assert abs(cal[hypo] - exp_p) < delta, 'Vectorized posterior varies too far away'
+
+
+def test_link_quality_vectorized():
+    """Vectorized link quality update matches per hypothesis update"""
+    user = SUser(0)
+    user.reliability = 0.8
+    votes = [Vote(user, VoteDir.UP), Vote(user, VoteDir.UP), Vote(user, VoteDir.DOWN)]
+
+    lq = LinkQuality(name='link')
+    exp = _update_per_hypo(LinkQuality(name='ref'), votes)
+    lq.UpdateSet(votes)
+    _assert_same_dist(exp, lq.d)
+
+
+def test_user_reliability_vectorized():
+    """Vectorized user reliability update matches per hypothesis update"""
+    user = SUser(0)
+    dataset = [(Vote(user, VoteDir.UP), 0.9), (Vote(user, VoteDir.UP), 0.1), (Vote(user, VoteDir.DOWN), 0.5)]
+
+    ur = UserReliability(name='user')
+    exp = _update_per_hypo(UserReliability(name='ref'), dataset)
+    for data in dataset:
+        ur.Update(data)
+    _assert_same_dist(exp, ur.d)
+
+
+def test_summary_cache():
+    """Cached summary is only recomputed after the posterior changes"""
+    user = BUser(0)
+    link = BLink(0)
+    ver = link._l_quality.version
+    assert abs(link.quality - link._l_quality.Mean()) < 1e-12
+
+    # Commit without staged votes does not change the posterior
+    link.commit_vote()
+    assert link._l_quality.version == ver
+
+    vote = Vote(user, VoteDir.UP)
+    link.add_vote(vote)
+    link.commit_vote()
+    assert link._l_quality.version != ver
+    assert abs(link.quality - link._l_quality.Mean()) < 1e-12
+    assert abs(link.variance - link._l_quality.Var()) < 1e-12
+
+    # An unjudgable vote does not change the posterior
+    ver = user._reliability.version
+    user.update_reliability(vote, 0.5)
+    assert user._reliability.version == ver
+
+    user.update_reliability(vote, 0.9)
+    assert user._reliability.version != ver
+    assert abs(user.reliability - user._reliability.Mean()) < 1e-12
+    assert user.max_likelihood == user._reliability.MaximumLikelihood()
+
+
+def test_user_votes_index():
+    """Pool indexes committed votes by user"""
+    pool = ResourcePool(SUser, SLink)
+    u0 = pool.get_user(0)
+    u1 = pool.get_user(1)
+    for link_id in (10, 11):
+        link = pool.get_link(link_id)
+        link.add_vote(Vote(u0, VoteDir.UP))
+        link.commit_vote()
+
+    # Vote again, the new vote overwrites the old one
+    link = pool.get_link(11)
+    link.add_vote(Vote(u0, VoteDir.DOWN))
+    link.commit_vote()
+
+    lvs = sorted(pool.user_votes(u0), key=lambda lv: lv.link.id_)
+    assert [(lv.link.id_, lv.vote.dir_) for lv in lvs] == [(10, VoteDir.UP), (11, VoteDir.DOWN)]
+    assert not list(pool.user_votes(u1))
+
+
+def test_vote_tallies():
+    """Link vote tallies follow votes again by the same user"""
+    users = [SUser(i) for i in range(3)]
+    link = SLink(0)
+    for u in users:
+        link.add_vote(Vote(u, VoteDir.UP))
+    link.commit_vote()
+    assert (link.up_vote_count, link.down_vote_count) == (3, 0)
+
+    link.add_vote(Vote(users[0], VoteDir.DOWN))
+    link.add_vote(Vote(users[1], VoteDir.UP))
+    link.commit_vote()
+    assert (link.up_vote_count, link.down_vote_count) == (2, 1)
+    assert abs(link.quality - 2 / 3) < 1e-12
+
+    # A commit does not wait for a user lock held by a reliability update
+    pool = ResourcePool(BUser, BLink, concurrent=True)
+    user, link = pool.get_user(0), pool.get_link(0)
+
+    def commit():
+        with link.lock:
+            link.add_vote(Vote(user, VoteDir.UP))
+            link.commit_vote()
+
+    with ThreadPoolExecutor(max_workers=1) as executor, user.lock:
+        executor.submit(commit).result(timeout=10)
+    assert user.up_vote_count == 1
+
+
+def test_quality_without():
+    """Leaving a committed vote out gives the quality before the vote"""
+    user = BUser(0)
+    link = BLink(0)
+    link.add_vote(Vote(user, VoteDir.DOWN))
+    link.commit_vote()
+    lq_b4 = link.quality
+
+    voter = SUser(1)
+    voter.reliability = 0.8
+    vote = Vote(voter, VoteDir.UP)
+    link.add_vote(vote)
+    link.commit_vote()
+    assert abs(link.quality_without(vote) - lq_b4) < 1e-9
+
+    # With the reversibility the vote was committed with
+    voter.reliability = 0.6
+    assert abs(link.quality_without(vote) - lq_b4) < 1e-9
+
+
+def test_columnar_votes():
+    """Columnar vote store behaves like per link dicts"""
+    pool = ResourcePool(SUser, SLink, columnar_votes=True)
+    store = pool.vote_store
+    users = [pool.get_user(i) for i in range(3)]
+    link = pool.get_link(7)
+    for u in users:
+        link.add_vote(Vote(u, VoteDir.UP))
+    link.commit_vote()
+    link.add_vote(Vote(users[2], VoteDir.DOWN))
+    link.commit_vote()
+
+    assert len(store) == 3
+    assert link.get_vote(users[2]).dir_ == VoteDir.DOWN
+    assert link.get_vote(users[2]).user is users[2]
+    assert link.get_vote(SUser(9)) is None
+    assert sorted(v.user.id_ for v in link.votes) == [0, 1, 2]
+    assert (link.up_vote_count, link.down_vote_count) == (2, 1)
+    # Votes of a user are found from the store
+    assert [(lv.link.id_, lv.vote.dir_) for lv in pool.user_votes(users[2])] == [(7, VoteDir.DOWN)]
+
+    user_ids, link_ids, dirs = store.columns
+    assert list(user_ids) == [0, 1, 2]
+    assert set(link_ids) == {7}
+    assert list(dirs) == [1, 1, -1]
+
+    # Optional fields of votes are kept once used, a delete moves them with the last row
+    assert store._revs is None and store._reliables is None
+    store.set_vote(8, 0, VoteDir.DOWN, rev=0.25, reliable=False)
+    store.set_vote(8, 1, VoteDir.UP)
+    assert link.get_vote(users[2]).rev is None and link.get_vote(users[2]).reliable is None
+    store.del_vote(7, 0)
+    vote = store.get_vote(8, 0)
+    assert (vote.dir_, vote.rev, vote.reliable) == (VoteDir.DOWN, 0.25, False)
+    store.set_vote(8, 0, VoteDir.UP, reliable=True)
+    vote = store.get_vote(8, 0)
+    assert (vote.rev, vote.reliable) == (None, True)
+
+
+def test_vote_store_grow():
+    """Vote store grows its columns"""
+    users = {i: SUser(i) for i in range(5)}
+    store = VoteStore(users.get, capacity=1)
+    for i in range(5):
+        store.set_vote(link_id=i % 2, user_id=i, dir_=VoteDir.UP)
+
+    assert len(store) == 5
+    assert store.link_vote_count(0) == 3
+    assert store.get_vote(link_id=1, user_id=3).user is users[3]
+
+
+def test_vote_store_delete():
+    """Votes found by binary search stay consistent with deletes moving rows"""
+    rng = np.random.default_rng(4)
+    users = {i: SUser(i) for i in range(50)}
+    store = VoteStore(users.get, capacity=4)
+    # {(link id, user id): vote dir code}
+    ref = {}
+    for _ in range(2000):
+        link_id, user_id = int(rng.integers(5)), int(rng.integers(50))
+        if rng.random() < 0.3:
+            assert store.del_vote(link_id, user_id) == ((link_id, user_id) in ref)
+            ref.pop((link_id, user_id), None)
+        else:
+            dir_ = VoteDir.UP if rng.random() < 0.5 else VoteDir.DOWN
+            store.set_vote(link_id, user_id, dir_)
+            ref[(link_id, user_id)] = dir_
+
+    assert len(store) == len(ref)
+    user_ids, link_ids, _ = store.columns
+    assert set(zip(link_ids.tolist(), user_ids.tolist())) == set(ref)
+    for (link_id, user_id), dir_ in ref.items():
+        assert store.get_vote(link_id, user_id).dir_ == dir_
+    for link_id in range(5):
+        assert sorted(v.user.id_ for v in store.link_votes(link_id)) == \
+            sorted(u for lk, u in ref if lk == link_id)
+    for user_id in range(50):
+        assert sorted(store.user_link_ids(user_id)) == sorted(lk for lk, u in ref if u == user_id)
+
+
+def _crash_ingest(path: str, ckpt: str, chunk_size: int, crash_chunk: int):
+    """Ingest a vote log until the crash_chunk-th chunk is half applied"""
+    engine = BayesEngine()
+    vote_many = engine.vote_many
+    calls = []
+
+    def crashing_vote_many(chunk_votes):
+        calls.append(chunk_votes)
+        if len(calls) == crash_chunk:
+            vote_many(chunk_votes[:1])
+            raise RuntimeError('crash')
+        vote_many(chunk_votes)
+
+    engine.vote_many = crashing_vote_many
+    try:
+        ingest(path, engine, chunk_size=chunk_size, checkpoint_dir=ckpt)
+        assert False, 'No crash'
+    except RuntimeError:
+        pass
+
+
+def _assert_same_bayes(ref: BayesEngine, engine: BayesEngine):
+    for link in ref.pool.links:
+        engine_link = engine.pool.find_link(link.id_)
+        assert abs(engine_link.quality - link.quality) < 1e-9
+        assert (engine_link.up_vote_count, engine_link.down_vote_count) == (link.up_vote_count, link.down_vote_count)
+    for user in ref.pool.users:
+        assert abs(engine.pool.find_user(user.id_).reliability - user.reliability) < 1e-9
+
+
+def test_vote_log(tmp_path):
+    """Vote logs read back in chunks, and ingestion resumes from checkpoint"""
+    votes = [(i % 4, 100 + i % 3, VoteDir.UP if i % 2 else VoteDir.DOWN) for i in range(10)]
+    for ext in ('csv', 'jsonl', 'bin'):
+        path = str(tmp_path / f'votes.{ext}')
+        write_votes(path, votes)
+
+        chunks = list(read_chunks(path, chunk_size=4))
+        assert [len(c.votes) for c in chunks] == [4, 4, 2]
+        assert [v for c in chunks for v in c.votes] == votes
+
+        # Resume from the end of the 1st chunk
+        resumed = [v for c in read_chunks(path, chunk_size=4, offset=chunks[0].end_offset) for v in c.votes]
+        assert resumed == votes[4:]
+
+        ref = BayesEngine()
+        assert ingest(path, ref, chunk_size=3) == 10
+
+        # Crash while the 3rd chunk is half applied, the checkpoint has the first 2 chunks
+        ckpt = str(tmp_path / f'ckpt_{ext}')
+        _crash_ingest(path, ckpt, chunk_size=3, crash_chunk=3)
+
+        # Resume in a new engine, as in a new process
+        for resumed_cnt in (4, 0):
+            resumed = BayesEngine()
+            assert ingest(path, resumed, chunk_size=3, checkpoint_dir=ckpt) == resumed_cnt
+            _assert_same_bayes(ref, resumed)
+        assert len([name for name in os.listdir(ckpt) if name.startswith('snapshot-')]) == 1
+
+    # Votes again after the checkpoint remove the votes they replace as an uninterrupted ingest does
+    votes = [(u, 0, VoteDir.UP) for u in range(1, 6)] + [(0, 0, VoteDir.UP)]
+    votes += [(u, 0, VoteDir.DOWN) for u in range(6, 9)] + [(0, 0, VoteDir.DOWN), (3, 0, VoteDir.DOWN)]
+    path = str(tmp_path / 'revotes.bin')
+    write_votes(path, votes)
+    ref = BayesEngine()
+    ingest(path, ref, chunk_size=9)
+    ckpt = str(tmp_path / 'ckpt_revotes')
+    _crash_ingest(path, ckpt, chunk_size=9, crash_chunk=2)
+    resumed = BayesEngine()
+    assert ingest(path, resumed, chunk_size=9, checkpoint_dir=ckpt) == 2
+    _assert_same_bayes(ref, resumed)
+
+
+def _vote_all(pool: ResourcePool, votes):
+    for user_id, link_id, dir_ in votes:
+        link = pool.get_link(link_id)
+        link.add_vote(Vote(pool.get_user(user_id), dir_))
+        link.commit_vote()
+
+
+def test_snapshot(tmp_path):
+    """Pool loaded from a snapshot has the saved state"""
+    votes = [(i % 5, 100 + i % 7, VoteDir.UP if i % 3 else VoteDir.DOWN) for i in range(30)]
+    for user_constr, link_constr in ((BUser, BLink), (SUser, SLink)):
+        pool = ResourcePool(user_constr, link_constr)
+        _vote_all(pool, votes)
+        for u in pool.users:
+            if isinstance(u, SUser):
+                u.reliability = u.id_ / 10
+
+        path = str(tmp_path / link_constr.__name__)
+        pool.save(path)
+        for mmap in (True, False):
+            loaded = ResourcePool.load(path, user_constr, link_constr, mmap=mmap)
+            # Saved objects are found, unknown ones are not created
+            assert loaded.find_link(101).id_ == 101 and loaded.find_link(99) is None
+            assert loaded.find_user(99) is None
+            u0 = loaded.find_user(0)
+            assert abs(u0.reliability - pool.get_user(0).reliability) < 1e-12
+            assert sorted(lv.link.id_ for lv in loaded.user_votes(u0)) == \
+                sorted(lv.link.id_ for lv in pool.user_votes(pool.get_user(0)))
+
+            assert sorted(u.id_ for u in loaded.users) == sorted(u.id_ for u in pool.users)
+            for link in loaded.links:
+                orig = pool.get_link(link.id_)
+                assert abs(link.quality - orig.quality) < 1e-12
+                assert (link.up_vote_count, link.down_vote_count) == (orig.up_vote_count, orig.down_vote_count)
+
+            # Loaded state keeps updating, and the snapshot is not changed
+            _vote_all(loaded, votes[:3])
+            _vote_all(pool, votes[:3])
+            assert abs(loaded.get_link(100).quality - pool.get_link(100).quality) < 1e-12
+            # Compare the next round with a fresh load, it fails if the snapshot files were changed
+            pool = ResourcePool.load(path, user_constr, link_constr)
+
+
+def test_sharded_bayes():
+    """Sharded bayes model matches the single process one when reliabilities are synced every vote"""
+    votes = [(i % 5, 100 + i % 7, VoteDir.UP if i % 3 else VoteDir.DOWN) for i in range(40)]
+
+    # Votes again replace earlier votes of the same link
+    engine = BayesEngine()
+    for v in votes:
+        engine.vote(*v)
+    pool = engine.pool
+
+    with ShardedBayes(shard_count=3) as sharded:
+        for v in votes:
+            sharded.vote(*v)
+
+        qualities = sharded.link_qualities()
+        assert sorted(qualities) == sorted(link.id_ for link in pool.links)
+        for link in pool.links:
+            assert abs(qualities[link.id_] - link.quality) < 1e-9
+        for user in pool.users:
+            assert abs(sharded.get_user(user.id_).reliability - user.reliability) < 1e-9
+        assert abs(sharded.link_quality(100) - pool.get_link(100).quality) < 1e-9
+        assert sorted(u.id_ for u in sharded.users) == sorted(u.id_ for u in pool.users)
+
+        # An error in a shard comes back, and the shard keeps serving
+        try:
+            sharded._request([(0, 'nothing', None)])
+            assert False, 'No error'
+        except RuntimeError as e:
+            assert 'KeyError' in str(e)
+        assert abs(sharded.link_quality(100) - pool.get_link(100).quality) < 1e-9
+        sharded.vote(0, 100, VoteDir.UP)
+        engine.vote(0, 100, VoteDir.UP)
+        assert abs(sharded.link_quality(100) - pool.get_link(100).quality) < 1e-9
+        assert abs(sharded.get_user(0).reliability - pool.get_user(0).reliability) < 1e-9
+
+
+def test_refit():
+    """Refit finds good / bad links and ranks reliable users first"""
+    votes = []
+    for user_id in range(6):
+        for link_id in range(12):
+            good = link_id < 8
+            # Users with larger id vote against link quality more often
+            honest = (user_id * 7 + link_id) % 12 >= user_id
+            up = good if honest else not good
+            votes.append((user_id, link_id, VoteDir.UP if up else VoteDir.DOWN))
+
+    for columnar_votes in (False, True):
+        engine = BayesEngine(columnar_votes=columnar_votes)
+        pool = engine.pool
+        _vote_all(pool, votes)
+        ranking = RankingIndex(pool)
+        assert refit(pool) < 100
+
+        for link in pool.links:
+            assert (link.quality > 0.5) == (link.id_ < 8)
+        relis = [pool.get_user(user_id).reliability for user_id in range(6)]
+        assert relis[0] > relis[-1]
+        # Quality listeners follow the refit qualities
+        assert ranking.top_k(12) == sorted(((link.id_, link.quality) for link in pool.links),
+                                           key=lambda lq: (-lq[1], lq[0]))
+
+        # Votes are retracted as refit counted them, both ends go back to their priors
+        for link_id in range(12):
+            engine.retract_vote(0, link_id)
+        for user_id in range(1, 6):
+            engine.retract_vote(user_id, 11)
+        assert abs(pool.get_user(0).reliability - 0.505) < 1e-9
+        assert abs(pool.get_link(11).quality - 0.505) < 1e-9
+
+
+def test_vote_service(tmp_path):
+    """Votes sent to the service are committed in batches and queries see them"""
+    pool = ResourcePool(SUser, SLink)
+    batches = []
+
+    def vote_many(votes):
+        batches.append(len(votes))
+        _vote_all(pool, votes)
+
+    service = VoteService(vote_many, pool, max_batch=8, queue_size=4)
+    path = str(tmp_path / 'vote.sock')
+
+    async def client(server_started: asyncio.Event):
+        await server_started.wait()
+        reader, writer = await asyncio.open_unix_connection(path)
+        votes = [{'op': 'vote', 'user_id': i, 'link_id': 1, 'dir': 'UP' if i % 4 else 'DOWN'} for i in range(20)]
+        # Queries are answered from committed state, send them after votes are acknowledged
+        queries = [{'op': 'quality', 'link_id': 1}, {'op': 'stats'}, {'op': 'nothing'},
+                   {'op': 'quality', 'link_id': 2}, {'op': 'reliability', 'user_id': 20}]
+        resps = []
+        for reqs in (votes, queries):
+            for req in reqs:
+                writer.write((json.dumps(req) + '\n').encode())
+            await writer.drain()
+            resps += [json.loads(await reader.readline()) for _ in reqs]
+        writer.close()
+        await writer.wait_closed()
+        return resps
+
+    async def run():
+        started = asyncio.Event()
+        server = asyncio.create_task(service.serve(path=path, started=lambda _: started.set()))
+        resps = await client(started)
+        server.cancel()
+        await asyncio.gather(server, return_exceptions=True)
+        return resps
+
+    resps = asyncio.run(run())
+    assert resps[:20] == [{'ok': True}] * 20
+    assert resps[20] == {'quality': 15 / 20}
+    assert resps[21]['votes'] == 20 and resps[21]['latency_p99_ms'] >= resps[21]['latency_p50_ms']
+    assert 'error' in resps[22]
+    assert resps[23:] == [{'quality': None, 'unknown': True}, {'reliability': None, 'unknown': True}]
+    # Unknown ids are not created by queries
+    assert pool.find_link(2) is None and pool.find_user(20) is None
+    assert pool.find_user(19) is pool.get_user(19)
+    assert sum(batches) == 20 and max(batches) <= 8
+
+
+def test_stale_reliability():
+    """Stale reliability is recomputed once when it is read"""
+    user = SUser(0)
+    calls = []
+
+    def refresh(u: SUser):
+        calls.append(u.id_)
+        u.reliability = 0.75
+
+    user.mark_stale(refresh)
+    assert not calls
+    assert user.reliability == 0.75
+    assert user.reliability == 0.75
+    assert calls == [0]
+
+    # Lazy reliabilities match eager ones on read and after flush
+    votes = [(u, 100 + lk, VoteDir.UP if (u * 5 + lk) % 4 else VoteDir.DOWN) for u in range(7) for lk in range(6)]
+    votes += [(u, 100, VoteDir.DOWN) for u in range(3)] + [(3, 101, VoteDir.UP)]
+    # Links tied by their final votes
+    votes += [(5, 200, VoteDir.UP), (6, 200, VoteDir.DOWN), (0, 201, VoteDir.UP), (1, 201, VoteDir.DOWN)]
+    # A tie following a judged vote, users 7 and 8 vote nowhere else
+    votes += [(7, 300, VoteDir.UP), (8, 300, VoteDir.DOWN)]
+    # Flips of a vote, breaking a tie, and ending in either direction
+    votes += [(2, 201, VoteDir.UP), (2, 201, VoteDir.DOWN), (4, 102, VoteDir.DOWN), (4, 102, VoteDir.UP),
+              (6, 103, VoteDir.DOWN), (6, 103, VoteDir.UP), (6, 103, VoteDir.DOWN)]
+    eager = SimpleEngine()
+    eager.vote_many(votes[:20])
+    for v in votes[20:]:
+        eager.vote(*v)
+    assert eager.pool.get_link(200).quality == eager.pool.get_link(300).quality == 0.5
+
+    for read in (True, False):
+        lazy = SimpleEngine(lazy_reliability=True)
+        lazy.vote_many(votes[:20])
+        for v in votes[20:]:
+            lazy.vote(*v)
+        assert len(lazy._dirty_users) == 9
+        if read:
+            for u in eager.pool.users:
+                assert lazy.pool.get_user(u.id_).reliability == u.reliability
+            # Reads refreshed the users, nothing is left to flush
+            assert not lazy._dirty_users
+        lazy.flush()
+        assert not lazy._dirty_users
+        for u in eager.pool.users:
+            assert lazy.pool.get_user(u.id_)._reliability == u.reliability
+
+
+def test_concurrent_votes():
+    """Votes of many threads through a concurrent engine give the results of a serial replay"""
+    user_cnt, link_cnt = 40, 25
+    votes = [(u, 100 + lk, VoteDir.UP if (u * 7 + lk) % 3 else VoteDir.DOWN)
+             for u in range(user_cnt) for lk in range(link_cnt)]
+    batches = [votes[i::16] for i in range(16)]
+
+    def vote_batch(engine, i_batch):
+        i, batch = i_batch
+        if i % 2:
+            engine.vote_many(batch)
+        else:
+            for v in batch:
+                engine.vote(*v)
+
+    def link_votes(link) -> list:
+        return sorted((v.user.id_, v.dir_.name) for v in link.votes)
+
+    old_interval = sys.getswitchinterval()
+    # Switch threads often to provoke races
+    sys.setswitchinterval(1e-6)
+    try:
+        for engine_constr, kwargs in ((SimpleEngine, {}), (SimpleEngine, {'lazy_reliability': True}),
+                                      (BayesEngine, {})):
+            serial = engine_constr(**kwargs)
+            for v in votes:
+                serial.vote(*v)
+
+            for columnar_votes in (False, True):
+                engine = engine_constr(columnar_votes=columnar_votes, concurrent=True, **kwargs)
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    list(executor.map(lambda b: vote_batch(engine, b), enumerate(batches)))
+
+                links = list(engine.pool.links)
+                assert len(links) == link_cnt and len(list(engine.pool.users)) == user_cnt
+                for link in links:
+                    serial_link = serial.pool.get_link(link.id_)
+                    assert (link.up_vote_count, link.down_vote_count) == \
+                        (serial_link.up_vote_count, serial_link.down_vote_count)
+                    assert link_votes(link) == link_votes(serial_link)
+                for u in engine.pool.users:
+                    serial_user = serial.pool.get_user(u.id_)
+                    assert (u.up_vote_count, u.down_vote_count) == \
+                        (serial_user.up_vote_count, serial_user.down_vote_count)
+                    assert len(list(engine.pool.user_votes(u))) == link_cnt
+
+                # Bayes results depend on vote order, simple ones do not
+                if engine_constr is SimpleEngine:
+                    for link in links:
+                        assert link.quality == serial.pool.get_link(link.id_).quality
+                    for u in engine.pool.users:
+                        assert u.reliability == serial.pool.get_user(u.id_).reliability
+    finally:
+        sys.setswitchinterval(old_interval)
+
+
+def test_tied_links_reset_reliability():
+    """A user whose voted links are all tied has no judged vote, and is back to the prior reliability"""
+    engine = SimpleEngine()
+    engine.vote_many([(0, 0, VoteDir.UP), (1, 0, VoteDir.DOWN), (0, 1, VoteDir.DOWN), (1, 1, VoteDir.UP)])
+    assert [engine.pool.get_user(i).reliability for i in (0, 1)] == [0.5, 0.5]
+
+    # A later tie drops the reliability judged by an earlier vote, lazy and eager modes agree
+    for lazy_reliability in (False, True):
+        engine = SimpleEngine(lazy_reliability=lazy_reliability)
+        engine.vote(0, 0, VoteDir.UP)
+        engine.vote(1, 0, VoteDir.DOWN)
+        assert [engine.pool.get_user(i).reliability for i in (0, 1)] == [0.5, 0.5]
+
+    # The flat prior of a bayes link is not tied, a down vote of this reliability ties it
+    engine = BayesSUserEngine()
+    engine.pool.get_user(0).reliability = 0.515
+    engine.vote(0, 0, VoteDir.DOWN)
+    assert abs(engine.pool.get_link(0).quality - 0.5) < 0.0001
+    assert engine.pool.get_user(0).reliability == 0.5
+
+
+def test_engines_side_by_side():
+    """Engines in one process do not share users and links"""
+    votes = [(u, 100 + lk, VoteDir.DOWN if u == 0 else VoteDir.UP) for u in (1, 2, 3, 4, 0) for lk in range(4)]
+    engines = [BayesEngine(), BayesEngine(), SimpleEngine(), BayesSUserEngine()]
+    for vote in votes:
+        for engine in engines:
+            engine.vote(*vote)
+
+    bayes, shadow, simple, bayes_suser = engines
+    for link in bayes.pool.links:
+        shadow_link = shadow.pool.get_link(link.id_)
+        assert shadow_link is not link
+        assert shadow_link.quality == link.quality
+    assert isinstance(simple.pool.get_user(0), SUser) and isinstance(bayes.pool.get_user(0), BUser)
+    assert isinstance(bayes_suser.pool.get_link(100), BLink)
+    assert simple.pool.get_user(0).reliability == 0.0
+    assert bayes_suser.pool.get_user(0).reliability == 0.0
+    assert bayes.pool.get_user(0).reliability < 0.5 < bayes.pool.get_user(1).reliability
+
+
+def test_ranking_index():
+    """Ranking index follows link qualities as votes are committed"""
+    engine = BayesEngine()
+    pool = engine.pool
+    engine.vote(0, 100, VoteDir.UP)
+    by_mean = RankingIndex(pool)
+    by_lower_bound = RankingIndex(pool, score=lower_bound_score(0.1))
+    assert by_mean.top_k(5) == [(100, pool.get_link(100).quality)]
+
+    votes = [(u, 100 + (u * 7 + i) % 30, VoteDir.UP if (u + i) % 3 else VoteDir.DOWN)
+             for u in range(20) for i in range(10)]
+    engine.vote_many(votes)
+    # Many votes for one link, so its lower bound is higher than a link with a single up vote
+    engine.vote_many([(u, 200, VoteDir.UP) for u in range(20)])
+    engine.vote(0, 201, VoteDir.UP)
+
+    for index in (by_mean, by_lower_bound):
+        links = list(pool.links)
+        assert len(index) == len(links)
+        exp = sorted(((link.id_, index._score(link)) for link in links), key=lambda t: (-t[1], t[0]))
+        assert index.top_k(len(links) + 5) == exp
+        assert index.top_k(3) == exp[:3]
+        for rank, (link_id, _) in enumerate(exp):
+            assert index.rank(link_id) == rank
+    assert by_lower_bound.rank(200) < by_lower_bound.rank(201)
+    assert by_mean.rank(999) is None
+
+
+def test_compact_objects():
+    """Users, links and votes have no per instance dict"""
+    for obj in (SUser(0), SLink(0), BUser(0), BLink(0), Vote(SUser(0), VoteDir.UP)):
+        assert not hasattr(obj, '__dict__')
+
+    res = measure(SUser, SLink, user_cnt=100, link_cnt=100, vote_cnt=500)
+    assert all(0 < n < 1000 for n in res.values())
+
+
+def test_workload(tmp_path):
+    """Generated votes follow the ground truth"""
+    spec = WorkloadSpec(user_count=300, link_count=50, votes_per_user=10, seed=1)
+    workload = Workload(spec)
+    chunks = list(workload.chunks(chunk_users=64))
+    assert len(chunks) == 5
+    user_ids = np.concatenate([c.user_ids for c in chunks])
+    link_ids = np.concatenate([c.link_ids for c in chunks])
+    dirs = np.concatenate([c.dirs for c in chunks])
+    assert len(set(zip(user_ids.tolist(), link_ids.tolist()))) == len(dirs)
+
+    truth = workload.truth
+    intended = (dirs == 1) == truth.link_is_good[link_ids]
+    assert np.array_equal(np.bincount(user_ids, weights=intended, minlength=300), truth.intended_cnt)
+    assert abs(np.nanmean(truth.simulated_reliability) - np.mean(truth.planned_reliability)) < 0.05
+
+    engine = BayesEngine()
+    for chunk in chunks:
+        engine.vote_many(chunk.tuples())
+    assert truth.link_accuracy({link.id_: link.quality for link in engine.pool.links}) > 0.9
+    assert truth.reliability_mae({u.id_: u.reliability for u in engine.pool.users}) < 0.2
+
+    # Same seed, same votes
+    path = str(tmp_path / 'votes.bin')
+    Workload(spec).write(path, chunk_users=64)
+    assert [v for c in read_chunks(path) for v in c.votes] == [v for c in chunks for v in c.tuples()]
+
+
+def test_bench_case():
+    """Benchmark case reports throughput and accuracy, and slower results are regressions"""
+    spec = WorkloadSpec(user_count=100, link_count=20, votes_per_user=5)
+    results = [run_case(model, spec, batch_size=batch_size)
+               for model in ('simple', 'bayes', 'bayes_suser') for batch_size in (1, 50)]
+    for res in results:
+        assert res['votes_per_sec'] > 0 and res['latency_p50_ms'] <= res['latency_p99_ms']
+        assert 0 <= res['link_accuracy'] <= 1 and 0 <= res['reliability_mae'] <= 1
+    assert results[0]['link_accuracy'] > 0.9
+
+    baseline = {'version': 1, 'results': results}
+    slower = [dict(res, votes_per_sec=res['votes_per_sec'] / 2) for res in results[:2]]
+    assert not compare(baseline, baseline)
+    assert len(compare(baseline, {'version': 1, 'results': slower})) == 2
+
+
+def test_instrument():
+    """Instrumentation counts hot path calls only when enabled"""
+    commit_vote = BLink.commit_vote
+    engine = BayesEngine()
+    votes = [(u, 100 + u % 3, VoteDir.UP) for u in range(10)]
+    with instrument.instrumented():
+        assert BLink.commit_vote is not commit_vote
+        engine.vote_many(votes[:6])
+        for vote in votes[6:]:
+            engine.vote(*vote)
+        snap = instrument.snapshot()
+    assert BLink.commit_vote is commit_vote and not instrument.is_enabled()
+
+    counters = snap['counters']
+    assert counters['votes_committed'] == 10
+    # A link update and a user update for each vote, and quality without each vote of vote_many
+    assert counters['likelihood'] == 10 + 10 + 6
+    # Links are normalized once per commit, users only when their vote can be judged
+    assert 7 <= counters['normalize'] <= 7 + 10
+    timers = snap['timers']
+    assert timers['commit_vote']['count'] == 3 + 4
+    assert timers['bayes.vote']['count'] == 4 and timers['bayes.vote_many']['count'] == 1
+    assert sum(timers['update_reliability']['histogram_us'].values()) == 10
+    json.dumps(snap)
+
+    engine.vote(0, 100, VoteDir.DOWN)
+    assert instrument.snapshot() == snap
+
+
+def test_beta_link():
+    """Beta approximated link quality follows the grid posterior"""
+    rng = np.random.default_rng(3)
+    grid, beta = BLink(0), BetaLink(0)
+    assert abs(grid.quality - beta.quality) < 1e-9
+    for i in range(40):
+        user = SUser(i)
+        user.reliability = float(rng.uniform(0.5, 1.0))
+        vote = Vote(user, VoteDir.UP if rng.random() < 0.7 else VoteDir.DOWN)
+        for link in (grid, beta):
+            link.add_vote(vote)
+            link.commit_vote()
+        assert abs(grid.quality - beta.quality) < 0.02
+        assert abs(grid.quality_without(vote) - beta.quality_without(vote)) < 0.02
+    assert not beta.is_grid and abs(grid.variance - beta.variance) < 1e-3
+
+    # Beta like state is restored as Beta, a bimodal one as grid
+    restored = BetaLink(1)
+    restored.restore_state(grid.state())
+    assert not restored.is_grid and abs(restored.quality - grid.quality) < 0.01
+    bimodal = np.zeros(100)
+    bimodal[[10, 90]] = 0.5
+    with np.errstate(divide='ignore'):
+        restored.restore_state(np.log(bimodal))
+    assert restored.is_grid and restored.alpha_beta is None and abs(restored.quality - 0.51) < 1e-9
+
+
+def test_grid_config(tmp_path):
+    """Grid size, float32 probabilities and pruning"""
+    rng = np.random.default_rng(5)
+    grids = (GridConfig(), GridConfig(size=400), GridConfig(dtype=np.float32), GridConfig(prune_eps=1e-9))
+    links = [BLink(0, grid=grid) for grid in grids]
+    for i in range(200):
+        user = SUser(i)
+        user.reliability = 0.9
+        vote = Vote(user, VoteDir.UP if rng.random() < 0.8 else VoteDir.DOWN)
+        for link in links:
+            link.add_vote(vote)
+            link.commit_vote()
+
+    full, fine, f32, pruned = links
+    assert len(fine.posterior.hypos) == 400 and abs(fine.quality - full.quality) < 0.01
+    assert f32.posterior.probs.dtype == np.float32 and abs(f32.quality - full.quality) < 1e-4
+    assert len(pruned.posterior.hypos) < 100 and abs(pruned.quality - full.quality) < 1e-6
+    # State is always on the whole grid
+    state = pruned.state()
+    assert len(state) == 100 and np.isneginf(state).sum() == 100 - len(pruned.posterior.hypos)
+
+    engine = BayesEngine(grid=GridConfig(size=50, dtype=np.float32))
+    engine.vote(0, 0, VoteDir.UP)
+    assert engine.pool.get_link(0).state().dtype == np.float32
+    engine.pool.save(str(tmp_path / 'snap'))
+    loaded = BayesEngine.load(str(tmp_path / 'snap'), grid=GridConfig(size=50, dtype=np.float32))
+    assert loaded.pool.get_link(0).quality == engine.pool.get_link(0).quality
+
+
+def test_retract_vote():
+    """A vote again or a retracted vote is removed from the posterior"""
+    users = [SUser(i) for i in range(10)]
+    for i, u in enumerate(users):
+        u.reliability = 0.6 + 0.04 * i
+
+    def link_of(votes: list[Vote], link_constr=BLink) -> BLink:
+        link = link_constr(0)
+        link.add_votes(votes)
+        link.commit_vote()
+        return link
+
+    votes = [Vote(u, VoteDir.UP if u.id_ % 3 else VoteDir.DOWN) for u in users]
+    # Beta approximated links switch to grid, and are close only
+    for link_constr, tol in ((BLink, 1e-9), (BetaLink, 0.02)):
+        link = link_of(votes, link_constr)
+        link.add_vote(Vote(users[3], VoteDir.UP))
+        link.commit_vote()
+        final = votes[:3] + [Vote(users[3], VoteDir.UP)] + votes[4:]
+        assert abs(link.quality - link_of(final).quality) < tol
+        assert link.down_vote_count == 3
+
+        assert link.retract_vote(users[5]) is votes[5] and link.retract_vote(users[5]) is None
+        assert abs(link.quality - link_of(final[:5] + final[6:]).quality) < tol
+
+    # Retracted votes leave the vote store and the user votes index
+    engine = BayesEngine(columnar_votes=True)
+    engine.vote_many([(0, 0, VoteDir.UP), (1, 0, VoteDir.DOWN), (0, 1, VoteDir.UP)])
+    assert engine.retract_vote(0, 0).dir_ == VoteDir.UP
+    assert len(engine.pool.vote_store) == 2 and engine.pool.get_link(0).up_vote_count == 0
+    assert [lv.link.id_ for lv in engine.pool.user_votes(engine.pool.get_user(0))] == [1]
+    assert engine.pool.vote_store.user_link_ids(0) == [1] and not engine.pool._user_link_index
+    assert engine.retract_vote(0, 0) is None
+
+    # Evidence of a vote again or a retracted vote is removed from the user reliability
+    engine = BayesEngine()
+    engine.vote_many([(i, 0, VoteDir.UP) for i in range(1, 5)])
+    prior = engine.pool.get_user(0).reliability
+    engine.vote(0, 0, VoteDir.UP)
+    reliability = engine.pool.get_user(0).reliability
+    assert reliability > prior
+    engine.vote(0, 0, VoteDir.DOWN)
+    engine.vote(0, 0, VoteDir.UP)
+    assert abs(engine.pool.get_user(0).reliability - reliability) < 1e-9
+    engine.retract_vote(0, 0)
+    assert abs(engine.pool.get_user(0).reliability - prior) < 1e-9
+
+    # A retracted vote is removed with the reversibility it was committed with, also from columns,
+    # though the reliability of its user has changed since
+    for engine_constr, tol in ((BayesEngine, 1e-9), (BayesBetaEngine, 0.01)):
+        for columnar_votes in (False, True):
+            engine = engine_constr(columnar_votes=columnar_votes)
+            for user_id, dir_ in ((1, VoteDir.UP), (2, VoteDir.UP), (3, VoteDir.DOWN)):
+                engine.vote(user_id, 0, dir_)
+            quality = engine.pool.get_link(0).quality
+            reliabilities = [u.reliability for u in engine.pool.users]
+            engine.vote(4, 0, VoteDir.UP)
+            assert engine.pool.get_link(0).get_vote(engine.pool.get_user(4)).reliable is not None
+            engine.retract_vote(4, 0)
+            assert abs(engine.pool.get_link(0).quality - quality) < tol
+            assert np.allclose([u.reliability for u in engine.pool.users], reliabilities + [0.505], atol=1e-9)
+
+    engine = SimpleEngine()
+    engine.vote_many([(0, 0, VoteDir.UP), (1, 0, VoteDir.DOWN), (2, 0, VoteDir.UP)])
+    engine.retract_vote(2, 0)
+    assert engine.pool.get_link(0).quality == 0.5
+
+    # Retracting a vote of an unknown user or link creates neither
+    assert engine.retract_vote(9, 0) is None and engine.retract_vote(0, 9) is None
+    assert sorted(u.id_ for u in engine.pool.users) == [0, 1, 2] and [lk.id_ for lk in engine.pool.links] == [0]
+
+
+def test_report(tmp_path):
+    """Summaries follow running tallies, and are exported in chunks"""
+    engine = BayesEngine(columnar_votes=True)
+    engine.vote_many([(0, 0, VoteDir.UP), (1, 0, VoteDir.DOWN), (0, 1, VoteDir.UP), (2, 1, VoteDir.UP)])
+    engine.vote(0, 1, VoteDir.DOWN)
+    engine.retract_vote(2, 1)
+
+    users = {s.id_: s for s in user_summaries(engine.pool)}
+    assert (users[0].votes, users[0].up, users[0].down) == (2, 1, 1)
+    assert users[2].votes == 0 and users[0].reliability == engine.pool.get_user(0).reliability
+    links = {s.id_: s for s in link_summaries(engine.pool)}
+    assert (links[1].up, links[1].down) == (0, 1)
+
+    csv_path, jsonl_path = str(tmp_path / 'users.csv'), str(tmp_path / 'links.jsonl')
+    assert export(csv_path, user_summaries(engine.pool), chunk_size=2) == 3
+    with open(csv_path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert lines[0] == 'id_,votes,up,down,reliability' and len(lines) == 4
+    assert export(jsonl_path, link_summaries(engine.pool)) == 2
+    with open(jsonl_path, encoding='utf-8') as f:
+        rows = [json.loads(line) for line in f]
+    assert rows[1] == {'id_': 1, 'up': 0, 'down': 1, 'quality': links[1].quality}
+
+    # No lock is held while a consumer holds a summary
+    engine = BayesEngine(concurrent=True)
+    engine.vote(0, 0, VoteDir.UP)
+
+    def try_lock(lock) -> bool:
+        if lock.acquire(blocking=False):
+            lock.release()
+            return True
+        return False
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for summaries, obj in ((user_summaries(engine.pool), engine.pool.get_user(0)),
+                               (link_summaries(engine.pool), engine.pool.get_link(0))):
+            assert next(summaries).id_ == 0
+            assert executor.submit(try_lock, obj.lock).result()
+
+
+def test_vote_order_sensitivity():
+    """Replays in worker processes give the same spreads as replays in this process"""
+    workload = Workload(WorkloadSpec(user_count=30, link_count=10, votes_per_user=5, seed=2))
+    votes = list(workload.votes())
+    res = analyze('bayes', votes, permutations=6, workers=0, seed=1)
+    assert res.links.ids.tolist() == sorted({v[1] for v in votes})
+    assert np.all(res.links.min <= res.links.mean) and np.all(res.links.mean <= res.links.max)
+    # Bayes model depends on vote order
+    assert res.users.std.max() > 0
+
+    in_workers = analyze('bayes', votes, permutations=6, workers=1, seed=1)
+    np.testing.assert_allclose(in_workers.links.mean, res.links.mean)
+    np.testing.assert_allclose(in_workers.users.std, res.users.std)
+
+
+def test_credible_interval():
+    """Percentiles are searched in a cumulative sum cached until the posterior changes"""
+    users = [SUser(i) for i in range(20)]
+    link = BLink(0)
+    for u in users:
+        u.reliability = 0.8
+        link.add_vote(Vote(u, VoteDir.UP if u.id_ % 4 else VoteDir.DOWN))
+    link.commit_vote()
+
+    def ref_percentile(q: float) -> float:
+        # Smallest hypothesis whose cumulative probability reaches q percent
+        total = 0.0
+        for hypo, p in sorted(link.posterior.d.items()):
+            total += p
+            if total >= q / 100 - 1e-12:
+                return hypo
+        return max(link.posterior.d)
+
+    for q in (0, 5, 50, 95, 100):
+        assert abs(link.percentile(q) - ref_percentile(q)) < 1e-9
+    lo, hi = link.credible_interval(0.9)
+    assert (lo, hi) == (link.percentile(5), link.percentile(95)) and lo < link.quality < hi
+
+    cdf = link._summary._get_cdf()
+    assert link._summary._get_cdf() is cdf
+    link.add_vote(Vote(SUser(99), VoteDir.UP))
+    link.commit_vote()
+    assert link._summary._get_cdf() is not cdf
+
+    user = BUser(0)
+    assert user.credible_interval(0.5) == (user.percentile(25), user.percentile(75))
+    beta = BetaLink(0)
+    assert abs(beta.percentile(50) - BLink(0).percentile(50)) < 0.02
+
+
+def test_update_many_votes():
+    """Likelihoods of thousands of votes in one update do not underflow"""
+    users = [SUser(i) for i in range(2500)]
+    for u in users:
+        u.reliability = 0.9
+    votes = [Vote(u, VoteDir.UP if u.id_ % 5 else VoteDir.DOWN) for u in users]
+    batch, serial = LinkQuality(name='batch'), LinkQuality(name='serial')
+    batch.UpdateSet(votes)
+    for v in votes:
+        serial.Update(v)
+    assert abs(batch.Mean() - serial.Mean()) < 1e-9
+
+    engine = BayesEngine()
+    engine.vote_many([(u, 0, VoteDir.UP) for u in range(2100)])
+    assert engine.pool.get_link(0).quality > 0.9